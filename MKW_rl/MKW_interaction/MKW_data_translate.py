@@ -12,7 +12,6 @@ import math
 from typing import TypedDict
 import os, sys
 sys.path.append(os.path.expanduser("~") + "\\AppData\\Local\\programs\\python\\python312\\lib\\site-packages")
-import flatdict
 from config_files import config_copy
 import numpy as np
 from enum import Enum
@@ -120,471 +119,3 @@ class Game_Data(TypedDict, total=False):
     trickable_timer: int
     surface_properties: SurfaceProperties
     airtime: int
-
-float_input_mean = [
-    0.9, # A
-    0.1, # B
-    0.1, # Dpad Up
-    0, # StickX
-    0, # StickY
-    0.5, # TriggerLeft
-    0.5, # TriggerRight
-    0.9, # A
-    0.1, # B
-    0.1, # Dpad Up
-    0, # StickX
-    0, # StickY
-    0.5, # TriggerLeft
-    0.5, # TriggerRight
-    0.9, # A
-    0.1, # B
-    0.1, # Dpad Up
-    0, # StickX
-    0, # StickY
-    0.5, # TriggerLeft
-    0.5, # TriggerRight
-    0.9, # A
-    0.1, # B
-    0.1, # Dpad Up
-    0, # StickX
-    0, # StickY
-    0.5, # TriggerLeft
-    0.5, # TriggerRight
-    0.9, # A
-    0.1, # B
-    0.1, # Dpad Up
-    0, # StickX
-    0, # StickY
-    0.5, # TriggerLeft
-    0.5, # TriggerRight
-    # End ugly ugly input listing
-    75, # mt_charge
-    20, # smt_charge
-    3, # ssmt_charge
-    30, # mt_boost
-    0, # trick_boost
-    30, # shroom_boost
-    0.0, # position.x
-    10000.0, # position.y
-    0.0, # position.z
-    0.0, # rotation.x
-    0.0, # rotation.y
-    0.0, # rotation.z
-    0.0, # rotation.w
-    60.0, # speed_norm
-    40.0, # external_velocity.x
-    10.0, # external_velocity.y
-    40.0, # external_velocity.z
-    60.0, # internal_velocity.x
-    10.0, # internal_velocity.y
-    60.0, # internal_velocity.z
-    0.0, # moving_road_velocity.x
-    0.0, # moving_road_velocity.y
-    0.0, # moving_road_velocity.z
-    0.0, # moving_water_velocity.x
-    0.0, # moving_water_velocity.y
-    0.0, # moving_water_velocity.z
-    5, # wheelie_cooldown
-    5, # trick_cooldown
-    0.5, # lap_completion
-    2.0, # race_completion
-    2.0, # race_completion_max
-    10, # checkpoint_id
-    3, # current_key_checkpoint
-    3, # max_key_checkpoint
-    2, # driving_direction
-    1, # item_count
-    60, # race_time
-    2, # state
-    0.8, # start_boost_charge -- average value over an entire rollout
-    2, # trickable_timer
-    2, # surface_properties
-    10, # airtime
-    # ==================== BEGIN 40 CP =====================
-    # -6423.899 1434.1862 19811.404
-    -6423.899,
-    1434.1862,
-    19811.404,
-    -6423.899,
-    1434.1862,
-    19811.404,
-    -6423.899,
-    1434.1862,
-    19811.404,
-    -6423.899,
-    1434.1862,
-    19811.404,
-    -6423.899,
-    1434.1862,
-    19811.404,
-    -6423.899,
-    1434.1862,
-    19811.404,
-    -6423.899,
-    1434.1862,
-    19811.404,
-    -6423.899,
-    1434.1862,
-    19811.404,
-    -6423.899,
-    1434.1862,
-    19811.404,
-    -6423.899,
-    1434.1862,
-    19811.404,
-    -6423.899,
-    1434.1862,
-    19811.404,
-    -6423.899,
-    1434.1862,
-    19811.404,
-    -6423.899,
-    1434.1862,
-    19811.404,
-    -6423.899,
-    1434.1862,
-    19811.404,
-    -6423.899,
-    1434.1862,
-    19811.404,
-    -6423.899,
-    1434.1862,
-    19811.404,
-    -6423.899,
-    1434.1862,
-    19811.404,
-    -6423.899,
-    1434.1862,
-    19811.404,
-    -6423.899,
-    1434.1862,
-    19811.404,
-    -6423.899,
-    1434.1862,
-    19811.404,
-    -6423.899,
-    1434.1862,
-    19811.404,
-    -6423.899,
-    1434.1862,
-    19811.404,
-    -6423.899,
-    1434.1862,
-    19811.404,
-    -6423.899,
-    1434.1862,
-    19811.404,
-    -6423.899,
-    1434.1862,
-    19811.404,
-    -6423.899,
-    1434.1862,
-    19811.404,
-    -6423.899,
-    1434.1862,
-    19811.404,
-    -6423.899,
-    1434.1862,
-    19811.404,
-    -6423.899,
-    1434.1862,
-    19811.404,
-    -6423.899,
-    1434.1862,
-    19811.404,
-    -6423.899,
-    1434.1862,
-    19811.404,
-    -6423.899,
-    1434.1862,
-    19811.404,
-    -6423.899,
-    1434.1862,
-    19811.404,
-    -6423.899,
-    1434.1862,
-    19811.404,
-    -6423.899,
-    1434.1862,
-    19811.404,
-    -6423.899,
-    1434.1862,
-    19811.404,
-    -6423.899,
-    1434.1862,
-    19811.404,
-    -6423.899,
-    1434.1862,
-    19811.404,
-    -6423.899,
-    1434.1862,
-    19811.404,
-    -6423.899,
-    1434.1862,
-    19811.404,
-    # ====================  END  40 CP =====================
-]
-
-float_input_deviation = [
-    1, # A
-    1, # B
-    1, # Dpad Up
-    2, # StickX
-    2, # StickY
-    1, # TriggerLeft
-    1, # TriggerRight
-    1, # A
-    1, # B
-    1, # Dpad Up
-    2, # StickX
-    2, # StickY
-    1, # TriggerLeft
-    1, # TriggerRight
-    1, # A
-    1, # B
-    1, # Dpad Up
-    2, # StickX
-    2, # StickY
-    1, # TriggerLeft
-    1, # TriggerRight
-    1, # A
-    1, # B
-    1, # Dpad Up
-    2, # StickX
-    2, # StickY
-    1, # TriggerLeft
-    1, # TriggerRight
-    1, # A
-    1, # B
-    1, # Dpad Up
-    2, # StickX
-    2, # StickY
-    1, # TriggerLeft
-    1, # TriggerRight
-    # End ugly ugly input list
-    270, # mt_charge
-    270, # smt_charge
-    75, # ssmt_charge
-    141, # mt_boost
-    100, # trick_boost
-    90, # shroom_boost
-    250000.0, # position.x
-    25000.0, # position.y
-    250000.0, # position.z
-    2.0, # rotation.x
-    2.0, # rotation.y
-    2.0, # rotation.z
-    2.0, # rotation.w
-    180.0, # speed_norm
-    120.0, # external_velocity.x
-    120.0, # external_velocity.y
-    120.0, # external_velocity.z
-    120.0, # internal_velocity.x
-    120.0, # internal_velocity.y
-    120.0, # internal_velocity.z
-    # Toad's factory conveyers
-    120.0, # moving_road_velocity.x
-    120.0, # moving_road_velocity.y
-    120.0, # moving_road_velocity.z
-    # Koopa Cape's water stream
-    120.0, # moving_water_velocity.x
-    120.0, # moving_water_velocity.y
-    120.0, # moving_water_velocity.z
-    20, # wheelie_cooldown
-    30, # trick_cooldown
-    1.0, # lap_completion
-    4.0, # race_completion
-    4.0, # race_completion_max
-    100, # checkpoint_id
-    15, # current_key_checkpoint
-    15, # max_key_checkpoint
-    4, # driving_direction
-    3, # item_count
-    360, # race_time
-    3, # state
-    1.0, # start_boost_charge
-    23, # trickable_timer
-    5, # surface_properties
-    240, # airtime -- note that this may be higher if you get more than 4 seconds of airtime but eh.
-    # ==================== BEGIN 40 CP =====================
-    # 40000  5000  60000
-    40000,
-    5000,
-    60000,
-    40000,
-    5000,
-    60000,
-    40000,
-    5000,
-    60000,
-    40000,
-    5000,
-    60000,
-    40000,
-    5000,
-    60000,
-    40000,
-    5000,
-    60000,
-    40000,
-    5000,
-    60000,
-    40000,
-    5000,
-    60000,
-    40000,
-    5000,
-    60000,
-    40000,
-    5000,
-    60000,
-    40000,
-    5000,
-    60000,
-    40000,
-    5000,
-    60000,
-    40000,
-    5000,
-    60000,
-    40000,
-    5000,
-    60000,
-    40000,
-    5000,
-    60000,
-    40000,
-    5000,
-    60000,
-    40000,
-    5000,
-    60000,
-    40000,
-    5000,
-    60000,
-    40000,
-    5000,
-    60000,
-    40000,
-    5000,
-    60000,
-    40000,
-    5000,
-    60000,
-    40000,
-    5000,
-    60000,
-    40000,
-    5000,
-    60000,
-    40000,
-    5000,
-    60000,
-    40000,
-    5000,
-    60000,
-    40000,
-    5000,
-    60000,
-    40000,
-    5000,
-    60000,
-    40000,
-    5000,
-    60000,
-    40000,
-    5000,
-    60000,
-    40000,
-    5000,
-    60000,
-    40000,
-    5000,
-    60000,
-    40000,
-    5000,
-    60000,
-    40000,
-    5000,
-    60000,
-    40000,
-    5000,
-    60000,
-    40000,
-    5000,
-    60000,
-    40000,
-    5000,
-    60000,
-    40000,
-    5000,
-    60000,
-    40000,
-    5000,
-    60000,
-    40000,
-    5000,
-    60000,
-    40000,
-    5000,
-    60000,
-    # ==================== END   40 CP =====================
-]
-
-class Network_Inputs():
-    def __init__(self, game_data: Game_Data, previous_actions_idx):
-        self.game_data = game_data
-        self.__flat_game_data = None
-        self.previous_actions_idx = previous_actions_idx
-
-    def get_input_dimensions(self):
-        previous_inputs_length = config_copy.n_prev_actions_in_inputs * 18
-        game_data_length = len(self.get_flattened_game_data())
-        
-        input_dimensions = previous_inputs_length + game_data_length
-        # Sanity check in case of bad programmers
-        assert game_data_length == len(float_input_deviation)
-        return input_dimensions
-    
-    def get_input_data(self):
-        previous_actions = [
-            # Get inputs from k for every k that we have not processed yet
-            config_copy.inputs[self.previous_actions_idx[k] if k >= 0 else config_copy.action_forward_idx]
-            for k in range(
-                len(self.previous_actions_idx) - config_copy.n_prev_actions_in_inputs, len(self.previous_actions_idx)
-            )
-        ]
-        unwrapped_actions = []
-        for dictionary in previous_actions:
-            for value in dictionary.values():
-                unwrapped_actions.append(value)
-        
-        return unwrapped_actions
-
-    def get_flattened_game_data(self):
-        if not self.__flat_game_data:
-            temp_game_data = self.game_data.copy()
-            for key in temp_game_data["kart_data"].keys():
-                value = temp_game_data["kart_data"][key]
-                if type(value) == vec3:
-                    temp_game_data["kart_data"][key] = [value.x, value.y, value.z]
-                elif type(value) == quatf:
-                    temp_game_data["kart_data"][key] = [value.x, value.y, value.z, value.w]
-            self.__flat_game_data = flatdict.FlatterDict(temp_game_data).values()
-        return self.__flat_game_data
-    
-
-def get_1d_state_floats(game_data, previous_actions_idx):
-    network_inputs = Network_Inputs(game_data, previous_actions_idx)
-
-    return np.hstack(
-        (
-            np.array(
-                network_inputs.get_input_data()
-            ),
-            np.array(
-                network_inputs.get_flattened_game_data() # includes relative zone centers
-            )
-        ),
-        dtype=np.float32
-    )
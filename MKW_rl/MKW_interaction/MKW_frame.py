@@ -0,0 +1,40 @@
+"""
+This file contains the frame preprocessing applied before frames are given to the network.
+It runs either in the game manager, or in the game instance hook when the manager asks for preprocessed frames,
+and must give byte-identical results in both places so that frames from either path can share a replay buffer.
+
+The Python environment embedded in Dolphin may not have OpenCV, so the grayscale conversion is always done with NumPy,
+using the same fixed-point arithmetic as OpenCV's 8-bit cvtColor.
+"""
+
+import numpy as np
+
+FRAME_WIDTH = 611
+FRAME_HEIGHT = 456
+# Keep one pixel out of FRAME_STRIDE in each direction
+FRAME_STRIDE = 4
+
+PREPROCESSED_FRAME_HEIGHT = -(-FRAME_HEIGHT // FRAME_STRIDE)
+PREPROCESSED_FRAME_WIDTH = -(-FRAME_WIDTH // FRAME_STRIDE)
+
+# OpenCV's RGB to gray coefficients for 8-bit images (BY15, GY15, RY15), scaled by 2**GRAY_SHIFT. The first channel is weighted as blue.
+GRAY_SHIFT = 15
+GRAY_WEIGHTS = np.array([3735, 19235, 9798], dtype=np.uint32)
+
+
+def grayscale_numpy(frame: np.ndarray) -> np.ndarray:
+    """
+    Same result as cv2.cvtColor(frame, cv2.COLOR_BGRA2GRAY) for a (H, W, 3) uint8 frame.
+    """
+    weighted = frame.astype(np.uint32) @ GRAY_WEIGHTS
+    return ((weighted + (1 << (GRAY_SHIFT - 1))) >> GRAY_SHIFT).astype(np.uint8)
+
+
+def preprocess_frame(frame: np.ndarray) -> np.ndarray:
+    """
+    frame is a numpy array of shape (FRAME_HEIGHT, FRAME_WIDTH, 3) and dtype np.uint8, as drawn by Dolphin.
+    Returns a numpy array of shape (1, PREPROCESSED_FRAME_HEIGHT, PREPROCESSED_FRAME_WIDTH) and dtype np.uint8.
+    """
+    # https://stackoverflow.com/questions/48121916/numpy-resize-rescale-image
+    resized_frame = frame[::FRAME_STRIDE, ::FRAME_STRIDE]
+    return np.expand_dims(grayscale_numpy(resized_frame), 0)
@@ -13,8 +13,10 @@ from mkw_scripts.Modules.mkw_classes import RaceConfig, RaceConfigScenario, Race
 from mkw_scripts.Modules.mkw_classes import KartObject, KartMove, KartSettings, KartBody
 from mkw_scripts.Modules.mkw_classes import VehicleDynamics, VehiclePhysics, KartBoost, KartJump
 from mkw_scripts.Modules.mkw_classes import KartState, KartCollide, KartInput, TimerManager
+from mkw_scripts.Modules.mkw_classes.common import read_bytes
 
 from MKW_rl.MKW_interaction.MKW_data_translate import *
+from MKW_rl.MKW_interaction.MKW_snapshot import GameStateSnapshot
 
 class MKW_Interface():
 	def __init__(self):
@@ -38,6 +40,9 @@ class MKW_Interface():
 		self.vehicle_dynamics: VehicleDynamics
 		self.vehicle_physics: VehiclePhysics
 
+		# Reads the whole game state each frame from the base addresses resolved in initialize_race_objects
+		self.snapshot = GameStateSnapshot(read_bytes=read_bytes)
+
 		"""if self.kart_move.is_bike:
 			text += f"Wheelie Length: {self.kart_move.wheelie_frames()}\n"
 			text += f"Wheelie CD: {self.kart_move.wheelie_cooldown()} | "
@@ -62,6 +67,24 @@ class MKW_Interface():
 		self.timer_manager = TimerManager(addr=self.race_mgr.timer_manager())
 		self.timer = Timer(self.timer_manager.timer())
 
+		self.snapshot.resolve(self.get_snapshot_base_addresses())
+
+	def get_snapshot_base_addresses(self):
+		return {
+			"vehicle_physics": self.vehicle_physics.addr,
+			"kart_move": self.kart_move.addr,
+			"kart_move_bike": self.kart_move.addr if self.kart_move.is_bike else None,
+			"kart_boost": self.kart_boost.addr,
+			"kart_jump": self.kart_jump.addr,
+			"kart_state": self.kart_state.addr,
+			"kart_collide": self.kart_collide.addr,
+			"race_manager": self.race_mgr.addr,
+			"race_manager_player": self.race_mgr_player.addr,
+			"timer": self.timer.addr,
+			# Item count and type are read relative to this pointer, see get_item_count
+			"item_holder": mkw_utils.chase_pointer(0x809c3618, [0x14], 'u32'),
+		}
+
 	def get_start_boost_charge(self):
 		return self.kart_state.start_boost_charge()
 	
@@ -204,10 +227,16 @@ class MKW_Interface():
 		# race_data["item_type"] = self.get_item_type()
 		return race_data
 
+	def get_game_data_snapshot(self):
+		# Same values as get_game_data_object, as a structured array with the fixed layout of self.snapshot.dtype
+		return self.snapshot.read()
+
 	def get_game_data_object(self) -> Game_Data:
-		# Note that the order here and within the called functions is important, as that is the order in which they are flattened.
-		# Thus, MKW_data_translate must match the ordering, especially in the float_input_mean and float_input_std variables.
-		# If I find a way to remove those variables I will remove them.
+		self.snapshot.read()
+		return self.snapshot.to_game_data()
+
+	def get_game_data_object_by_field(self) -> Game_Data:
+		# Reads every value with its own getter, GAME_DATA_FIELDS in MKW_snapshot must be kept in the same order.
 		game_data = Game_Data()
 		game_data["boost_data"] = self.get_boost_states()
 		game_data["kart_data"] = self.get_kart_data()
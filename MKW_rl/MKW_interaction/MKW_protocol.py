@@ -0,0 +1,197 @@
+"""
+This file defines the binary messages exchanged between the game manager and the game instance hook.
+
+Every message is sent with Connection.send_bytes, nothing is pickled:
+    - Requests (manager -> hook) are a fixed REQUEST_HEADER, followed by a payload: the start point and UTF-8 savestate path
+      for LOAD_STATE and SAVE_STATE (see MKW_savestates), and the shared memory description, if any, for HELLO.
+    - The hook answers a LOAD_STATE with the start point it actually loaded, as the savestate pool may have dropped it.
+      SAVE_STATE is not answered, and saves the state of the last frame reported to the manager.
+    - Replies to a STEP (hook -> manager) are the raw frame, then the game state record, each in its own message.
+      A STEP with hold_frames > 0 has the hook keep the inputs for that many frames without waiting for requests,
+      and reply for the frame after them.
+      The game state record is the fixed binary layout of GameStateSnapshot, so the hook sends it as read.
+    - On connection, the manager sends a HELLO and the hook answers with its protocol version and schema hash.
+      Both ends derive the schema from MKW_snapshot.GAME_DATA_FIELDS, so a mismatch means the two sides
+      were started from different versions of the field declarations and would disagree on the field order.
+    - If the HELLO has the PREPROCESS_FRAMES flag, the hook sends frames already downsampled and in grayscale.
+    - If the HELLO carries a SharedMemoryRing description, replies to a STEP are written to the next slot of the ring
+      instead, and the hook only sends SLOT_READY with the slot index.
+
+This file must not import the dolphin stubs, as it is used on both sides.
+"""
+
+import os
+import struct
+import zlib
+from enum import IntEnum, IntFlag
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from MKW_rl.MKW_interaction.MKW_savestates import RACE_START
+from MKW_rl.MKW_interaction.MKW_snapshot import MAX_BLOCK_GAP, GameStateSnapshot
+
+PROTOCOL_VERSION = 5
+
+# Order in which the inputs of an action are packed. Buttons are sent as 0.0 or 1.0.
+INPUT_KEYS = ("A", "B", "Up", "StickX", "StickY", "TriggerLeft", "TriggerRight")
+BUTTON_KEYS = ("A", "B", "Up")
+
+# command, flags, payload length, hold frames, inputs
+REQUEST_HEADER = struct.Struct(f"<BBHH{len(INPUT_KEYS)}f")
+# start point, followed by the savestate path
+SAVESTATE_KEY = struct.Struct("<i")
+# start point loaded
+LOAD_STATE_REPLY = struct.Struct("<i")
+# protocol version, schema hash, state record size
+HELLO_REPLY = struct.Struct("<HII")
+# number of slots, state record size, frame size, followed by the shared memory name
+SHARED_MEMORY_HELLO = struct.Struct("<III")
+# index of the slot the reply was written to
+SLOT_READY = struct.Struct("<I")
+
+
+class Command(IntEnum):
+    HELLO = 0
+    STEP = 1
+    LOAD_STATE = 2
+    SAVE_STATE = 3
+
+
+class RequestFlags(IntFlag):
+    NONE = 0
+    FRAME = 1
+    GAME_DATA = 2
+    INPUTS = 4
+    # Only meaningful in a HELLO: frames are sent preprocessed by MKW_frame.preprocess_frame instead of raw
+    PREPROCESS_FRAMES = 8
+
+
+class ProtocolMismatchError(Exception):
+    def __init__(self, message="The game instance hook and the game manager use different protocol versions or game data schemas"):
+        super().__init__(message)
+
+
+def schema_hash(snapshot: GameStateSnapshot) -> int:
+    declaration = repr(
+        (PROTOCOL_VERSION, MAX_BLOCK_GAP, INPUT_KEYS, [(field.name, field.base, field.offset, field.kind) for field in snapshot.fields])
+    )
+    return zlib.crc32(declaration.encode())
+
+
+def pack_request(
+    command: Command,
+    frame_request=False,
+    game_data_request=False,
+    inputs=None,
+    savestate_path=None,
+    start_point=RACE_START,
+    payload=b"",
+    flags=RequestFlags.NONE,
+    hold_frames=0,
+) -> bytes:
+    if frame_request:
+        flags |= RequestFlags.FRAME
+    if game_data_request:
+        flags |= RequestFlags.GAME_DATA
+    if inputs is not None:
+        flags |= RequestFlags.INPUTS
+        input_values = [float(inputs.get(key, 0)) for key in INPUT_KEYS]
+    else:
+        input_values = [0.0] * len(INPUT_KEYS)
+    if savestate_path is not None:
+        payload = SAVESTATE_KEY.pack(start_point) + savestate_path.encode()
+    return REQUEST_HEADER.pack(command, flags, len(payload), hold_frames, *input_values) + payload
+
+
+def unpack_request(message: bytes):
+    """
+    Returns (command, flags, inputs, payload, hold_frames). inputs is None when the request does not carry inputs.
+    """
+    command, flags, payload_length, hold_frames, *input_values = REQUEST_HEADER.unpack_from(message)
+    flags = RequestFlags(flags)
+    inputs = None
+    if flags & RequestFlags.INPUTS:
+        inputs = {key: (value != 0 if key in BUTTON_KEYS else value) for key, value in zip(INPUT_KEYS, input_values)}
+    payload = bytes(message[REQUEST_HEADER.size : REQUEST_HEADER.size + payload_length])
+    return Command(command), flags, inputs, payload, hold_frames
+
+
+def unpack_savestate_key(payload: bytes):
+    """
+    Returns (savestate_path, start_point) from the payload of a LOAD_STATE or SAVE_STATE request.
+    """
+    (start_point,) = SAVESTATE_KEY.unpack_from(payload)
+    return payload[SAVESTATE_KEY.size :].decode(), start_point
+
+
+def pack_hello_reply(snapshot: GameStateSnapshot) -> bytes:
+    return HELLO_REPLY.pack(PROTOCOL_VERSION, schema_hash(snapshot), snapshot.dtype.itemsize)
+
+
+def check_hello_reply(message: bytes, snapshot: GameStateSnapshot) -> None:
+    version, remote_schema_hash, state_size = HELLO_REPLY.unpack(message)
+    if version != PROTOCOL_VERSION or remote_schema_hash != schema_hash(snapshot) or state_size != snapshot.dtype.itemsize:
+        raise ProtocolMismatchError(
+            f"Game instance hook speaks protocol {version} with schema {remote_schema_hash:08x} ({state_size} bytes), "
+            f"game manager expects protocol {PROTOCOL_VERSION} with schema {schema_hash(snapshot):08x} ({snapshot.dtype.itemsize} bytes)"
+        )
+
+
+class SharedMemoryRing:
+    """
+    Ring of slots in shared memory, each holding one game state record followed by one raw frame.
+    The game manager creates the ring and describes it in its HELLO, the hook attaches to it.
+    Views returned by state() and frame() are zero-copy, and stay valid until the hook wraps around the ring.
+    """
+
+    SLOT_ALIGNMENT = 64
+
+    def __init__(self, n_slots: int, state_size: int, frame_size: int, name=None):
+        assert n_slots > 1
+        self.n_slots = n_slots
+        self.state_size = state_size
+        self.frame_size = frame_size
+        self.frame_offset = state_size + (-state_size) % SharedMemoryRing.SLOT_ALIGNMENT
+        self.slot_size = self.frame_offset + frame_size + (-frame_size) % SharedMemoryRing.SLOT_ALIGNMENT
+        self.next_slot = 0
+        if name is None:
+            self.shared_memory = shared_memory.SharedMemory(create=True, size=self.n_slots * self.slot_size)
+        else:
+            self.shared_memory = shared_memory.SharedMemory(name=name)
+            if os.name == "posix":
+                # Only the creator may unlink the ring, the resource tracker would otherwise unlink it when the hook exits
+                resource_tracker.unregister(self.shared_memory._name, "shared_memory")
+
+    @classmethod
+    def from_hello_payload(cls, payload: bytes) -> "SharedMemoryRing":
+        n_slots, state_size, frame_size = SHARED_MEMORY_HELLO.unpack_from(payload)
+        return cls(n_slots, state_size, frame_size, name=payload[SHARED_MEMORY_HELLO.size :].decode())
+
+    def hello_payload(self) -> bytes:
+        return SHARED_MEMORY_HELLO.pack(self.n_slots, self.state_size, self.frame_size) + self.shared_memory.name.encode()
+
+    def advance(self) -> int:
+        slot = self.next_slot
+        self.next_slot = (self.next_slot + 1) % self.n_slots
+        return slot
+
+    def state(self, slot: int) -> memoryview:
+        start = slot * self.slot_size
+        return self.shared_memory.buf[start : start + self.state_size]
+
+    def frame(self, slot: int) -> memoryview:
+        start = slot * self.slot_size + self.frame_offset
+        return self.shared_memory.buf[start : start + self.frame_size]
+
+    def state_array(self, slot: int, dtype: np.dtype) -> np.ndarray:
+        return np.ndarray((1,), dtype=dtype, buffer=self.shared_memory.buf, offset=slot * self.slot_size)
+
+    def frame_array(self, slot: int, shape) -> np.ndarray:
+        return np.ndarray(shape, dtype=np.uint8, buffer=self.shared_memory.buf, offset=slot * self.slot_size + self.frame_offset)
+
+    def close(self, unlink=False):
+        # Unlinked first, so that the ring is removed even if views of it are still alive and closing fails
+        if unlink:
+            self.shared_memory.unlink()
+        self.shared_memory.close()
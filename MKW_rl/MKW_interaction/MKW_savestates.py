@@ -0,0 +1,60 @@
+"""
+This file keeps savestates in memory in the game instance hook, so that races can be reset without reading from disk.
+
+Savestates are keyed by (savestate path, start point). The start point RACE_START is the state found in the savestate file
+itself, other start points are states saved by the hook during a race.
+The pool is bounded: when it is full, the least recently used savestate is dropped, and is read from its file again if needed.
+
+This file must not import the dolphin stubs, the savestate module is passed in by the hook.
+"""
+
+from collections import OrderedDict
+
+RACE_START = -1
+
+
+class SavestatePool:
+    def __init__(self, savestate_module, max_size: int):
+        assert max_size > 0
+        self.savestate = savestate_module
+        self.max_size = max_size
+        self.states = OrderedDict()
+
+    def __contains__(self, key) -> bool:
+        return key in self.states
+
+    def __len__(self) -> int:
+        return len(self.states)
+
+    def save(self, key):
+        """
+        Saves the current state of the game under key.
+        """
+        self.states[key] = self.savestate.save_to_bytes()
+        self.states.move_to_end(key)
+        while len(self.states) > self.max_size:
+            self.states.popitem(last=False)
+
+    def load(self, savestate_path: str, start_point: int = RACE_START):
+        """
+        Restores the savestate saved under (savestate_path, start_point).
+        Race starts missing from the pool are loaded from their file, then kept in the pool.
+        Returns the start point that was loaded, which is RACE_START when another start point is no longer in the pool.
+        """
+        key = (savestate_path, start_point)
+        if key not in self.states:
+            key = (savestate_path, RACE_START)
+        if key in self.states:
+            self.states.move_to_end(key)
+            self.savestate.load_from_bytes(self.states[key])
+            return key[1]
+
+        if savestate_path.startswith("__slot__"):
+            self.savestate.load_from_slot(int(savestate_path[8:]))
+        else:
+            self.savestate.load_from_file(savestate_path)
+        self.save(key)
+        return RACE_START
+
+    def clear(self):
+        self.states.clear()
@@ -0,0 +1,198 @@
+"""
+This file describes the per-frame game state as a flat list of (base object, offset, type) fields.
+The base addresses are resolved once per race, after which every frame is read in a handful of bulk memory reads
+straight into a preallocated NumPy structured array.
+
+This file must not import the dolphin stubs, so that the game manager can rebuild the exact same binary layout
+(GameStateSnapshot.dtype) without running inside dolphin. The hook passes the memory reading function in.
+"""
+
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional
+
+import numpy as np
+
+from MKW_rl.MKW_interaction.MKW_data_translate import Game_Data, SurfaceProperties, quatf, vec3
+
+# Fields closer than this are read in the same memory block. Bigger gaps are cheaper to skip with a second read.
+MAX_BLOCK_GAP = 0x20
+
+# kind: (size in bytes, big endian dtype as found in game memory)
+FIELD_KINDS = {
+    "u8": (1, ">u1"),
+    "u16": (2, ">u2"),
+    "u32": (4, ">u4"),
+    "s32": (4, ">i4"),
+    "f32": (4, ">f4"),
+    "vec3": (12, (">f4", (3,))),
+    "quatf": (16, (">f4", (4,))),
+}
+
+# Fields computed from other fields after every read, kind: native dtype
+DERIVED_KINDS = {
+    "f64": "=f8",
+    "bool": "?",
+}
+
+
+@dataclass(frozen=True)
+class SnapshotField:
+    # Dotted path of the value within Game_Data. Names starting with "_" are raw values only used by derived fields.
+    name: str
+    # Name of the object the offset is relative to, or None for derived fields
+    base: Optional[str]
+    offset: int
+    kind: str
+
+
+# The order here is the order of the game data in the float inputs of the network, see MKW_state_layout.
+GAME_DATA_FIELDS = (
+    SnapshotField("boost_data.mt_charge", "kart_move", 0xFE, "u16"),
+    SnapshotField("boost_data.smt_charge", "kart_move", 0x100, "u16"),
+    SnapshotField("boost_data.ssmt_charge", "kart_move", 0x14C, "u16"),
+    SnapshotField("boost_data.mt_boost", "kart_boost", 0x4, "u16"),
+    SnapshotField("boost_data.trick_boost", "kart_boost", 0xC, "u16"),
+    SnapshotField("boost_data.shroom_boost", "kart_boost", 0x8, "u16"),
+    SnapshotField("kart_data.position", "vehicle_physics", 0x68, "vec3"),
+    SnapshotField("kart_data.rotation", "vehicle_physics", 0xF0, "quatf"),
+    SnapshotField("kart_data.speed", "vehicle_physics", 0xE0, "f32"),
+    SnapshotField("kart_data.external_velocity", "vehicle_physics", 0x74, "vec3"),
+    SnapshotField("kart_data.internal_velocity", "vehicle_physics", 0x14C, "vec3"),
+    SnapshotField("kart_data.moving_road_velocity", "vehicle_physics", 0xB0, "vec3"),
+    SnapshotField("kart_data.moving_water_velocity", "vehicle_physics", 0xC8, "vec3"),
+    # Only bikes have a wheelie cooldown, the base is left unresolved (and the value 0) for karts
+    SnapshotField("kart_data.wheelie_cooldown", "kart_move_bike", 0x2B6, "u16"),
+    SnapshotField("kart_data.trick_cooldown", "kart_jump", 0x38, "u16"),
+    SnapshotField("race_data.lap_completion", "race_manager_player", 0x1C, "f32"),
+    SnapshotField("race_data.race_completion", "race_manager_player", 0xC, "f32"),
+    SnapshotField("race_data.race_completion_max", "race_manager_player", 0x10, "f32"),
+    SnapshotField("race_data.checkpoint_id", "race_manager_player", 0xA, "u16"),
+    SnapshotField("race_data.current_key_checkpoint", "race_manager_player", 0x27, "u8"),
+    SnapshotField("race_data.max_key_checkpoint", "race_manager_player", 0x28, "u8"),
+    SnapshotField("race_data.driving_direction", "kart_move", 0x23C, "u32"),
+    SnapshotField("race_data.item_count", "item_holder", 0x90, "s32"),
+    SnapshotField("race_data.race_time", None, 0, "f64"),
+    SnapshotField("race_data.state", "race_manager", 0x28, "u32"),
+    SnapshotField("start_boost_charge", "kart_state", 0x9C, "f32"),
+    SnapshotField("trickable_timer", "kart_state", 0xA6, "u16"),
+    SnapshotField("surface_properties", None, 0, "bool"),
+    SnapshotField("airtime", "kart_move", 0x218, "u32"),
+    SnapshotField("_timer.minutes", "timer", 0x4, "u16"),
+    SnapshotField("_timer.seconds", "timer", 0x6, "u8"),
+    SnapshotField("_timer.milliseconds", "timer", 0x8, "u16"),
+    SnapshotField("_surface_properties", "kart_collide", 0x2C, "u32"),
+)
+
+GAME_DATA_DERIVED = {
+    "race_data.race_time": lambda snapshot: (
+        snapshot["_timer.minutes"].astype(np.int64) * 60
+        + snapshot["_timer.seconds"]
+        + snapshot["_timer.milliseconds"] / 1000
+    ),
+    "surface_properties": lambda snapshot: (snapshot["_surface_properties"] & SurfaceProperties.OFFROAD) > 0,
+}
+
+
+class GameStateSnapshot:
+    def __init__(
+        self,
+        fields=GAME_DATA_FIELDS,
+        derived: Dict[str, Callable] = GAME_DATA_DERIVED,
+        read_bytes: Optional[Callable[[int, int], bytes]] = None,
+    ):
+        """
+        Memory blocks and the record layout are computed once from the field declarations.
+        read_bytes is only needed to read from the game, the layout itself can be used anywhere.
+        """
+        self.fields = tuple(fields)
+        self.derived = [(name, derived[name]) for name in (field.name for field in self.fields) if name in derived]
+        self.read_bytes = read_bytes
+
+        # Group the fields of each base object into contiguous memory blocks
+        # block: [base, start offset, end offset, position in the record]
+        self.blocks = []
+        field_positions = {}
+        for field in sorted((field for field in self.fields if field.base is not None), key=lambda f: (f.base, f.offset)):
+            size = FIELD_KINDS[field.kind][0]
+            block = self.blocks[-1] if self.blocks else None
+            if block is None or block[0] != field.base or field.offset - block[2] > MAX_BLOCK_GAP:
+                block = [field.base, field.offset, field.offset, 0]
+                self.blocks.append(block)
+            block[2] = max(block[2], field.offset + size)
+            field_positions[field.name] = (block, field.offset)
+
+        record_size = 0
+        for block in self.blocks:
+            block[3] = record_size
+            record_size += block[2] - block[1]
+
+        names, formats, offsets = [], [], []
+        for field in self.fields:
+            names.append(field.name)
+            if field.base is None:
+                formats.append(np.dtype(DERIVED_KINDS[field.kind]))
+                record_size += (-record_size) % formats[-1].alignment
+                offsets.append(record_size)
+                record_size += formats[-1].itemsize
+            else:
+                block, offset = field_positions[field.name]
+                formats.append(FIELD_KINDS[field.kind][1])
+                offsets.append(block[3] + offset - block[1])
+        self.dtype = np.dtype({"names": names, "formats": formats, "offsets": offsets, "itemsize": record_size})
+
+        self.buffer = bytearray(self.dtype.itemsize)
+        self.array = np.frombuffer(self.buffer, dtype=self.dtype)
+        # (address, size, position in the record) of every block whose base object was resolved
+        self.block_reads = []
+
+    def resolve(self, base_addresses: Dict[str, Optional[int]]):
+        """
+        Should be called once per race, when the game objects are (re)created.
+        Blocks whose base object is missing or None are not read and keep the value 0.
+        """
+        self.buffer[:] = bytes(len(self.buffer))
+        self.block_reads = [
+            (base_addresses[base] + start, end - start, position)
+            for base, start, end, position in self.blocks
+            if base_addresses.get(base) is not None
+        ]
+
+    def read(self) -> np.ndarray:
+        """
+        Reads the whole state for the current frame into the preallocated array, and returns that array.
+        """
+        buffer = self.buffer
+        for address, size, position in self.block_reads:
+            buffer[position : position + size] = self.read_bytes(address, size)
+        for name, derive in self.derived:
+            self.array[name] = derive(self.array)
+        return self.array
+
+    def from_bytes(self, data) -> np.ndarray:
+        """
+        View of a snapshot received as raw bytes, e.g. on the game manager side.
+        """
+        return np.frombuffer(data, dtype=self.dtype)
+
+    def to_game_data(self, snapshot: Optional[np.ndarray] = None) -> Game_Data:
+        """
+        Rebuilds the nested Game_Data dictionary from a snapshot, with the same types as the individual getters.
+        """
+        record = (self.array if snapshot is None else snapshot)[0]
+        game_data = Game_Data()
+        for field in self.fields:
+            if field.name.startswith("_"):
+                continue
+            value = record[field.name]
+            if field.kind == "vec3":
+                value = vec3(*value.tolist())
+            elif field.kind == "quatf":
+                value = quatf(*value.tolist())
+            else:
+                value = value.item()
+            *parents, key = field.name.split(".")
+            target = game_data
+            for parent in parents:
+                target = target.setdefault(parent, {})
+            target[key] = value
+        return game_data
@@ -0,0 +1,199 @@
+"""
+This file defines where each float given to the network lives in the float input vector:
+    - the previous actions, n_prev_actions_in_inputs times the inputs in MKW_protocol.INPUT_KEYS order, oldest first
+    - the game data, in MKW_snapshot.GAME_DATA_FIELDS order
+    - the zone centers ahead of the kart, relative to its position
+The layout is computed once, and values are written straight into preallocated float32 vectors.
+float_input_mean and float_input_deviation are generated from FLOAT_INPUT_NORMALIZATION, which gives them by field name.
+
+The last two parts form a "state_float" row, which is what rollouts record for each action (see rollout_recorder).
+The previous actions are added when states are given to the network, as they are a property of the rollout.
+"""
+
+from typing import Dict, Union
+
+import numpy as np
+
+from config_files import config_copy
+from MKW_rl.MKW_interaction.MKW_protocol import INPUT_KEYS
+from MKW_rl.MKW_interaction.MKW_snapshot import GAME_DATA_FIELDS
+
+Column = Union[int, slice]
+
+# Number of floats of the vector kinds of MKW_snapshot.FIELD_KINDS, every other kind is a single float
+VECTOR_WIDTHS = {"vec3": 3, "quatf": 4}
+
+# name: (mean, deviation). Vectors have one value per component. Previous actions are named after their input.
+# Zone centers are given for one zone center, and repeated for each.
+FLOAT_INPUT_NORMALIZATION = {
+    "previous_actions.A": (0.9, 1),
+    "previous_actions.B": (0.1, 1),
+    "previous_actions.Up": (0.1, 1),
+    "previous_actions.StickX": (0, 2),
+    "previous_actions.StickY": (0, 2),
+    "previous_actions.TriggerLeft": (0.5, 1),
+    "previous_actions.TriggerRight": (0.5, 1),
+    "boost_data.mt_charge": (75, 270),
+    "boost_data.smt_charge": (20, 270),
+    "boost_data.ssmt_charge": (3, 75),
+    "boost_data.mt_boost": (30, 141),
+    "boost_data.trick_boost": (0, 100),
+    "boost_data.shroom_boost": (30, 90),
+    "kart_data.position": ((0.0, 10000.0, 0.0), (250000.0, 25000.0, 250000.0)),
+    "kart_data.rotation": ((0.0, 0.0, 0.0, 0.0), (2.0, 2.0, 2.0, 2.0)),
+    "kart_data.speed": (60.0, 180.0),
+    "kart_data.external_velocity": ((40.0, 10.0, 40.0), (120.0, 120.0, 120.0)),
+    "kart_data.internal_velocity": ((60.0, 10.0, 60.0), (120.0, 120.0, 120.0)),
+    # Toad's factory conveyers
+    "kart_data.moving_road_velocity": ((0.0, 0.0, 0.0), (120.0, 120.0, 120.0)),
+    # Koopa Cape's water stream
+    "kart_data.moving_water_velocity": ((0.0, 0.0, 0.0), (120.0, 120.0, 120.0)),
+    "kart_data.wheelie_cooldown": (5, 20),
+    "kart_data.trick_cooldown": (5, 30),
+    "race_data.lap_completion": (0.5, 1.0),
+    "race_data.race_completion": (2.0, 4.0),
+    "race_data.race_completion_max": (2.0, 4.0),
+    "race_data.checkpoint_id": (10, 100),
+    "race_data.current_key_checkpoint": (3, 15),
+    "race_data.max_key_checkpoint": (3, 15),
+    "race_data.driving_direction": (2, 4),
+    "race_data.item_count": (1, 3),
+    "race_data.race_time": (60, 360),
+    "race_data.state": (2, 3),
+    "start_boost_charge": (0.8, 1.0),  # mean is the average value over an entire rollout
+    "trickable_timer": (2, 23),
+    "surface_properties": (2, 5),
+    "airtime": (10, 240),  # note that this may be higher if you get more than 4 seconds of airtime but eh.
+    "relative_zone_centers": ((-6423.899, 1434.1862, 19811.404), (40000, 5000, 60000)),
+}
+
+
+def shift_column(column: Column, offset: int) -> Column:
+    return column + offset if isinstance(column, int) else slice(column.start + offset, column.stop + offset)
+
+
+class StateLayout:
+    def __init__(self, inputs, n_prev_actions: int, n_zone_centers: int, action_forward_idx: int, fields=GAME_DATA_FIELDS):
+        # (n_actions, len(INPUT_KEYS)) float value of every input of every action, buttons as 0.0 or 1.0
+        self.action_floats = np.array([[float(action.get(key, 0)) for key in INPUT_KEYS] for action in inputs], dtype=np.float32)
+        self.n_prev_actions = n_prev_actions
+        self.action_forward_idx = action_forward_idx
+
+        # name: column(s) in the float input vector
+        self.columns: Dict[str, Column] = {}
+        self.previous_actions = slice(0, n_prev_actions * len(INPUT_KEYS))
+        self.columns["previous_actions"] = self.previous_actions
+        start = self.previous_actions.stop
+        game_data_paths = []
+        for field in fields:
+            if field.name.startswith("_"):
+                continue
+            width = VECTOR_WIDTHS.get(field.kind, 1)
+            column = start if width == 1 else slice(start, start + width)
+            self.columns[field.name] = column
+            game_data_paths.append(tuple(field.name.split(".")))
+            start += width
+        self.relative_zone_centers = slice(start, start + 3 * n_zone_centers)
+        self.columns["relative_zone_centers"] = self.relative_zone_centers
+        self.size = self.relative_zone_centers.stop
+
+        # Columns of a state_float row, i.e. of the float input vector without the previous actions
+        self.state_float = slice(self.previous_actions.stop, self.size)
+        self.state_float_size = self.state_float.stop - self.state_float.start
+        self.state_float_columns = {
+            name: shift_column(column, -self.state_float.start) for name, column in self.columns.items() if name != "previous_actions"
+        }
+        # (key path within Game_Data, column(s) in a state_float row) for every game data value
+        self.game_data_fields = [(path, self.state_float_columns[".".join(path)]) for path in game_data_paths]
+
+    def write_previous_actions(self, floats: np.ndarray, previous_actions_idx):
+        """
+        Writes the last n_prev_actions actions of previous_actions_idx into the float input vector.
+        Actions before the start of the rollout are taken to be action_forward_idx.
+        """
+        if self.n_prev_actions == 0:
+            return
+        recent_actions = previous_actions_idx[-self.n_prev_actions :]
+        actions_idx = np.full(self.n_prev_actions, self.action_forward_idx, dtype=np.int64)
+        actions_idx[self.n_prev_actions - len(recent_actions) :] = recent_actions
+        floats[self.previous_actions] = self.action_floats[actions_idx].ravel()
+
+    def write_state_float(self, state_float: np.ndarray, game_data, relative_zone_centers: np.ndarray):
+        """
+        Writes a state_float row. Vectors in game_data must be lists, as given by GameManager.receive_game_data.
+        """
+        for path, column in self.game_data_fields:
+            value = game_data
+            for key in path:
+                value = value[key]
+            state_float[column] = value
+        state_float[self.state_float_columns["relative_zone_centers"]] = relative_zone_centers
+
+    def state_floats(self, state_float: np.ndarray, previous_actions_idx) -> np.ndarray:
+        """
+        Float input vector of a recorded state_float row.
+        """
+        floats = np.empty(self.size, dtype=np.float32)
+        self.write_previous_actions(floats, previous_actions_idx)
+        floats[self.state_float] = state_float
+        return floats
+
+    def rollout_state_floats(self, state_float: np.ndarray, previous_actions_idx: np.ndarray, n_earlier_actions: int) -> np.ndarray:
+        """
+        Float input vectors of all the recorded state_float rows of a rollout, at once.
+        Row i carries the actions previous_actions_idx[: n_earlier_actions + i], as state_floats() would.
+        """
+        n_rows = len(state_float)
+        floats = np.empty((n_rows, self.size), dtype=np.float32)
+        if self.n_prev_actions > 0:
+            # Window i of the padded actions holds the last n_prev_actions of previous_actions_idx[:i]
+            padded_actions = np.concatenate((np.full(self.n_prev_actions, self.action_forward_idx, dtype=np.int64), previous_actions_idx))
+            windows = np.lib.stride_tricks.sliding_window_view(padded_actions, self.n_prev_actions)[n_earlier_actions : n_earlier_actions + n_rows]
+            floats[:, self.previous_actions] = self.action_floats[windows].reshape(n_rows, -1)
+        floats[:, self.state_float] = state_float
+        return floats
+
+    def normalization(self, table=FLOAT_INPUT_NORMALIZATION):
+        """
+        Returns the (mean, deviation) vectors of the float inputs, from values given by name.
+        """
+        mean = np.empty(self.size)
+        deviation = np.empty(self.size)
+        for key_idx, key in enumerate(INPUT_KEYS):
+            mean[self.previous_actions][key_idx :: len(INPUT_KEYS)] = table[f"previous_actions.{key}"][0]
+            deviation[self.previous_actions][key_idx :: len(INPUT_KEYS)] = table[f"previous_actions.{key}"][1]
+        for name, column in self.columns.items():
+            if name == "previous_actions":
+                continue
+            if isinstance(column, int):
+                mean[column], deviation[column] = table[name]
+            else:
+                mean[column] = np.resize(table[name][0], column.stop - column.start)
+                deviation[column] = np.resize(table[name][1], column.stop - column.start)
+        return mean, deviation
+
+
+STATE_LAYOUT = StateLayout(
+    config_copy.inputs,
+    config_copy.n_prev_actions_in_inputs,
+    config_copy.n_zone_centers_in_inputs,
+    config_copy.action_forward_idx,
+)
+# Sanity check in case of bad programmers
+assert STATE_LAYOUT.size == config_copy.float_input_dim
+
+float_input_mean, float_input_deviation = STATE_LAYOUT.normalization()
+
+
+def get_1d_state_floats(state_float, previous_actions_idx):
+    """
+    state_float is a row of rollout_results["state_float"], i.e. the flattened game data followed by the relative zone centers.
+    """
+    return STATE_LAYOUT.state_floats(state_float, previous_actions_idx)
+
+
+def get_rollout_state_floats(state_float, previous_actions_idx, n_earlier_actions):
+    """
+    state_float holds rows of rollout_results["state_float"], which carry previous_actions_idx[: n_earlier_actions + i], see get_1d_state_floats.
+    """
+    return STATE_LAYOUT.rollout_state_floats(state_float, previous_actions_idx, n_earlier_actions)
@@ -6,12 +6,25 @@ import sys
 sys.path.append(os.path.expanduser("~") + "\\AppData\\Local\\programs\\python\\python312\\lib\\site-packages")
 
 from multiprocessing.connection import Listener
+import numpy as np
 from config_files import config_copy
 import inspect
 source_file_path = inspect.getfile(inspect.currentframe())
 
 from MKW_rl.MKW_interaction.MKW_data_translate import *
-from mkw_scripts.Modules.mkw_classes.race_manager import RaceState
+from MKW_rl.MKW_interaction.MKW_frame import preprocess_frame
+from MKW_rl.MKW_interaction.MKW_protocol import (
+    LOAD_STATE_REPLY,
+    SLOT_READY,
+    Command,
+    RequestFlags,
+    SharedMemoryRing,
+    pack_hello_reply,
+    unpack_savestate_key,
+    unpack_request,
+)
+from MKW_rl.MKW_interaction.MKW_savestates import RACE_START, SavestatePool
+from mkw_scripts.Modules.mkw_classes import clear_chain_cache
 
 HOST = "127.0.0.1"
 
@@ -31,142 +44,117 @@ class GameInstanceHook():
         self.load_state_desired = False
         self.desired_savestate = None
         self.last_game_data = None
-        self.restarting_race = False
-        self.restarting_race_timer = 0
+        self.desired_start_point = RACE_START
+        # Race starts kept in memory, so that resetting a race does not read the savestate file again
+        self.savestate_pool = SavestatePool(savestate, config_copy.savestate_pool_size)
+        self.ring = None # Shared memory transport, if requested by the game manager in its HELLO
+        self.preprocess_frames = False # Also requested in the HELLO
+        # STEP requests holding their inputs for several frames are answered after hold_frames_left frames
+        self.hold_frames_left = 0
+        self.held_request = None
 
     def framedrawn_handler(self, width, height, data):
-        if self.restarting_race:
-            if self.restarting_race_timer < 3:
-                self.desired_inputs = {
-                    "A": False,
-                    "B": False,
-                    "Up": False,
-                    "StickX": 0,
-                    "StickY": 0,
-                    "TriggerLeft": 0,
-                    "TriggerRight": 0,
-                    "Start": True,
-                }
-                self.restarting_race_timer += 1
-            elif self.restarting_race_timer >= 3 and self.restarting_race_timer < 7:
-                self.desired_inputs = {
-                    "A": False,
-                    "B": False,
-                    "Up": False,
-                    "StickX": 0,
-                    "StickY": -1,
-                    "TriggerLeft": 0,
-                    "TriggerRight": 0,
-                    "Start": False,
-                }
-                self.restarting_race_timer += 1
-            elif self.restarting_race_timer >= 7 and self.restarting_race_timer < 12:
-                self.desired_inputs = {
-                    "A": True,
-                    "B": False,
-                    "Up": False,
-                    "StickX": 0,
-                    "StickY": 0,
-                    "TriggerLeft": 0,
-                    "TriggerRight": 0,
-                    "Start": False,
-                }
-                self.restarting_race_timer += 1
-            else:
-                self.restarting_race_timer += 1
-                # Reload game objects awaiting countdown start
-                self.game_data_interface.initialize_race_objects()
-                if self.game_data_interface.race_mgr.state() == RaceState.COUNTDOWN:
-                    print("Restarting via countdown timer")
-                    self.restarting_race = False
-                    self.restarting_race_timer = 0
-                # Skipped 1000 frames attempting to let the game load the race, so we continue instead.
-                if self.restarting_race_timer > 1000:
-                    # This behavior is likely unwanted but if it never runs (which I believe to be the case) then it never runs
-                    print("ERROR: Restarting due to frame rule, track was not loaded within 1000 frames")
-                    self.restarting_race = False
-                    self.restarting_race_timer = 0
-            return
-        
         # Wait for data necessary to determine what we want to do
         self.current_unprocessed_frame = (height, width, data)
 
+        if self.hold_frames_left > 0:
+            # Keep the current inputs without waiting on the game manager
+            self.hold_frames_left -= 1
+            if self.hold_frames_left == 0:
+                frame_data_request, game_data_request = self.held_request
+                self.answer_request(frame_data_request, game_data_request, width, height, data)
+            return
+
         # print("Now waiting for new request")
-        # https://stackoverflow.com/questions/38412887/how-to-send-a-list-through-tcp-sockets-python
-        socket_data = self.conn.recv()
-        # print("Received:", socket_data)
+        command, flags, new_inputs, payload, hold_frames = self.receive_request()
 
-        frame_data_request = socket_data[0]
-        game_data_request = socket_data[1]
-        new_inputs = socket_data[2]
-        load_state_request = socket_data[3]
+        frame_data_request = bool(flags & RequestFlags.FRAME)
+        game_data_request = bool(flags & RequestFlags.GAME_DATA)
 
         if new_inputs is not None:
             self.desired_inputs = new_inputs
 
-        if load_state_request is not None:
-            # Funky way of avoiding loading a savestate for every rollout (bad for performance)
-            if socket_data[3] == config_copy.restart_race_command:
-                self.restarting_race = True
-                self.desired_inputs = {
-                    "A": False,
-                    "B": False,
-                    "Up": False,
-                    "StickX": 0,
-                    "StickY": 0,
-                    "TriggerLeft": 0,
-                    "TriggerRight": 0,
-                    "Start": True,
-                }
-                return
+        if command == Command.LOAD_STATE:
             self.load_state_desired = True
-            self.desired_savestate = socket_data[3]
+            self.desired_savestate, self.desired_start_point = unpack_savestate_key(payload)
             if frame_data_request:
                 print("ERROR: Savestate file received but got unactionable frame data request")
             if game_data_request:
                 print("ERROR: Savestate file received but got unactionable game data request")
             return
 
-        if frame_data_request:
-            self.conn.send_bytes(self.current_unprocessed_frame[2]) # unsure if i should pre-process frame or not...
-
-            # width * height * 4, socket.MSG_WAITALL # server recv to receive frame data because it's big
-
-            """# The following line brought to you by literal hours of trying to figure things out only to realize I just needed two functions that I could've just copied from the original code
-            processed_frame = numpy.frombuffer(self.current_unprocessed_frame[2], dtype = numpy.uint8).reshape((self.current_unprocessed_frame[0], self.current_unprocessed_frame[1], 3))
-            # https://stackoverflow.com/questions/48121916/numpy-resize-rescale-image
-            resized_frame = processed_frame[::6,::6]
-            resized_frame = numpy.expand_dims(cv2.cvtColor(resized_frame, cv2.COLOR_BGRA2GRAY), 0) # took me like 80 minutes to get to the solution that was already present in the original code
-            # frame is a numpy array of shape (1, H, W) and dtype np.uint8
-            print(processed_frame.shape, ":", resized_frame.shape)"""
-        
+        if hold_frames > 0:
+            self.hold_frames_left = hold_frames
+            self.held_request = (frame_data_request, game_data_request)
+            return
+
+        self.answer_request(frame_data_request, game_data_request, width, height, data)
+
+    def answer_request(self, frame_data_request, game_data_request, width, height, data):
+        if frame_data_request and self.preprocess_frames:
+            # frame is a numpy array of shape (1, H, W) and dtype np.uint8, flattened to be sent
+            frame = preprocess_frame(np.frombuffer(data, dtype=np.uint8).reshape((height, width, 3))).reshape(-1)
+        else:
+            frame = data
+
+        game_data_ready = False
         if game_data_request and self.desired_savestate is not None:
             if not self.game_data_initiated:
                 self.game_data_interface.initialize_race_objects()
                 self.game_data_initiated = True
-
-            game_data = self.game_data_interface.get_game_data_object()
-            for key in game_data["kart_data"].keys():
-                value = game_data["kart_data"][key]
-                if type(value) == vec3:
-                    game_data["kart_data"][key] = [value.x, value.y, value.z]
-            self.conn.send(game_data)
-            self.last_game_data = game_data
+            self.last_game_data = self.game_data_interface.get_game_data_snapshot()
+            game_data_ready = True
         elif game_data_request:
             print("ERROR: game_data_request was sent before race state was loaded")
+
+        if self.ring is not None:
+            if frame_data_request or game_data_ready:
+                slot = self.ring.advance()
+                if frame_data_request:
+                    self.ring.frame(slot)[:] = frame
+                if game_data_ready:
+                    self.ring.state(slot)[:] = self.game_data_interface.snapshot.buffer
+                self.conn.send_bytes(SLOT_READY.pack(slot))
+            return
+
+        if frame_data_request:
+            self.conn.send_bytes(frame)
+
+        if game_data_ready:
+            # The game manager reads the record with the same fixed layout, see MKW_protocol
+            self.conn.send_bytes(self.game_data_interface.snapshot.buffer)
         # send the image data here, so we can set desired_inputs before we exit the function
-            
+
+    def receive_request(self):
+        """
+        Waits for the next request of the game manager. HELLO and SAVE_STATE requests are answered right away,
+        as they do not act on the current frame.
+        """
+        while True:
+            command, flags, inputs, payload, hold_frames = unpack_request(self.conn.recv_bytes())
+            if command == Command.SAVE_STATE:
+                self.savestate_pool.save(unpack_savestate_key(payload))
+                continue
+            if command != Command.HELLO:
+                return command, flags, inputs, payload, hold_frames
+            if self.ring is not None:
+                self.ring.close()
+                self.ring = None
+            if payload:
+                self.ring = SharedMemoryRing.from_hello_payload(payload)
+            self.preprocess_frames = bool(flags & RequestFlags.PREPROCESS_FRAMES)
+            self.conn.send_bytes(pack_hello_reply(self.game_data_interface.snapshot))
+
     def frameadvance_handler(self):
         self.frame_counter += 1
         gui.draw_text((10, 10), self.red, f"Frame: {self.frame_counter}")
 
         if self.load_state_desired:
             self.load_state_desired = False
-            if self.desired_savestate.startswith("__slot__"):
-                savestate.load_from_slot(int(self.desired_savestate[8:]))
-            else:
-                savestate.load_from_file(self.desired_savestate)
+            loaded_start_point = self.savestate_pool.load(self.desired_savestate, self.desired_start_point)
+            clear_chain_cache()
             self.game_data_initiated = False
+            self.conn.send_bytes(LOAD_STATE_REPLY.pack(loaded_start_point))
             # print("Loaded new savestate:", self.desired_savestate)
 
         controller.set_gc_buttons(0, self.desired_inputs)
@@ -3,16 +3,29 @@ from config_files import config_copy, user_config
 
 import math
 import os
+import random
 from multiprocessing.connection import Client
 import subprocess
 import time
-from typing import Callable, Dict, List
-import flatdict
+from typing import Callable, Dict, List, Optional
 
 from MKW_rl.MKW_interaction.MKW_data_translate import *
+from MKW_rl.MKW_interaction.MKW_frame import FRAME_HEIGHT, FRAME_WIDTH, PREPROCESSED_FRAME_HEIGHT, PREPROCESSED_FRAME_WIDTH, preprocess_frame
+from MKW_rl.MKW_interaction.MKW_protocol import (
+    LOAD_STATE_REPLY,
+    SLOT_READY,
+    Command,
+    RequestFlags,
+    SharedMemoryRing,
+    check_hello_reply,
+    pack_request,
+)
+from MKW_rl.MKW_interaction.MKW_savestates import RACE_START
+from MKW_rl.MKW_interaction.MKW_snapshot import GameStateSnapshot
+from MKW_rl.MKW_interaction.MKW_state_layout import STATE_LAYOUT
 from MKW_rl import map_loader
+from MKW_rl.rollout_recorder import RolloutRecorder
 
-import cv2
 import numba
 import numpy as np
 import numpy.typing as npt
@@ -24,8 +37,6 @@ import win32gui
 import win32process
 
 HOST = "127.0.0.1"
-FRAME_WIDTH = 611
-FRAME_HEIGHT = 456
 
 # Assuming that this function will work unmodified despite changes to the magnitude of zone spacings
 # @numba.njit
@@ -82,10 +93,31 @@ class GameManager:
         self.tmi_port = tmi_port
         self.dolphin_process_id = None
         self.dolphin_window_id = None
-        self.start_states = {} # oh hey I might want to use this for starting later on in the track
+        # Start-state bank: {savestate_path: {zone_idx: item count}}, for states saved in the hook's savestate pool during eval rollouts.
+        # Exploration rollouts may start from one of them instead of the start of the race, see rollout()
+        self.start_states = {}
         self.game_spawning_lock = game_spawning_lock
         self.game_activated = False
         self.process_number = process_number
+        # Layout of the game state records sent by the hook, see MKW_protocol
+        self.snapshot = GameStateSnapshot()
+        # Frames are either raw, or already preprocessed by the hook
+        self.preprocess_frames_in_game_hook = config_copy.preprocess_frames_in_game_hook
+        if self.preprocess_frames_in_game_hook:
+            self.frame_shape = (1, PREPROCESSED_FRAME_HEIGHT, PREPROCESSED_FRAME_WIDTH)
+        else:
+            self.frame_shape = (FRAME_HEIGHT, FRAME_WIDTH, 3)
+        self.frame_size = math.prod(self.frame_shape)
+        # Shared memory ring the hook writes frames and game data to, if enabled. Made for each game instance in register(),
+        # closed and unlinked with it by close_game(), or by close() when the process shuts down.
+        self.use_shared_memory_transport = config_copy.use_shared_memory_transport
+        self.ring = None
+        self.ready_slot = None
+        # Frames between actions are run by the hook on its own, instead of one request per frame
+        self.batch_skipped_frames = config_copy.batch_skipped_frames_in_game_hook
+        # Request the next observation before computing the action for the current one, see rollout()
+        self.pipeline_actions = config_copy.pipeline_actions_with_emulation
+        assert self.batch_skipped_frames or not self.pipeline_actions, "pipeline_actions_with_emulation requires batch_skipped_frames_in_game_hook"
     
     def get_window_id(self):
         assert self.dolphin_process_id is not None
@@ -113,6 +145,17 @@ class GameManager:
     def register(self, timeout=None):
         # https://stackoverflow.com/questions/6920858/interprocess-communication-in-python
         self.sock = Client((HOST, self.tmi_port))
+        if self.use_shared_memory_transport and self.ring is None:
+            self.ring = SharedMemoryRing(config_copy.shared_memory_ring_slots, self.snapshot.dtype.itemsize, self.frame_size)
+        # Both ends must agree on the protocol version and on the game data schema before exchanging anything else
+        self.sock.send_bytes(
+            pack_request(
+                Command.HELLO,
+                payload=self.ring.hello_payload() if self.ring is not None else b"",
+                flags=RequestFlags.PREPROCESS_FRAMES if self.preprocess_frames_in_game_hook else RequestFlags.NONE,
+            )
+        )
+        check_hello_reply(self.sock.recv_bytes(), self.snapshot)
         """# signal.signal(signal.SIGINT, self.signal_handler) # Handle close game signal
         # https://stackoverflow.com/questions/45864828/msg-waitall-combined-with-so-rcvtimeo
         # https://stackoverflow.com/questions/2719017/how-to-set-timeout-on-pythons-socket-recv-method
@@ -184,6 +227,7 @@ class GameManager:
         print(f"Found Dolphin process id: {self.dolphin_process_id=}")
         self.last_game_reboot = time.perf_counter() # set counter to know how old the process is
         self.latest_map_path_requested = -1
+        self.start_states = {} # The states lived in the previous Dolphin instance
         self.msgtype_response_to_wakeup_TMI = None
         while not self.is_game_running(): # wait for the program to launch fully
             time.sleep(0)
@@ -212,6 +256,21 @@ class GameManager:
             os.system(f"taskkill /PID {self.dolphin_process_id} /f")
         while self.is_game_running(): # wait for process to fully close
             time.sleep(0)
+        self.close_ring()
+
+    def close_ring(self):
+        if self.ring is not None:
+            self.ring.close(unlink=True)
+            self.ring = None
+            self.ready_slot = None
+
+    def close(self):
+        """
+        Shuts down the game instance, and removes the shared memory ring.
+        """
+        if self.is_game_running():
+            self.close_game()
+        self.close_ring()
 
     def ensure_game_launched(self):
         if not self.is_game_running():
@@ -253,11 +312,62 @@ class GameManager:
             self.max_allowable_distance_to_real_checkpoint,
         ) = map_loader.sync_virtual_and_real_checkpoints(zone_centers, savestate_path)"""
 
-    def rollout(self, exploration_policy: Callable, savestate_path: str, zone_centers: npt.NDArray, update_network: Callable, last_loop_finished: bool):
+    def send_request(
+        self, command: Command, frame_request=False, game_data_request=False, inputs=None, savestate_path=None, start_point=RACE_START, hold_frames=0
+    ):
+        self.sock.send_bytes(
+            pack_request(command, frame_request, game_data_request, inputs, savestate_path, start_point=start_point, hold_frames=hold_frames)
+        )
+
+    def load_state(self, savestate_path: str, start_point=RACE_START, inputs=None) -> int:
+        """
+        Returns the start point the hook actually loaded, which is RACE_START if start_point was dropped from its savestate pool.
+        """
+        self.send_request(Command.LOAD_STATE, inputs=inputs, savestate_path=savestate_path, start_point=start_point)
+        (loaded_start_point,) = LOAD_STATE_REPLY.unpack(self.sock.recv_bytes())
+        if loaded_start_point != start_point:
+            self.start_states.get(savestate_path, {}).pop(start_point, None)
+        return loaded_start_point
+
+    def receive_frame(self) -> npt.NDArray:
+        if self.ring is not None:
+            # Zero-copy view, only valid until the hook wraps around the ring
+            (self.ready_slot,) = SLOT_READY.unpack(self.sock.recv_bytes())
+            return self.ring.frame_array(self.ready_slot, self.frame_shape)
+        return np.frombuffer(self.sock.recv_bytes(self.frame_size), dtype = np.uint8).reshape(self.frame_shape)
+
+    def receive_game_data(self) -> Game_Data:
+        if self.ring is not None:
+            # Written to the same slot as the frame received just before
+            record = self.ring.state_array(self.ready_slot, self.snapshot.dtype)
+        else:
+            record = self.snapshot.from_bytes(self.sock.recv_bytes())
+        game_data = self.snapshot.to_game_data(record)
+        for key in game_data["kart_data"].keys():
+            value = game_data["kart_data"][key]
+            if type(value) == vec3:
+                game_data["kart_data"][key] = [value.x, value.y, value.z]
+            elif type(value) == quatf:
+                game_data["kart_data"][key] = [value.x, value.y, value.z, value.w]
+        return game_data
+
+    def rollout(
+        self,
+        exploration_policy: Callable,
+        savestate_path: str,
+        zone_centers: npt.NDArray,
+        update_network: Callable,
+        last_loop_finished: bool,
+        is_explo: bool = False,
+        send_chunk: Optional[Callable] = None,
+    ):
         """
         exploration_policy: Function that returns ratio of exploration vs exploitation runs
         savestate_path: file path to current track to run
         update_network: function to send network information to update itself with
+        is_explo: exploration rollouts may start from the start-state bank, eval rollouts start from the race start and fill the bank
+        send_chunk: if given, called with a RolloutRecorder chunk every config_copy.rollout_chunk_size new actions while the race is
+            running. The last chunk is then returned in rollout_results["last_chunk"].
         """
         (
             zone_transitions,
@@ -285,16 +395,18 @@ class GameManager:
         instrumentation__convert_frame = 0
         instrumentation__grab_floats = 0
 
+        # Per-action columns: current_zone_idx (based off the map.npy file), frames, input_w (whether or not A is pressed), actions,
+        # executed_actions (action held between each frame and the next one, one action behind actions when they are pipelined),
+        # action_was_greedy (as defined by the exploration policy), q_values, race_completion and state_float (flattened Game_Data,
+        # see state_float_columns)
+        recorder = RolloutRecorder((1, PREPROCESSED_FRAME_HEIGHT, PREPROCESSED_FRAME_WIDTH), len(config_copy.inputs))
+        recorder.set_state_float_columns(STATE_LAYOUT.state_float_columns)
+        # Float inputs of the network, rewritten for every action. state_float is the part recorded in the rollout.
+        floats = np.zeros(STATE_LAYOUT.size, dtype=np.float32)
+        state_float = floats[STATE_LAYOUT.state_float]
         rollout_results = {
-            "current_zone_idx": [], # Current zone we are in based off the map.npy file
-            "frames": [], # frame data
-            "input_w": [], # Whether or not w is pressed
-            "actions": [], # list of actions
-            "action_was_greedy": [], # whether action is greedy as defined by the exploration policy
-            "q_values": [],
-            "race_completion": [], # TODO: use this to check if our map.npy file is working
-            "state_float": [], # Game_Data object
             "furthest_zone_idx": 0, # based off map.npy file
+            "start_zone_idx": 0, # zone of the start-state bank entry the rollout started from, 0 for the start of the race
         }
 
         if (self.sock is None) or (not self.registered): # Game was not connected to the program
@@ -332,15 +444,17 @@ class GameManager:
         this_rollout_has_seen_t_negative = False
         this_rollout_is_finished = False
         n_th_action_we_compute = 0
+        chunk_start = 0 # first action of the next chunk sent to the learner
         compute_action_asap = True
-        compute_action_asap_floats = True
         frame_expected = False
+        # In pipelined mode, the next observation is requested before the action for the current one is computed.
+        # The game then runs the action committed one observation earlier while the network looks at the current frame.
+        request_in_flight = False
         map_change_requested_time = math.inf
 
         last_known_simulation_state = None
         pc = 0 # performance counter
         pc5 = 0
-        floats = None
 
         # distance_since_track_begin = 0.99 # Beginning lap completion percentage is usually about 0.999, depending on the track
         last_progress_improvement = 0
@@ -350,25 +464,28 @@ class GameManager:
 
         game_data = None
         
-        # Load the savestate if we have not done so (we are on the wrong map)
-        # print("loading savestate")
-        if self.latest_map_path_requested != savestate_path or last_loop_finished:
-            # We have to load the savestate we want
+        manual_item_count = 3
+        # Reset the race. The hook keeps race starts in memory, so this only reads the savestate file on a new map
+        if self.latest_map_path_requested != savestate_path:
             print("Loading savestate")
-            self.sock.send([False, False, computed_action, savestate_path])
-            self.latest_map_path_requested = savestate_path # this seems backwards... TODO
-        else:
-            # Send signal to restart race manually instead of reloading savestate to save overhead
-            # Note that this may run into some serious issues regarding load times and reward functions
-            # These issues also will be hard to debug... oh joy. IDK if this is worth it xd
-            # print("Restarting manually")
-            self.sock.send([False, False, computed_action, config_copy.restart_race_command])
+        start_point = RACE_START
+        bank = self.start_states.get(savestate_path)
+        if config_copy.use_start_state_bank and is_explo and bank and random.random() < config_copy.start_state_bank_probability:
+            start_point = random.choice(list(bank.keys()))
+        start_point = self.load_state(savestate_path, start_point, inputs=computed_action)
+        self.latest_map_path_requested = savestate_path # this seems backwards... TODO
+        if start_point != RACE_START:
+            current_zone_idx = start_point
+            manual_item_count = bank[start_point]
+            rollout_results["start_zone_idx"] = current_zone_idx
+            rollout_results["furthest_zone_idx"] = current_zone_idx
+        # Zones are saved to the bank the first time an eval rollout passes them
+        next_bank_zone_idx = config_copy.start_state_bank_zone_interval if config_copy.use_start_state_bank and not is_explo else math.inf
         
         
         # self.sock.send([False, False, computed_action, savestate_path])
         # self.latest_map_path_requested = savestate_path # this seems backwards... TODO
 
-        manual_item_count = 3
         while not this_rollout_is_finished:
             """
             This loop needs to perform these essential functions:
@@ -382,45 +499,60 @@ class GameManager:
             if self.latest_map_path_requested != savestate_path:
                 # We have to load the savestate we want
                 print("loading savestate")
-                self.sock.send([False, False, computed_action, savestate_path])
+                self.load_state(savestate_path, inputs=computed_action)
                 self.latest_map_path_requested = savestate_path # this seems backwards... TODO
                 continue
             pc2 = time.perf_counter_ns()
             instrumentation__grab_frame += pc2 - pc
+            hold_frames = 0
             if (frames_processed % self.run_steps_per_action != 0):
-                self.sock.send([False, False, computed_action, None])
-                compute_action_asap_floats = True
-                frames_processed += 1
-                continue
+                if not self.batch_skipped_frames:
+                    self.send_request(Command.STEP, inputs=computed_action)
+                    frames_processed += 1
+                    continue
+                # The hook keeps the inputs for the remaining frames, then replies as if they had been requested one by one
+                hold_frames = self.run_steps_per_action - frames_processed % self.run_steps_per_action
+                frames_processed += hold_frames
             pc3 = time.perf_counter_ns()
             instrumentation__between_run_steps += pc3 - pc2
             
-            self.sock.send([True, True, computed_action, None])
+            if not request_in_flight:
+                self.send_request(Command.STEP, frame_request=True, game_data_request=True, inputs=computed_action, hold_frames=hold_frames)
+            request_in_flight = False
             # The following line brought to you by literal hours of trying to figure things out only to realize I just needed two functions that I could've just copied from the original code
-            frame_data = np.frombuffer(self.sock.recv_bytes(FRAME_WIDTH * FRAME_HEIGHT * 3), dtype = np.uint8).reshape((FRAME_HEIGHT, FRAME_WIDTH, 3))
+            frame_data = self.receive_frame()
             pc4 = time.perf_counter_ns()
             instrumentation__grab_frame += pc4 - pc3
             frames_processed += 1
-            # https://stackoverflow.com/questions/48121916/numpy-resize-rescale-image
-            resized_frame = frame_data[::4,::4]
-            """if frame_counter % 240 == 0:
-                cv2.imshow("Greyscale", cv2.cvtColor(resized_frame, cv2.COLOR_BGRA2GRAY))
-                cv2.waitKey(0)""" # Image is collected properly, next step is to save to file for display.
-            resized_frame = np.expand_dims(cv2.cvtColor(resized_frame, cv2.COLOR_BGRA2GRAY), 0) # took me like 80 minutes to get to the solution that was already present in the original code
+            if self.preprocess_frames_in_game_hook:
+                # Copied, as shared memory slots are reused and received bytes are read-only
+                resized_frame = np.array(frame_data)
+            else:
+                resized_frame = preprocess_frame(frame_data)
             # frame is a numpy array of shape (1, H, W) and dtype np.uint8
 
-            rollout_results["frames"].append(resized_frame)
             pc5 = time.perf_counter_ns()
             instrumentation__convert_frame += pc5 - pc4
-            game_data = self.sock.recv()
+            game_data = self.receive_game_data()
+            if self.pipeline_actions:
+                # Frame and game data were copied out of the shared memory slot above, so the hook may write the next one
+                committed_action_idx = recorder.get("actions")[-1] if len(recorder) > 0 else config_copy.action_forward_idx
+                committed_action = computed_action if computed_action is not None else config_copy.inputs[committed_action_idx]
+                self.send_request(
+                    Command.STEP,
+                    frame_request=True,
+                    game_data_request=True,
+                    inputs=committed_action,
+                    hold_frames=self.run_steps_per_action - 1,
+                )
+                request_in_flight = True
+                recorder.append_executed_action(committed_action_idx)
             # print("Game manager rollout() :: race time is", game_data["race_data"]["race_time"])
             if game_data["boost_data"]["shroom_boost"] > 86:
                 manual_item_count -= 1
 
             game_data["race_data"]["item_count"] = manual_item_count
 
-            network_inputs = Network_Inputs(game_data, rollout_results["actions"])
-            # print("Game data converted to:", network_inputs.get_flattened_game_data())
             race_time = max([game_data["race_data"]["race_time"], 1e-12]) # Epsilon trick to avoid division by zero
 
             current_zone_idx = update_current_zone_idx(
@@ -434,6 +566,12 @@ class GameManager:
                 last_progress_improvement_f = frames_processed
                 rollout_results["furthest_zone_idx"] = current_zone_idx
 
+            if current_zone_idx >= next_bank_zone_idx and game_data["race_data"]["state"] == RaceState.RACE.value:
+                # The hook saves the state of the frame it reported last, which is this one unless actions are pipelined
+                self.send_request(Command.SAVE_STATE, savestate_path=savestate_path, start_point=current_zone_idx)
+                self.start_states.setdefault(savestate_path, {})[current_zone_idx] = manual_item_count
+                next_bank_zone_idx = (current_zone_idx // config_copy.start_state_bank_zone_interval + 1) * config_copy.start_state_bank_zone_interval
+
             """distance_since_track_begin = game_data["race_data"]["race_completion"]
             if distance_since_track_begin > last_progress_improvement + config_copy.required_progress_per_cutoff_rollout: # Force the ai to improve by non-micro steps
                 # print("Game manager rollout race_completion_max value updated:", game_data["race_data"]["race_completion"], "Now updating frame:", frames_processed)
@@ -449,23 +587,8 @@ class GameManager:
                 :,
             ] - game_data["kart_data"]["position"]
 
-            if compute_action_asap_floats:
-                compute_action_asap_floats = False
-
-                # unfinished
-                floats = np.hstack(
-                    (
-                        np.array(
-                            network_inputs.get_input_data()
-                        ),
-                        np.array(
-                            network_inputs.get_flattened_game_data()
-                        ),
-                        state_zone_center_coordinates_in_car_reference_system.ravel(),
-                    ),
-                    dtype=np.float32
-                )
-                # print("Floats generated:", len(floats))
+            STATE_LAYOUT.write_state_float(state_float, game_data, state_zone_center_coordinates_in_car_reference_system.ravel())
+            STATE_LAYOUT.write_previous_actions(floats, recorder.get("actions"))
             pc7 = time.perf_counter_ns()
             instrumentation__answer_action_step += pc7 - pc6
 
@@ -475,7 +598,7 @@ class GameManager:
                 action_was_greedy,
                 q_value,
                 q_values,
-            ) = exploration_policy(rollout_results["frames"][-1], floats) # TODO: consider replacing list index with available variable resized_frame
+            ) = exploration_policy(resized_frame, floats)
             pc8 = time.perf_counter_ns()
             instrumentation__exploration_policy += pc8 - pc7
 
@@ -494,15 +617,18 @@ class GameManager:
                 for i, val in enumerate(np.nditer(q_values)):
                     end_race_stats[f"q_value_{i}_starting_frame"] = val
 
-            rollout_results["current_zone_idx"].append(current_zone_idx)
-            rollout_results["race_completion"].append(game_data["race_data"]["race_completion"])
-            rollout_results["input_w"].append(config_copy.inputs[action_idx]["A"])
-            rollout_results["actions"].append(action_idx)
-            rollout_results["action_was_greedy"].append(action_was_greedy)
-            rollout_results["q_values"].append(q_values)
-
-            game_data["relative_zone_centers"] = state_zone_center_coordinates_in_car_reference_system.ravel().tolist()
-            rollout_results["state_float"].append(game_data)
+            recorder.append(
+                resized_frame,
+                state_float,
+                action_idx,
+                action_was_greedy,
+                q_values,
+                current_zone_idx,
+                game_data["race_data"]["race_completion"],
+                config_copy.inputs[action_idx]["A"],
+            )
+            if not self.pipeline_actions:
+                recorder.append_executed_action(action_idx)
 
             n_th_action_we_compute += 1
             if (n_th_action_we_compute % config_copy.update_inference_network_every_n_actions == 0):
@@ -560,5 +686,22 @@ class GameManager:
 
                 this_rollout_is_finished = True
 
+            # Chunks are only sent while the race is running: transitions of a chunk do not depend on when the race ends
+            if (send_chunk is not None and not this_rollout_is_finished
+                and len(recorder) - chunk_start >= config_copy.rollout_chunk_size + config_copy.n_steps):
+                send_chunk(recorder.chunk(chunk_start, False, config_copy.n_steps, config_copy.n_prev_actions_in_inputs))
+                chunk_start = len(recorder) - config_copy.n_steps
+
+        if request_in_flight:
+            # Discard the observation requested ahead of time, so that the next rollout starts in step with the hook
+            self.receive_frame()
+            self.receive_game_data()
+
+        rollout_results.update(recorder.finish())
+        if send_chunk is not None:
+            last_chunk = recorder.chunk(chunk_start, True, config_copy.n_steps, config_copy.n_prev_actions_in_inputs)
+            if "race_time" in rollout_results:
+                last_chunk["race_time"] = rollout_results["race_time"]
+            rollout_results["last_chunk"] = last_chunk
         return rollout_results, end_race_stats
 
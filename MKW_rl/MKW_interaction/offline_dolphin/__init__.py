@@ -0,0 +1,49 @@
+"""
+Pure Python stand-in for the dolphin scripting modules, to run the hook stack off-emulator.
+
+Memory is a big-endian bytearray image loaded from MEM1/MEM2 dumps (Dolphin: Debug > Memory > Dump MEM1/MEM2),
+and frames are emitted synthetically by run(), so the memory readers, MKW_Interface and the hook's request loop
+can be benchmarked or regression-tested on any machine.
+
+Usage:
+    from MKW_rl.MKW_interaction import offline_dolphin
+    offline_dolphin.install()
+    offline_dolphin.memory.load_dump("mem1.raw", "mem2.raw")
+    import MKW_rl.MKW_interaction.game_instance_hook  # registers its callbacks as it would inside Dolphin
+    offline_dolphin.run(frames=10000)
+
+install() must be called before anything imports dolphin, it is never done implicitly.
+"""
+
+import sys
+
+from MKW_rl.MKW_interaction.offline_dolphin import controller, event, gui, memory, savestate
+
+SUBMODULES = {
+    "memory": memory,
+    "savestate": savestate,
+    "event": event,
+    "controller": controller,
+    "gui": gui,
+}
+
+
+def install():
+    """
+    Registers this package as the dolphin module, so that "from dolphin import memory" resolves to the fakes.
+    """
+    sys.modules["dolphin"] = sys.modules[__name__]
+    for name, module in SUBMODULES.items():
+        sys.modules["dolphin." + name] = module
+
+
+def run(frames: int, width: int = 611, height: int = 456, frame_source=None):
+    """
+    Emulates the given number of frames. Each frame calls the framedrawn callback with (width, height, data),
+    then the frameadvance callback, like Dolphin does.
+    frame_source(frame_index) may return the raw RGB frame to send, by default a synthetic frame is reused.
+    """
+    if frame_source is None:
+        frame_source = event.synthetic_frame_source(width, height)
+    for frame_index in range(frames):
+        event.emit_frame(width, height, frame_source(frame_index))
@@ -0,0 +1,49 @@
+"""
+Fake dolphin.controller. Inputs set by scripts are only stored, and read back by the getters.
+"""
+
+gc_buttons = {}
+wiimote_buttons = {}
+wii_classic_buttons = {}
+wii_nunchuk_buttons = {}
+gba_buttons = {}
+
+
+def get_gc_buttons(controller_id: int, /) -> dict:
+    return dict(gc_buttons.get(controller_id, {}))
+
+
+def set_gc_buttons(controller_id: int, inputs: dict, /) -> None:
+    gc_buttons[controller_id] = dict(inputs)
+
+
+def get_wiimote_buttons(controller_id: int, /) -> dict:
+    return dict(wiimote_buttons.get(controller_id, {}))
+
+
+def set_wiimote_buttons(controller_id: int, inputs: dict, /) -> None:
+    wiimote_buttons[controller_id] = dict(inputs)
+
+
+def get_wii_classic_buttons(controller_id: int, /) -> dict:
+    return dict(wii_classic_buttons.get(controller_id, {}))
+
+
+def set_wii_classic_buttons(controller_id: int, inputs: dict, /) -> None:
+    wii_classic_buttons[controller_id] = dict(inputs)
+
+
+def get_wii_nunchuk_buttons(controller_id: int, /) -> dict:
+    return dict(wii_nunchuk_buttons.get(controller_id, {}))
+
+
+def set_wii_nunchuk_buttons(controller_id: int, inputs: dict, /) -> None:
+    wii_nunchuk_buttons[controller_id] = dict(inputs)
+
+
+def get_gba_buttons(controller_id: int, /) -> dict:
+    return dict(gba_buttons.get(controller_id, {}))
+
+
+def set_gba_buttons(controller_id: int, inputs: dict, /) -> None:
+    gba_buttons[controller_id] = dict(inputs)
@@ -0,0 +1,77 @@
+"""
+Fake dolphin.event. Callbacks are only called when frames are emitted through offline_dolphin.run.
+As in Dolphin, registering a callback replaces the previous one, and all registration functions work as decorators.
+"""
+
+import asyncio
+
+callbacks = {
+    "frameadvance": None,
+    "framedrawn": None,
+    "savestateload": None,
+    "memorybreakpoint": None,
+}
+waiters = {
+    "frameadvance": [],
+    "framedrawn": [],
+}
+
+
+def _register(name):
+    def on_event(callback):
+        callbacks[name] = callback
+        return callback
+
+    return on_event
+
+
+on_frameadvance = _register("frameadvance")
+on_framedrawn = _register("framedrawn")
+on_savestateload = _register("savestateload")
+on_memorybreakpoint = _register("memorybreakpoint")
+
+
+def _wait(name):
+    future = asyncio.get_running_loop().create_future()
+    waiters[name].append(future)
+    return future
+
+
+async def frameadvance() -> None:
+    await _wait("frameadvance")
+
+
+async def framedrawn() -> None:
+    await _wait("framedrawn")
+
+
+def system_reset() -> None:
+    pass
+
+
+def _notify(name, *args):
+    if callbacks[name] is not None:
+        callbacks[name](*args)
+    if name in waiters and waiters[name]:
+        pending, waiters[name] = waiters[name], []
+        for future in pending:
+            if not future.done():
+                future.set_result(None)
+
+
+def emit_frame(width: int, height: int, data: bytes) -> None:
+    _notify("framedrawn", width, height, data)
+    _notify("frameadvance")
+
+
+def emit_savestateload(from_slot: bool, slot: int) -> None:
+    _notify("savestateload", from_slot, slot)
+
+
+def synthetic_frame_source(width: int, height: int, n_frames: int = 4):
+    """
+    A few precomputed RGB frames, cycled through, so that frame generation does not weigh on benchmarks.
+    """
+    frames = [bytes((i * 37 + j) & 0xFF for j in range(256)) * (width * height * 3 // 256 + 1) for i in range(n_frames)]
+    frames = [frame[: width * height * 3] for frame in frames]
+    return lambda frame_index: frames[frame_index % n_frames]
@@ -0,0 +1,36 @@
+"""
+Fake dolphin.gui. Nothing is drawn, OSD messages are kept so that scripts printing through them can be inspected.
+"""
+
+display_size = (640.0, 528.0)
+osd_messages = []
+
+
+def add_osd_message(message: str, duration_ms: int = 2000, color: int = 0xFFFFFF30) -> None:
+    osd_messages.append(message)
+
+
+def clear_osd_messages() -> None:
+    osd_messages.clear()
+
+
+def get_display_size() -> tuple[float, float]:
+    return display_size
+
+
+def _ignore(*args, **kwargs) -> None:
+    pass
+
+
+draw_line = _ignore
+draw_rect = _ignore
+draw_rect_filled = _ignore
+draw_quad = _ignore
+draw_quad_filled = _ignore
+draw_triangle = _ignore
+draw_triangle_filled = _ignore
+draw_circle = _ignore
+draw_circle_filled = _ignore
+draw_text = _ignore
+draw_polyline = _ignore
+draw_convex_poly_filled = _ignore
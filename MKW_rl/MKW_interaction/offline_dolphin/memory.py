@@ -0,0 +1,111 @@
+"""
+Fake dolphin.memory backed by MEM1/MEM2 bytearray images, in the emulated machine's (big-endian) byte order.
+Reads outside of the loaded images return 0 and writes are ignored, as in Dolphin.
+"""
+
+import struct
+
+MEM1_SIZE = 0x01800000
+MEM2_SIZE = 0x04000000
+
+mem1 = bytearray(MEM1_SIZE)
+mem2 = bytearray(MEM2_SIZE)
+
+U8 = struct.Struct(">B")
+U16 = struct.Struct(">H")
+U32 = struct.Struct(">I")
+U64 = struct.Struct(">Q")
+S8 = struct.Struct(">b")
+S16 = struct.Struct(">h")
+S32 = struct.Struct(">i")
+S64 = struct.Struct(">q")
+F32 = struct.Struct(">f")
+F64 = struct.Struct(">d")
+
+
+def load_dump(mem1_path: str, mem2_path: str | None = None) -> None:
+    """
+    Loads raw memory dumps into the images. Missing bytes at the end of a short dump are zeroed.
+    """
+    with open(mem1_path, "rb") as f:
+        _fill(mem1, f.read())
+    if mem2_path is not None:
+        with open(mem2_path, "rb") as f:
+            _fill(mem2, f.read())
+
+
+def _fill(image: bytearray, data: bytes) -> None:
+    size = min(len(data), len(image))
+    image[:size] = data[:size]
+    image[size:] = bytes(len(image) - size)
+
+
+def _locate(addr: int, size: int):
+    """
+    Translates a virtual address (cached 0x8/0x9 or uncached 0xC/0xD segment) to (image, offset).
+    """
+    segment = addr >> 28
+    if segment in (0x8, 0xC):
+        image, offset = mem1, addr & 0x0FFFFFFF
+    elif segment in (0x9, 0xD):
+        image, offset = mem2, addr & 0x0FFFFFFF
+    else:
+        return None, 0
+    if offset + size > len(image):
+        return None, 0
+    return image, offset
+
+
+def _reader(layout: struct.Struct):
+    def read(addr: int, /):
+        image, offset = _locate(addr, layout.size)
+        if image is None:
+            return layout.unpack(bytes(layout.size))[0]
+        return layout.unpack_from(image, offset)[0]
+
+    return read
+
+
+def _writer(layout: struct.Struct, mask: int | None):
+    def write(addr: int, value, /) -> None:
+        image, offset = _locate(addr, layout.size)
+        if image is None:
+            return
+        if mask is not None:
+            # Overflowing values are truncated
+            value = value & mask
+            if layout.format[-1].islower() and value > mask >> 1:
+                value -= mask + 1
+        layout.pack_into(image, offset, value)
+
+    return write
+
+
+read_u8 = _reader(U8)
+read_u16 = _reader(U16)
+read_u32 = _reader(U32)
+read_u64 = _reader(U64)
+read_s8 = _reader(S8)
+read_s16 = _reader(S16)
+read_s32 = _reader(S32)
+read_s64 = _reader(S64)
+read_f32 = _reader(F32)
+read_f64 = _reader(F64)
+
+write_u8 = _writer(U8, 0xFF)
+write_u16 = _writer(U16, 0xFFFF)
+write_u32 = _writer(U32, 0xFFFFFFFF)
+write_u64 = _writer(U64, 0xFFFFFFFFFFFFFFFF)
+write_s8 = _writer(S8, 0xFF)
+write_s16 = _writer(S16, 0xFFFF)
+write_s32 = _writer(S32, 0xFFFFFFFF)
+write_s64 = _writer(S64, 0xFFFFFFFFFFFFFFFF)
+write_f32 = _writer(F32, None)
+write_f64 = _writer(F64, None)
+
+
+def read_bytes(addr: int, size: int, /) -> bytes:
+    image, offset = _locate(addr, size)
+    if image is None:
+        return bytes(size)
+    return bytes(image[offset : offset + size])
@@ -0,0 +1,53 @@
+"""
+Fake dolphin.savestate. A savestate is a copy of both memory images, slots are kept in memory.
+Loading a savestate emits the savestateload event, like Dolphin does.
+"""
+
+import struct
+
+from MKW_rl.MKW_interaction.offline_dolphin import event, memory
+
+HEADER = struct.Struct(">4sII")
+MAGIC = b"FKDS"
+
+slots = {}
+
+
+def save_to_bytes() -> bytes:
+    return HEADER.pack(MAGIC, len(memory.mem1), len(memory.mem2)) + bytes(memory.mem1) + bytes(memory.mem2)
+
+
+def load_from_bytes(state_bytes: bytes, /) -> None:
+    _load(state_bytes)
+    event.emit_savestateload(False, -1)
+
+
+def _load(state_bytes: bytes) -> None:
+    magic, mem1_size, mem2_size = HEADER.unpack_from(state_bytes)
+    if magic != MAGIC:
+        raise ValueError("Not an offline_dolphin savestate")
+    start = HEADER.size
+    memory.mem1[:] = state_bytes[start : start + mem1_size]
+    memory.mem2[:] = state_bytes[start + mem1_size : start + mem1_size + mem2_size]
+
+
+def save_to_slot(slot: int, /) -> None:
+    assert 0 <= slot < 100
+    slots[slot] = save_to_bytes()
+
+
+def load_from_slot(slot: int, /) -> None:
+    assert 0 <= slot < 100
+    _load(slots[slot])
+    event.emit_savestateload(True, slot)
+
+
+def save_to_file(filename: str, /) -> None:
+    with open(filename, "wb") as f:
+        f.write(save_to_bytes())
+
+
+def load_from_file(filename: str, /) -> None:
+    with open(filename, "rb") as f:
+        _load(f.read())
+    event.emit_savestateload(False, -1)
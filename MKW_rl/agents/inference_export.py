@@ -0,0 +1,109 @@
+"""
+This file contains the inference-only export of IQN_Network used by collectors, and its accuracy check.
+
+The export is a copy of the network in which:
+    - the Linear layers of float_feature_extractor, A_head and V_head can be dynamically quantized to int8. This only runs on CPU.
+    - img_head can run in float16 or bfloat16, with float32 inputs and outputs.
+iqn_fc stays in float32: its output only depends on tau and is cached by QuantileEmbeddingCache, see iqn.py.
+
+The export is made from the float32 network the collector pulls its weights into, and is refreshed after each pull that brought
+new weights. iqn_fc is refreshed in place, so that the quantile embedding cache sees the new weights; the other parts are rebuilt.
+"""
+
+import copy
+from typing import Optional
+
+import numpy as np
+import torch
+
+from MKW_rl.agents.iqn import IQN_Network
+from MKW_rl.MKW_interaction.MKW_state_layout import get_1d_state_floats
+
+QUANTIZED_HEADS = ("float_feature_extractor", "A_head", "V_head")
+
+
+class CastModule(torch.nn.Module):
+    """
+    Runs a module in dtype, with inputs and outputs in float32.
+    """
+
+    def __init__(self, module: torch.nn.Module, dtype: torch.dtype):
+        super().__init__()
+        self.module = module.to(dtype)
+        self.dtype = dtype
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return self.module(x.to(self.dtype)).float()
+
+
+class InferenceNetworkExport:
+    def __init__(self, network: IQN_Network, quantize_linear: bool, conv_head_dtype: Optional[torch.dtype]):
+        """
+        Args:
+            network:          the float32 network to export, usually the uncompiled network weights are pulled into
+            quantize_linear:  whether to quantize the Linear layers of the float head and of the dueling heads to int8
+            conv_head_dtype:  dtype of img_head, or None to keep it in float32
+        """
+        device = next(network.parameters()).device
+        if quantize_linear and device.type != "cpu":
+            raise ValueError(f"Dynamic int8 quantization only runs on CPU, the network is on {device}")
+        self.quantize_linear = quantize_linear
+        self.conv_head_dtype = conv_head_dtype
+        self.network = copy.deepcopy(network).eval()
+        self.refresh(network)
+
+    def refresh(self, network: IQN_Network):
+        """
+        Exports the current weights of network.
+        """
+        exported = self.network
+        with torch.no_grad():
+            exported.iqn_fc.load_state_dict(network.iqn_fc.state_dict())
+            img_head = copy.deepcopy(network.img_head)
+            exported.img_head = img_head if self.conv_head_dtype is None else CastModule(img_head, self.conv_head_dtype)
+            for name in QUANTIZED_HEADS:
+                head = copy.deepcopy(getattr(network, name))
+                if self.quantize_linear:
+                    head = torch.ao.quantization.quantize_dynamic(head, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+                setattr(exported, name, head)
+        exported.eval()
+
+
+def action_agreement(
+    reference_network: torch.nn.Module, network: torch.nn.Module, rollout_results: dict, iqn_k: int, batch_size: int = 256
+) -> float:
+    """
+    Rate at which network picks the same greedy action as reference_network on the states of a recorded rollout.
+    Both networks are evaluated on the same regularly spaced tau, so that the rate only reflects the export.
+    """
+    device = next(reference_network.parameters()).device
+    n_states = min(len(rollout_results["frames"]), len(rollout_results["state_float"]))
+    # The last frame is not an array when the race was finished
+    n_states -= not isinstance(rollout_results["frames"][n_states - 1], np.ndarray)
+    if n_states <= 0:
+        return float("nan")
+    tau = torch.linspace(0.05, 0.95, iqn_k, device=device)[:, None]
+    n_agreements = 0
+    with torch.no_grad():
+        for start in range(0, n_states, batch_size):
+            end = min(start + batch_size, n_states)
+            state_img_tensor = (
+                torch.from_numpy(np.stack(rollout_results["frames"][start:end])).to(
+                    device, memory_format=torch.channels_last, dtype=torch.float32
+                )
+                - 128
+            ) / 128
+            # Previous actions as the collector saw them, i.e. the actions chosen before each frame
+            state_floats = [get_1d_state_floats(rollout_results["state_float"][i], rollout_results["actions"][:i]) for i in range(start, end)]
+            state_float_tensor = torch.from_numpy(np.stack(state_floats)).to(device)
+            # Rows of the output are ordered by quantile, then by state
+            tau_batch = tau.repeat_interleave(end - start, dim=0)
+            greedy_actions = [
+                model(state_img_tensor, state_float_tensor, iqn_k, tau=tau_batch)[0]
+                .reshape(iqn_k, end - start, -1)
+                .mean(dim=0)
+                .argmax(dim=1)
+                for model in (reference_network, network)
+            ]
+            n_agreements += (greedy_actions[0] == greedy_actions[1]).sum().item()
+    return n_agreements / n_states
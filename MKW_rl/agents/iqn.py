@@ -2,6 +2,7 @@
 In this file, we define:
     - The IQN_Network class, which defines the neural network's structure.
     - The Trainer class, which implements the IQN training logic in method train_on_batch.
+    - The QuantileEmbeddingCache class, which caches the quantile embeddings of fixed tau for inference.
     - The Inferer class, which implements utilities for forward propagation with and without exploration.
 """
 
@@ -17,7 +18,8 @@ from torchrl.data import ReplayBuffer
 
 from config_files import config_copy
 from MKW_rl import utilities
-from MKW_rl.MKW_interaction import MKW_data_translate
+from MKW_rl.device_policy import DevicePolicy
+from MKW_rl.MKW_interaction import MKW_state_layout
 
 
 class IQN_Network(torch.nn.Module):
@@ -78,8 +80,9 @@ class IQN_Network(torch.nn.Module):
         self.n_actions = n_actions
 
         # States are not normalized when the method forward() is called. Normalization is done as the first step of the forward() method.
-        self.float_inputs_mean = torch.tensor(float_inputs_mean, dtype=torch.float32).to("cuda")
-        self.float_inputs_std = torch.tensor(float_inputs_std, dtype=torch.float32).to("cuda")
+        # Buffers follow the network to its device, but are not part of its state_dict: they come from the config.
+        self.register_buffer("float_inputs_mean", torch.tensor(float_inputs_mean, dtype=torch.float32), persistent=False)
+        self.register_buffer("float_inputs_std", torch.tensor(float_inputs_std, dtype=torch.float32), persistent=False)
 
     def initialize_weights(self):
         lrelu_neg_slope = 1e-2
@@ -94,8 +97,49 @@ class IQN_Network(torch.nn.Module):
         for module in [self.A_head[-1], self.V_head[-1]]:
             utilities.init_orthogonal(module)
 
+    @torch.jit.export
+    def sample_tau(self, batch_size: int, num_quantiles: int, device: torch.device) -> torch.Tensor:
+        """
+        Samples tau randomly in num_quantiles regularly spaced segments, and symmetrically around 0.5.
+
+        Returns:
+            tau: a torch.Tensor of shape (batch_size * num_quantiles, 1)
+        """
+        tau = (
+            torch.arange(num_quantiles // 2, device=device, dtype=torch.float32).repeat_interleave(batch_size).unsqueeze(1)
+            + torch.rand(size=(batch_size * num_quantiles // 2, 1), device=device, dtype=torch.float32)
+        ) / num_quantiles  # (batch_size * num_quantiles // 2, 1) (random numbers)
+        return torch.cat((tau, 1 - tau), dim=0)  # ensure that tau are sampled symmetrically
+
+    @torch.jit.export
+    def quantile_embedding(self, tau: torch.Tensor) -> torch.Tensor:
+        """
+        Embedding of the quantiles tau, which forward() multiplies with the embedding of the state.
+        It only depends on tau and on the weights of iqn_fc, so that it can be cached for fixed tau, see QuantileEmbeddingCache.
+
+        Args:
+            tau: a torch.Tensor of shape (batch_size * num_quantiles, 1)
+
+        Returns:
+            a torch.Tensor of shape (batch_size * num_quantiles, dense_input_dimension)
+        """
+        quantile_net = torch.cos(
+            torch.arange(1, self.iqn_embedding_dimension + 1, 1, device=tau.device) * math.pi * tau
+        )  # (batch_size*num_quantiles, 1)
+        quantile_net = quantile_net.expand(
+            [-1, self.iqn_embedding_dimension]
+        )  # (batch_size*num_quantiles, iqn_embedding_dimension) (still random numbers)
+        # (8 or 32 initial random numbers, expanded with cos to iqn_embedding_dimension)
+        # (batch_size*num_quantiles, dense_input_dimension)
+        return self.iqn_fc(quantile_net)
+
     def forward(
-        self, img: torch.Tensor, float_inputs: torch.Tensor, num_quantiles: int, tau: Optional[torch.Tensor] = None
+        self,
+        img: torch.Tensor,
+        float_inputs: torch.Tensor,
+        num_quantiles: int,
+        tau: Optional[torch.Tensor] = None,
+        quantile_embedding: Optional[torch.Tensor] = None,
     ) -> Tuple[torch.Tensor, torch.Tensor]:
         """
         This method implements the forward pass through the IQN neural network.
@@ -118,6 +162,7 @@ class IQN_Network(torch.nn.Module):
             num_quantiles: the number of quantiles, defined as N or N' in the IQN paper (https://arxiv.org/pdf/1806.06923).
             tau: if not None, a torch.Tensor of shape (batch_size * num_quantiles) the specifies the exact quantiles for which the neural network should return Q values
                  if None, the method will sample tau randomly in num_quantiles regularly spaced segments, and symmetrically around 0.5.
+            quantile_embedding: if not None, self.quantile_embedding(tau) computed beforehand. tau must then be given as well.
 
         Returns:
             Q: a torch.Tensor of shape (batch_size * num_quantiles, 1) representing the Q values for a given (state, quantile) combination
@@ -129,20 +174,12 @@ class IQN_Network(torch.nn.Module):
         float_outputs = self.float_feature_extractor((float_inputs - self.float_inputs_mean) / self.float_inputs_std)
         concat = torch.cat((img_outputs, float_outputs), 1)  # (batch_size, dense_input_dimension)
         if tau is None:
-            tau = (
-                torch.arange(num_quantiles // 2, device="cuda", dtype=torch.float32).repeat_interleave(batch_size).unsqueeze(1)
-                + torch.rand(size=(batch_size * num_quantiles // 2, 1), device="cuda", dtype=torch.float32)
-            ) / num_quantiles  # (batch_size * num_quantiles // 2, 1) (random numbers)
-            tau = torch.cat((tau, 1 - tau), dim=0)  # ensure that tau are sampled symmetrically
-        quantile_net = torch.cos(
-            torch.arange(1, self.iqn_embedding_dimension + 1, 1, device="cuda") * math.pi * tau
-        )  # (batch_size*num_quantiles, 1)
-        quantile_net = quantile_net.expand(
-            [-1, self.iqn_embedding_dimension]
-        )  # (batch_size*num_quantiles, iqn_embedding_dimension) (still random numbers)
-        # (8 or 32 initial random numbers, expanded with cos to iqn_embedding_dimension)
-        # (batch_size*num_quantiles, dense_input_dimension)
-        quantile_net = self.iqn_fc(quantile_net)
+            assert quantile_embedding is None
+            tau = self.sample_tau(batch_size, num_quantiles, img.device)
+        if quantile_embedding is None:
+            quantile_net = self.quantile_embedding(tau)
+        else:
+            quantile_net = quantile_embedding
         # (batch_size*num_quantiles, dense_input_dimension)
         concat = concat.repeat(num_quantiles, 1)
         # (batch_size*num_quantiles, dense_input_dimension)
@@ -202,6 +239,7 @@ class Trainer:
         "iqn_n",
         "typical_self_loss",
         "typical_clamped_self_loss",
+        "device_policy",
     )
 
     def __init__(
@@ -212,6 +250,7 @@ class Trainer:
         scaler: torch.amp.GradScaler,
         batch_size: int,
         iqn_n: int,
+        device_policy: DevicePolicy,
     ):
         self.online_network = online_network
         self.target_network = target_network
@@ -221,6 +260,7 @@ class Trainer:
         self.iqn_n = iqn_n
         self.typical_self_loss = 0.01
         self.typical_clamped_self_loss = 0.01
+        self.device_policy = device_policy
 
     def train_on_batch(self, buffer: ReplayBuffer, do_learn: bool):
         """
@@ -234,6 +274,7 @@ class Trainer:
 
         Args:
             buffer: a ReplayBuffer object from which transitions are sampled. Currently, handles a basic buffer or a prioritized replay buffer.
+                    May also be a BatchPrefetcher of such a buffer, which has the same sample() and update_priority() methods.
             do_learn: a boolean indicating whether steps 3 and 4 should be applied. If these are not applied, the method only returns total_loss and grad_norm for logging purposes.
 
         Returns:
@@ -243,7 +284,7 @@ class Trainer:
         """
         self.optimizer.zero_grad(set_to_none=True)
 
-        with torch.amp.autocast(device_type="cuda", dtype=torch.float16):
+        with self.device_policy.autocast():
             with torch.no_grad():
                 batch, batch_info = buffer.sample(self.batch_size, return_info=True)
                 (
@@ -256,7 +297,7 @@ class Trainer:
                     gammas_terminal,
                 ) = batch
                 if config_copy.prio_alpha > 0:
-                    IS_weights = torch.from_numpy(batch_info["_weight"]).to("cuda", non_blocking=True)
+                    IS_weights = self.device_policy.to_device(torch.from_numpy(batch_info["_weight"]))
 
                 rewards = rewards.unsqueeze(-1).repeat(
                     [self.iqn_n, 1]
@@ -359,6 +400,48 @@ class Trainer:
         return total_loss, grad_norm
 
 
+class QuantileEmbeddingCache:
+    """
+    Caches IQN_Network.quantile_embedding(tau) for tau tensors that are reused between inferences.
+
+    Entries are keyed by the tau tensor and a weight version, read from the version counters torch increments on every in-place
+    modification of a tensor: optimizer steps, load_state_dict() and SharedWeights.pull() all modify the weights in place.
+    An embedding is therefore computed again after each weight update, or if its tau tensor was modified.
+
+    Stochastic tau can be drawn from a pool of pre-sampled tau instead of being sampled at each inference,
+    so that their embeddings are cached as well.
+    """
+
+    __slots__ = ("network", "entries", "max_entries", "tau_pool")
+
+    def __init__(self, network: IQN_Network, max_entries: int = 8):
+        self.network = network
+        self.entries = {}  # id(tau) -> (tau, version, embedding). tau is kept so that its id is not reused.
+        self.max_entries = max_entries
+        self.tau_pool = []
+
+    def _version(self, tau: torch.Tensor) -> tuple:
+        return (tau._version, *(parameter._version for parameter in self.network.iqn_fc.parameters()))
+
+    def get(self, tau: torch.Tensor) -> torch.Tensor:
+        version = self._version(tau)
+        entry = self.entries.get(id(tau))
+        if entry is not None and entry[0] is tau and entry[1] == version:
+            return entry[2]
+        embedding = self.network.quantile_embedding(tau)
+        self.entries.pop(id(tau), None)
+        if len(self.entries) >= self.max_entries + len(self.tau_pool):
+            del self.entries[next(iter(self.entries))]  # Oldest entry
+        self.entries[id(tau)] = (tau, version, embedding)
+        return embedding
+
+    def fill_tau_pool(self, pool_size: int, num_quantiles: int, device: torch.device):
+        self.tau_pool = [self.network.sample_tau(1, num_quantiles, device) for _ in range(pool_size)]
+
+    def sample_tau(self) -> torch.Tensor:
+        return self.tau_pool[random.randrange(len(self.tau_pool))]
+
+
 class Inferer:
     __slots__ = (
         "inference_network",
@@ -367,15 +450,29 @@ class Inferer:
         "epsilon_boltzmann",
         "tau_epsilon_boltzmann",
         "is_explo",
+        "device_policy",
+        "quantile_embeddings",
+        "fixed_tau",
     )
 
-    def __init__(self, inference_network, iqn_k, tau_epsilon_boltzmann):
+    def __init__(self, inference_network, iqn_k, tau_epsilon_boltzmann, device_policy: DevicePolicy, tau_pool_size: int = 0):
+        """
+        With tau_pool_size > 0, inferences without tau draw their tau from a pool of tau_pool_size pre-sampled tau.
+        """
         self.inference_network = inference_network
         self.iqn_k = iqn_k
         self.epsilon = None
         self.epsilon_boltzmann = None
         self.tau_epsilon_boltzmann = tau_epsilon_boltzmann
         self.is_explo = None
+        self.device_policy = device_policy
+        self.quantile_embeddings = None
+        self.fixed_tau = None
+        if inference_network is not None:
+            self.quantile_embeddings = QuantileEmbeddingCache(inference_network)
+            self.quantile_embeddings.fill_tau_pool(tau_pool_size, iqn_k, device_policy.device)
+            # Regularly spaced tau, for statistics and figures. The same tensor is used each time so that its embedding is cached.
+            self.fixed_tau = torch.linspace(0.05, 0.95, iqn_k, device=device_policy.device)[:, None]
 
     def infer_network(self, img_inputs_uint8: npt.NDArray, float_inputs: npt.NDArray, tau=None) -> npt.NDArray:
         """
@@ -384,26 +481,30 @@ class Inferer:
         Args:
             img_inputs_uint8:   a numpy array of shape (1, H, W) and dtype np.uint8
             float_inputs:       a numpy array of shape (float_input_dim, ) and dtype np.float32
-            tau:                a torch.Tensor of shape (iqn_k,  1)
+            tau:                a torch.Tensor of shape (iqn_k,  1). Its quantile embedding is cached while it is not modified.
 
         Returns:
             q_values:           a numpy array of shape (iqn_k, 1)
         """
         with torch.no_grad():
+            if tau is None and self.quantile_embeddings.tau_pool:
+                tau = self.quantile_embeddings.sample_tau()
+            quantile_embedding = None if tau is None else self.quantile_embeddings.get(tau)
             state_img_tensor = (
                 torch.from_numpy(img_inputs_uint8)
                 .unsqueeze(0)
-                .to("cuda", memory_format=torch.channels_last, non_blocking=True, dtype=torch.float32)
+                .to(self.device_policy.device, memory_format=torch.channels_last, non_blocking=True, dtype=torch.float32)
                 - 128
             ) / 128
             # print("iqn inferer network :: inputs received:", img_inputs_uint8.shape, ": Floats: ", len(float_inputs))
-            state_float_tensor = torch.from_numpy(np.expand_dims(float_inputs, axis=0)).to("cuda", non_blocking=True)
+            state_float_tensor = torch.from_numpy(np.expand_dims(float_inputs, axis=0)).to(self.device_policy.device, non_blocking=True)
             q_values = (
                 self.inference_network(
                     state_img_tensor,
                     state_float_tensor,
                     self.iqn_k,
-                    tau=tau,  # torch.linspace(0.05, 0.95, self.iqn_k, device="cuda")[:, None],
+                    tau=tau,  # self.fixed_tau
+                    quantile_embedding=quantile_embedding,
                 )[0]
                 .cpu()
                 .numpy()
@@ -450,7 +551,7 @@ class Inferer:
         )
 
 
-def make_untrained_iqn_network(jit: bool, is_inference: bool) -> Tuple[IQN_Network, IQN_Network]:
+def make_untrained_iqn_network(jit: bool, is_inference: bool, device_policy: DevicePolicy) -> Tuple[IQN_Network, IQN_Network]:
     """
     Constructs two identical copies of the IQN network.
 
@@ -459,6 +560,7 @@ def make_untrained_iqn_network(jit: bool, is_inference: bool) -> Tuple[IQN_Netwo
 
     Args:
         jit: a boolean indicating whether compilation should be used
+        device_policy: the DevicePolicy giving the device of the networks
     """
 
     # TODO: Adjust float input dimension and mean/std to ideally dictionaries, or refactor to translate to list only when used
@@ -469,18 +571,22 @@ def make_untrained_iqn_network(jit: bool, is_inference: bool) -> Tuple[IQN_Netwo
         dense_hidden_dimension=config_copy.dense_hidden_dimension,
         iqn_embedding_dimension=config_copy.iqn_embedding_dimension,
         n_actions=len(config_copy.inputs),
-        float_inputs_mean=MKW_data_translate.float_input_mean,
-        float_inputs_std=MKW_data_translate.float_input_deviation,
+        float_inputs_mean=MKW_state_layout.float_input_mean,
+        float_inputs_std=MKW_state_layout.float_input_deviation,
     )
     if jit:
         if config_copy.is_linux:
-            compile_mode = None if "rocm" in torch.__version__ else ("max-autotune" if is_inference else "max-autotune-no-cudagraphs")
+            compile_mode = (
+                None
+                if "rocm" in torch.__version__ or not device_policy.is_cuda
+                else ("max-autotune" if is_inference else "max-autotune-no-cudagraphs")
+            )
             model = torch.compile(uncompiled_model, dynamic=False, mode=compile_mode)
         else:
             model = torch.jit.script(uncompiled_model)
     else:
         model = copy.deepcopy(uncompiled_model)
     return (
-        model.to(device="cuda", memory_format=torch.channels_last).train(),
-        uncompiled_model.to(device="cuda", memory_format=torch.channels_last).train(),
+        model.to(device=device_policy.device, memory_format=torch.channels_last).train(),
+        uncompiled_model.to(device=device_policy.device, memory_format=torch.channels_last).train(),
     )
@@ -63,7 +63,7 @@ def race_time_left_curves(rollout_results, inferer, save_dir, map_name):
             q_h = defaultdict(list)
             a_h = defaultdict(list)
 
-            tau = torch.linspace(0.05, 0.95, config_copy.iqn_k)[:, None].to("cuda")
+            tau = inferer.fixed_tau
             for j in x_axis:
                 # print(j)
                 rollout_results_copy["state_float"][frame_number][0] = j
@@ -109,7 +109,7 @@ def tau_curves(rollout_results, inferer, save_dir, map_name):
 
     rollout_results_copy = rollout_results.copy()
 
-    tau = torch.linspace(0.05, 0.95, config_copy.iqn_k)[:, None].to("cuda")
+    tau = inferer.fixed_tau
 
     n_best_actions_to_plot = 12
 
@@ -145,7 +145,7 @@ def patrick_curves(rollout_results, inferer, save_dir, map_name):
 
     rollout_results_copy = rollout_results.copy()
 
-    tau = torch.linspace(0.05, 0.95, config_copy.iqn_k)[:, None].to("cuda")
+    tau = inferer.fixed_tau
 
     horizons_to_plot = [140, 120, 100, 80, 60, 40, 20, 10]
 
@@ -190,7 +190,7 @@ def highest_prio_transitions(buffer, save_dir):
     shutil.rmtree(save_dir / "high_prio_figures", ignore_errors=True)
     (save_dir / "high_prio_figures").mkdir(parents=True, exist_ok=True)
 
-    prios = [buffer._sampler._sum_tree.at(i) for i in range(len(buffer))]
+    prios = buffer._sampler._sum_tree.priorities(len(buffer))
 
     for high_error_idx in np.argsort(prios)[-20:]:
         for idx in range(max(0, high_error_idx - 4), min(len(buffer) - 1, high_error_idx + 5)):
@@ -201,7 +201,7 @@ def highest_prio_transitions(buffer, save_dir):
             ).save(save_dir / "high_prio_figures" / f"{high_error_idx}_{idx}_{buffer._storage[idx].n_steps}_{prios[idx]:.2f}.png")
 
 
-def get_output_and_target_for_batch(batch, online_network, target_network, num_quantiles):
+def get_output_and_target_for_batch(batch, online_network, target_network, num_quantiles, device_policy):
     (
         state_img_tensor,
         state_float_tensor,
@@ -219,8 +219,8 @@ def get_output_and_target_for_batch(batch, online_network, target_network, num_q
     state_float_tensor[:, 0] = (0 - config_copy.float_inputs_mean[0]) / config_copy.float_inputs_std[0]
     next_state_float_tensor[:, 0] = state_float_tensor[:, 0] + delta
 
-    tau = torch.linspace(0, 1, num_quantiles, device="cuda").repeat_interleave(batch_size).unsqueeze(1)
-    with torch.amp.autocast(device_type="cuda", dtype=torch.float16):
+    tau = torch.linspace(0, 1, num_quantiles, device=device_policy.device).repeat_interleave(batch_size).unsqueeze(1)
+    with device_policy.autocast():
         with torch.no_grad():
             rewards = rewards.unsqueeze(-1).repeat(
                 [num_quantiles, 1]
@@ -264,13 +264,13 @@ def get_output_and_target_for_batch(batch, online_network, target_network, num_q
     )
 
 
-def loss_distribution(buffer, save_dir, online_network, target_network):
+def loss_distribution(buffer, save_dir, online_network, target_network, device_policy):
     shutil.rmtree(save_dir / "loss_distribution", ignore_errors=True)
     (save_dir / "loss_distribution").mkdir(parents=True, exist_ok=True)
     buffer_loss = []
     for batch in batched(range(len(buffer)), config_copy.batch_size):
         quantiles_output, quantiles_target, losses = get_output_and_target_for_batch(
-            buffer[batch], online_network, target_network, config_copy.iqn_n
+            buffer[batch], online_network, target_network, config_copy.iqn_n, device_policy
         )
         buffer_loss.extend(losses["real_loss"])
     buffer_loss = np.array(buffer_loss)
@@ -295,7 +295,7 @@ def loss_distribution(buffer, save_dir, online_network, target_network):
     plt.savefig(save_dir / "loss_distribution" / "loss_distribution_inverse_mean_units.png")
 
 
-def distribution_curves(buffer, save_dir, online_network, target_network):
+def distribution_curves(buffer, save_dir, online_network, target_network, device_policy):
     if config_copy.n_transitions_to_plot_in_distribution_curves <= 0:
         return
 
@@ -312,7 +312,7 @@ def distribution_curves(buffer, save_dir, online_network, target_network):
         fig, ax = plt.subplots(figsize=(640 / my_dpi, 480 / my_dpi), dpi=my_dpi)
 
         quantiles_output, quantiles_target, losses = get_output_and_target_for_batch(
-            buffer[[i]], online_network, target_network, num_quantiles
+            buffer[[i]], online_network, target_network, num_quantiles, device_policy
         )
 
         quantiles_output = np.sort(quantiles_output.ravel())
@@ -2,6 +2,12 @@
 This file's main entry point is the function fill_buffer_from_rollout_with_n_steps_rule().
 Its main inputs are a rollout_results object (obtained from a GameInstanceManager object), and a buffer to be filled.
 It reassembles the rollout_results object into transitions, as defined in /trackmania_rl/experience_replay/experience_replay_interface.py
+
+rollout_results can also be a chunk of a rollout sent while the race was running, see RolloutRecorder.chunk(). Consecutive chunks share
+their last "overlap" frames: a chunk that is not the last one only forms the transitions of its other frames, whose next states and
+rewards are all within the chunk. Chunks of a rollout give the same transitions as the whole rollout when overlap >= n_steps_max,
+except for terminal_actions: chunks other than the last one are sent before the race finishes, so their transitions hold math.inf
+instead of their distance to the finish. That distance is then more than n_steps_max, and the transitions are not terminal either way.
 """
 
 import math
@@ -14,7 +20,7 @@ from torchrl.data import ReplayBuffer
 from config_files import config_copy
 from MKW_rl.experience_replay.experience_replay_interface import Experience
 from MKW_rl.reward_shaping import speedslide_quality_tarmac
-from MKW_rl.MKW_interaction.MKW_data_translate import get_1d_state_floats
+from MKW_rl.MKW_interaction.MKW_state_layout import STATE_LAYOUT, get_rollout_state_floats
 
 
 # @jit(nopython=True)
@@ -47,6 +53,16 @@ def get_potential(state_float):
     ) + (config_copy.shaped_reward_point_to_vcp_ahead * (vector_vcp_to_vcp_further_ahead_normalized[2] - 1))
 
 
+def as_scalar_operand(column: np.ndarray, value) -> np.ndarray:
+    """
+    Returns column cast to the type NumPy gives to one of its values combined with the Python number value.
+    Rewards used to be computed one frame at a time, on NumPy scalars. Depending on the NumPy version, a float32 scalar
+    is promoted to float64 when combined with a Python float while a float32 array is not, so array operations on the cast
+    column round and compare exactly like the scalar operations did.
+    """
+    return column.astype(type(column.dtype.type(0) * value), copy=False)
+
+
 def fill_buffer_from_rollout_with_n_steps_rule(
     buffer: ReplayBuffer,
     buffer_test: ReplayBuffer,
@@ -62,6 +78,12 @@ def fill_buffer_from_rollout_with_n_steps_rule(
 ):
     assert len(rollout_results["frames"]) == len(rollout_results["current_zone_idx"])
     n_frames = len(rollout_results["frames"])
+    is_last_chunk = rollout_results.get("is_last_chunk", True)
+    # Transitions are formed for the first n_transitions frames
+    n_transitions = n_frames - 1 if is_last_chunk else n_frames - rollout_results["overlap"]
+    # One row per frame, see rollout_recorder
+    states = rollout_results["state_float"]
+    columns = rollout_results["state_float_columns"]
 
     number_memories_added_train = 0
     number_memories_added_test = 0
@@ -73,106 +95,111 @@ def fill_buffer_from_rollout_with_n_steps_rule(
         np.float32
     )  # Discount factor that will be placed in front of next_step in Bellman equation, depending on n_steps chosen
 
+    # Columns of the rollout, one value per frame
+    race_state = states[:, columns["race_data.state"]]
+    item_count = states[:, columns["race_data.item_count"]]
+    race_completion = rollout_results["race_completion"]
+    start_boost_charge = as_scalar_operand(states[:, columns["start_boost_charge"]], 0.95)
+    # The last frame of a chunk that is not the last one is not the last frame of the rollout
+    not_last = np.arange(n_frames) < (n_frames - 1 if is_last_chunk else n_frames)
+
     reward_into = np.zeros(n_frames)
-    for i in range(1, n_frames): # run for each frame of the rollout
-        """reward_into[i] += config_copy.constant_reward_per_ms * (
-            config_copy.f_per_action
-            if (i < n_frames - 1 or ("race_time" not in rollout_results)) # We haven't generated any frames, or the race has not started
-            else rollout_results["race_time"] - (n_frames - 2) * config_copy.f_per_action
-        )"""
-        if rollout_results["state_float"][i]["race_data"]["state"] == 2: # Only apply these rewards during the actual race (Not race finished, not during countdown timer)
-            reward_into[i] += config_copy.constant_reward_per_action
-            temp_completion_reward = (
-                rollout_results["race_completion"][i] - rollout_results["race_completion"][i - 1] # meters progressed (negative if backwards)
-            ) * config_copy.reward_per_m_advanced_along_centerline # Based on estimated time to lap completion
-
-            # discourage mushroom usage according to speed increase for the duration of the boost
-            # 83 > 120 = 40 speed increase. 1/3rd of progression. so, discount roughly 40% (?) of progression
-            if (rollout_results["state_float"][i]["boost_data"]["shroom_boost"] > 60
-                and temp_completion_reward > 0
-                and not rollout_results["state_float"][i]["surface_properties"]): # not on offroad, shouldn't have used shroom
-                temp_completion_reward = 0 # 0.6 (40% discount for speed increase) divided by 30/90 as we can't confirm source of boost outside that range
-
-            if rollout_results["state_float"][i]["race_data"]["item_count"] < rollout_results["state_float"][i - 1]["race_data"]["item_count"]:
-                # used item punish
-                reward_into[i] += config_copy.constant_reward_per_action * engineered_item_usage_reward
-
-            # LUIGI CIRCUIT FORCE SHORTCUT
-            if rollout_results["state_float"][i]["kart_data"]["position"][2] > config_copy.LC_punish_line:
-                reward_into[i] += config_copy.constant_reward_per_action * config_copy.LC_punish_rate # triple punishment
-            
-            reward_into[i] += temp_completion_reward
-
-            if i < n_frames - 1:
-                if engineered_close_to_vcp_reward != 0:
-                    reward_into[i] += engineered_close_to_vcp_reward * np.interp(max(config_copy.engineered_reward_min_dist_to_cur_vcp,
-                            min(config_copy.engineered_reward_max_dist_to_cur_vcp, np.linalg.norm(rollout_results["state_float"][i]["relative_zone_centers"][0])),
-                        ),
-                        [config_copy.engineered_reward_min_dist_to_cur_vcp, config_copy.engineered_reward_max_dist_to_cur_vcp],
-                        [0.5, -1]
-                    ) # normalizing to 1, -1 using np.interp so when we multiply by engineered reward we are reasonable
-
-                """if (math.floor(-(rollout_results["state_float"][i]["race_data"]["race_completion_max"] - 4))) > rollout_results["state_float"][i]["race_data"]["item_count"]:
-                    reward_into[i] -= (temp_completion_reward / 2) # less reward for you, you mushroomed too much"""
-                
-        if i < n_frames - 1: # apply these rewards even during countdown
-            """if config_copy.final_speed_reward_per_f_per_s != 0:
-                # car is driving forward
-                reward_into[i] += config_copy.final_speed_reward_per_f_per_s * (
-                    rollout_results["state_float"][i]["kart_data"]["speed"]
-                )
-            if engineered_button_A_pressed_reward != 0 and config_copy.inputs[rollout_results["actions"][i]]["A"] > 0 and config_copy.inputs[rollout_results["actions"][i]]["TriggerRight"] == 0:
-                reward_into[i] += engineered_button_A_pressed_reward
-
-            if engineered_item_usage_reward != 0 and config_copy.inputs[rollout_results["actions"][i]]["TriggerLeft"] > 0:
-                reward_into[i] += engineered_item_usage_reward
-
-            if engineered_speedslide_reward != 0 and np.all(rollout_results["state_float"][i][25:29]):
-                # all wheels touch the ground
-                reward_into[i] += engineered_speedslide_reward * max(
-                    0.0,
-                    1 - abs(speedslide_quality_tarmac(rollout_results["state_float"][i][56], rollout_results["state_float"][i][58]) - 1),
-                )  # TODO : indices 25:29, 56 and 58 are hardcoded, this is bad....
-
-            # lateral speed is higher than 2 meters per second
-            reward_into[i] += (
-                engineered_neoslide_reward if abs(rollout_results["state_float"][i][56]) >= 2.0 else 0
-            )  # TODO : 56 is hardcoded, this is bad....
-            # kamikaze reward
-            if (
-                engineered_kamikaze_reward != 0
-                and rollout_results["actions"][i] <= 2
-                or np.sum(rollout_results["state_float"][i][25:29]) <= 1
-            ):
-                reward_into[i] += engineered_kamikaze_reward"""
-
-            if (engineered_start_boost_reward != 0
-                and rollout_results["state_float"][i]["race_data"]["state"] == 1): # only reward start boost during countdown
-                # reward_into[i] += engineered_start_boost_reward * (rollout_results["state_float"][i]["start_boost_charge"] - .3)
-                if rollout_results["state_float"][i]["start_boost_charge"] > rollout_results["state_float"][i - 1]["start_boost_charge"]:
-                    reward_into[i] += engineered_start_boost_reward if rollout_results["state_float"][i]["start_boost_charge"] < 0.95 else -engineered_start_boost_reward
-                else:
-                    reward_into[i] += -engineered_start_boost_reward if rollout_results["state_float"][i]["start_boost_charge"] <= 0.925 else 0
-
-    for i in range(n_frames - 1):  # Loop over all frames that were generated
+    # Only apply these rewards during the actual race (Not race finished, not during countdown timer). Frame 0 gets no reward.
+    racing = race_state == 2
+    racing[0] = False
+    reward_into[racing] += config_copy.constant_reward_per_action
+
+    # meters progressed (negative if backwards), based on estimated time to lap completion
+    completion_diff = as_scalar_operand(race_completion[1:] - race_completion[:-1], config_copy.reward_per_m_advanced_along_centerline)
+    completion_reward = np.zeros(n_frames, dtype=completion_diff.dtype)
+    completion_reward[1:] = completion_diff * config_copy.reward_per_m_advanced_along_centerline
+    # discourage mushroom usage according to speed increase for the duration of the boost
+    # 83 > 120 = 40 speed increase. 1/3rd of progression. so, discount roughly 40% (?) of progression
+    completion_reward[
+        (states[:, columns["boost_data.shroom_boost"]] > 60)
+        & (completion_reward > 0)
+        & (states[:, columns["surface_properties"]] == 0) # not on offroad, shouldn't have used shroom
+    ] = 0
+
+    # used item punish
+    item_used = np.zeros(n_frames, dtype=bool)
+    item_used[1:] = item_count[1:] < item_count[:-1]
+    reward_into[racing & item_used] += config_copy.constant_reward_per_action * engineered_item_usage_reward
+
+    # LUIGI CIRCUIT FORCE SHORTCUT
+    kart_height = as_scalar_operand(states[:, columns["kart_data.position"]][:, 2], config_copy.LC_punish_line)
+    reward_into[racing & (kart_height > config_copy.LC_punish_line)] += config_copy.constant_reward_per_action * config_copy.LC_punish_rate # triple punishment
+
+    reward_into[racing] += completion_reward[racing]
+
+    if engineered_close_to_vcp_reward != 0:
+        # Distance to the first zone center ahead, normalizing to 1, -1 using np.interp so when we multiply by engineered reward we are reasonable
+        cur_vcp = states[:, columns["relative_zone_centers"]][:, 0:3]
+        distance_to_cur_vcp = np.sqrt(np.sum(np.square(cur_vcp), axis=1)).astype(np.float64)
+        distance_to_cur_vcp = np.fmax(
+            config_copy.engineered_reward_min_dist_to_cur_vcp, np.fmin(config_copy.engineered_reward_max_dist_to_cur_vcp, distance_to_cur_vcp)
+        )
+        reward_into[racing & not_last] += engineered_close_to_vcp_reward * np.interp(
+            distance_to_cur_vcp[racing & not_last],
+            [config_copy.engineered_reward_min_dist_to_cur_vcp, config_copy.engineered_reward_max_dist_to_cur_vcp],
+            [0.5, -1],
+        )
+
+    if engineered_start_boost_reward != 0:
+        # only reward start boost during countdown
+        counting_down = (race_state == 1) & not_last
+        counting_down[0] = False
+        charging = np.zeros(n_frames, dtype=bool)
+        charging[1:] = start_boost_charge[1:] > start_boost_charge[:-1]
+        start_boost_reward = np.where(
+            charging,
+            np.where(start_boost_charge < 0.95, engineered_start_boost_reward, -engineered_start_boost_reward),
+            np.where(start_boost_charge <= 0.925, -engineered_start_boost_reward, 0),
+        )
+        reward_into[counting_down] += start_boost_reward[counting_down]
+
+    # n_steps of every transition
+    n_steps_all = np.minimum(n_steps_max, n_frames - 1 - np.arange(n_transitions))
+    if discard_non_greedy_actions_in_nsteps:
+        # Stop at the first non-greedy action after the transition's own action
+        frame_idx = np.arange(n_frames)
+        next_non_greedy = np.minimum.accumulate(
+            np.where(rollout_results["action_was_greedy"], 2 * n_frames, frame_idx)[::-1]
+        )[::-1]
+        n_steps_all = np.minimum(n_steps_all, next_non_greedy[1 : n_transitions + 1] - frame_idx[:n_transitions])
+
+    # rewards_all[i, j] is the sum of the discounted rewards of steps 0 to j after frame i.
+    # Each partial sum is rounded to float32 before the next reward is added, as Experience.rewards always were.
+    discounted_rewards = np.lib.stride_tricks.sliding_window_view(np.concatenate((reward_into[1:], np.zeros(n_steps_max))), n_steps_max)[
+        :n_transitions
+    ] * np.array([gamma**j for j in range(n_steps_max)])
+    rewards_all = np.empty((n_transitions, n_steps_max), dtype=np.float32)
+    rewards_all[:, 0] = discounted_rewards[:, 0]
+    for j in range(1, n_steps_max):
+        rewards_all[:, j] = discounted_rewards[:, j] + rewards_all[:, j - 1].astype(np.float64)
+
+    # The states carry the previous actions as the collector's network saw them, i.e. the actions chosen before each frame.
+    # A chunk also holds the actions chosen before its first frame.
+    previous_actions = rollout_results.get("previous_actions", rollout_results["actions"][:0])
+    actions_before = np.concatenate((previous_actions, rollout_results["actions"]))
+    state_floats = get_rollout_state_floats(states, actions_before, len(previous_actions))
+    transition_idx = np.arange(n_transitions)
+    next_state_floats = state_floats[transition_idx + n_steps_all]
+    if "race_time" in rollout_results:
+        # The next state of a transition that reaches the finish is its own state, with the actions chosen until the finish
+        passed_finish = transition_idx + n_steps_all == n_frames - 1
+        next_state_floats[passed_finish, STATE_LAYOUT.state_float] = states[:n_transitions][passed_finish]
+
+    for i in range(n_transitions):  # Loop over all frames that were generated
         # Switch memory buffer sometimes
         if random.random() < 0.1:
             list_to_fill = Experiences_For_Buffer_Test if random.random() < config_copy.buffer_test_ratio else Experiences_For_Buffer
 
-        n_steps = min(n_steps_max, n_frames - 1 - i)
-        if discard_non_greedy_actions_in_nsteps:
-            try:
-                first_non_greedy = rollout_results["action_was_greedy"][i + 1 : i + n_steps].index(False) + 1
-                n_steps = min(n_steps, first_non_greedy)
-            except ValueError:
-                pass
+        n_steps = int(n_steps_all[i])
+        rewards = rewards_all[i]
 
-        rewards = np.empty(n_steps_max).astype(np.float32)
-        for j in range(n_steps):
-            rewards[j] = (gamma**j) * reward_into[i + j + 1] + (rewards[j - 1] if j >= 1 else 0)
-
-        state_img = rollout_results["frames"][i]
-        state_float = rollout_results["state_float"][i]
+        state_img = i  # Frames are referenced by their index in the rollout until they are added to the frame store
+        state_float = state_floats[i]
         #state_potential = get_potential(rollout_results["state_float"][i])
 
         # Get action that was played
@@ -181,17 +208,13 @@ def fill_buffer_from_rollout_with_n_steps_rule(
         next_state_has_passed_finish = ((i + n_steps) == (n_frames - 1)) and ("race_time" in rollout_results)
 
         if not next_state_has_passed_finish:
-            next_state_img = rollout_results["frames"][i + n_steps]
-            next_state_float = rollout_results["state_float"][i + n_steps]
+            next_state_img = i + n_steps
             # next_state_potential = get_potential(rollout_results["state_float"][i + n_steps])
         else:
             # It doesn't matter what next_state_img and next_state_float contain, as the transition will be forced to be final
             next_state_img = state_img
-            next_state_float = state_float
             #next_state_potential = 0
-
-        state_float = get_1d_state_floats(state_float, rollout_results["actions"])
-        next_state_float = get_1d_state_floats(next_state_float, rollout_results["actions"][:-1])
+        next_state_float = next_state_floats[i]
 
         list_to_fill.append(
             Experience(
@@ -210,11 +233,17 @@ def fill_buffer_from_rollout_with_n_steps_rule(
         )
     # print("Sum of rewards for this rollout:", sum(reward_into))
     number_memories_added_train += len(Experiences_For_Buffer)
+    if len(Experiences_For_Buffer) > 0:
+        with buffer._replay_lock:  # Batches may be gathered from the frame store by other threads
+            buffer._storage.add_rollout_frames(Experiences_For_Buffer, rollout_results["frames"])
     if len(Experiences_For_Buffer) > 1:
         buffer.extend(Experiences_For_Buffer)
     elif len(Experiences_For_Buffer) == 1:
         buffer.add(Experiences_For_Buffer[0])
     number_memories_added_test += len(Experiences_For_Buffer_Test)
+    if len(Experiences_For_Buffer_Test) > 0:
+        with buffer_test._replay_lock:  # Batches may be gathered from the frame store by other threads
+            buffer_test._storage.add_rollout_frames(Experiences_For_Buffer_Test, rollout_results["frames"])
     if len(Experiences_For_Buffer_Test) > 1:
         buffer_test.extend(Experiences_For_Buffer_Test)
     elif len(Experiences_For_Buffer_Test) == 1:
@@ -5,50 +5,35 @@ This is where the magic of "mini-races" or "clipped horizon average reward" is h
 
 import random
 from copy import deepcopy
-from operator import attrgetter
-from typing import Any, Dict, Union
+from functools import partial
+from pathlib import Path
+from typing import Any, Dict, Optional, Union
 
 import numpy as np
 import torch
 import torchvision.transforms.v2 as transforms
 from torch import Tensor
-from torchrl.data import ListStorage, ReplayBuffer
+from torchrl.data import ReplayBuffer
 from torchrl.data.replay_buffers.samplers import PrioritizedSampler, RandomSampler
 from torchrl.data.replay_buffers.storages import Storage
 from torchrl.data.replay_buffers.utils import INT_CLASSES, _to_numpy
 
 from config_files import config_copy
+from MKW_rl.device_policy import DevicePolicy
+from MKW_rl.experience_replay.array_storage import ExperienceArrayStorage
+from MKW_rl.experience_replay.sum_tree import SumTree
 
-to_torch_dtype = {
-    np.uint8: torch.uint8,
-    np.float32: torch.float32,
-    np.int64: torch.int64,
-    float: torch.float32,
-    int: torch.int,
-    np.float64: torch.float32,
-}
-
-
-def fast_collate_cpu(batch, attr_name):
-    elem = getattr(batch[0], attr_name)
-    elem_array = hasattr(elem, "__len__")
-    shape = (len(batch),) + (elem.shape if elem_array else ())
-    data_type = type(elem.flat[0] if elem_array else elem)
-    data_type = to_torch_dtype[data_type]
-    buffer = torch.empty(size=shape, dtype=data_type, pin_memory=True).numpy()
-    attr_getter = attrgetter(attr_name)
-    source = [attr_getter(memory) for memory in batch]
-    buffer[:] = source[:]
-    return buffer
-
-
-def send_to_gpu(batch, attr_name):
-    return torch.as_tensor(batch).to(
-        non_blocking=True, device="cuda", memory_format=torch.channels_last if "img" in attr_name else torch.preserve_format
+def send_to_gpu(batch, attr_name, device_policy: DevicePolicy):
+    return device_policy.to_device(
+        torch.as_tensor(batch), memory_format=torch.channels_last if "img" in attr_name else torch.preserve_format
     )
 
 
-def buffer_collate_function(batch):
+def collate_on_cpu(batch):
+    """
+    First half of buffer_collate_function: mini-race horizon resampling, and gathering of gammas and rewards.
+    batch is the dict of gathered fields returned by ExperienceArrayStorage.get, and is modified in place.
+    """
     (
         state_img,
         state_float,
@@ -62,22 +47,20 @@ def buffer_collate_function(batch):
         terminal_actions,
         n_steps,
     ) = tuple(
-        map(
-            lambda attr_name: fast_collate_cpu(batch, attr_name),
-            [
-                "state_img",
-                "state_float",
-                # "state_potential",
-                "action",
-                "rewards",
-                "next_state_img",
-                "next_state_float",
-                # "next_state_potential",
-                "gammas",
-                "terminal_actions",
-                "n_steps",
-            ],
-        )
+        batch[attr_name]
+        for attr_name in [
+            "state_img",
+            "state_float",
+            # "state_potential",
+            "action",
+            "rewards",
+            "next_state_img",
+            "next_state_float",
+            # "next_state_potential",
+            "gammas",
+            "terminal_actions",
+            "n_steps",
+        ]
     )
 
     temporal_mini_race_current_time_actions = (
@@ -113,18 +96,18 @@ def buffer_collate_function(batch):
     # rewards += np.where(terminal, 0, gammas * next_state_potential)
     # rewards -= state_potential
 
+    return state_img, state_float, action, rewards, next_state_img, next_state_float, gammas
+
+
+def send_batch_to_gpu(cpu_batch, device_policy: DevicePolicy):
+    """
+    Second half of buffer_collate_function: transfer of the arrays returned by collate_on_cpu to the device of device_policy,
+    then image normalization and augmentation.
+    """
     state_img, state_float, action, rewards, next_state_img, next_state_float, gammas = tuple(
         map(
-            lambda batch, attr_name: send_to_gpu(batch, attr_name),
-            [
-                state_img,
-                state_float,
-                action,
-                rewards,
-                next_state_img,
-                next_state_float,
-                gammas,
-            ],
+            lambda batch, attr_name: send_to_gpu(batch, attr_name, device_policy),
+            cpu_batch,
             [
                 "state_img",
                 "state_float",
@@ -137,8 +120,8 @@ def buffer_collate_function(batch):
         )
     )
 
-    state_img = (state_img.to(torch.float16) - 128) / 128
-    next_state_img = (next_state_img.to(torch.float16) - 128) / 128
+    state_img = (state_img.to(device_policy.img_dtype) - 128) / 128
+    next_state_img = (next_state_img.to(device_policy.img_dtype) - 128) / 128
 
     if config_copy.apply_randomcrop_augmentation:
         # Same transformation is applied for state and next_state.
@@ -171,6 +154,19 @@ def buffer_collate_function(batch):
     )
 
 
+def buffer_collate_function(batch, device_policy: DevicePolicy):
+    return send_batch_to_gpu(collate_on_cpu(batch), device_policy)
+
+
+class _UnusedMinTree:
+    """
+    Stands in for torchrl's min tree, which PrioritizedSampler._add_or_extend() keeps writing to. Sampling only uses the sum tree.
+    """
+
+    def __setitem__(self, index, value) -> None:
+        pass
+
+
 class CustomPrioritizedSampler(PrioritizedSampler):
     """
     Custom Prioritized Sampler which implements a slightly modified behavior compared to torchrl's original implementation.
@@ -194,6 +190,13 @@ class CustomPrioritizedSampler(PrioritizedSampler):
         self._default_priority_ratio = default_priority_ratio
         self._uninitialized_memories = 0.0
 
+    def _init(self) -> None:
+        # Sets what PrioritizedSampler._init() sets, without allocating torchrl's trees at full capacity.
+        # Array-backed, so that priorities can be read and written in bulk, see sum_tree.py
+        self._sum_tree = SumTree(self._max_capacity)
+        self._min_tree = _UnusedMinTree()
+        self._max_priority = None
+
     @property
     def default_priority(self) -> float:
         if self._average_priority is None:
@@ -278,22 +281,24 @@ class CustomPrioritizedSampler(PrioritizedSampler):
 def copy_buffer_content_to_other_buffer(source_buffer: ReplayBuffer, target_buffer: ReplayBuffer) -> None:
     assert source_buffer._storage.max_size <= target_buffer._storage.max_size
 
-    target_buffer.extend(source_buffer._storage._storage)
+    # Fields are copied as whole arrays, transitions keep their index
+    target_buffer._storage.copy_from(source_buffer._storage)
+    target_buffer._writer._cursor = len(source_buffer) % target_buffer._storage.max_size
 
     if isinstance(source_buffer._sampler, CustomPrioritizedSampler) and isinstance(target_buffer._sampler, CustomPrioritizedSampler):
         target_buffer._sampler._average_priority = source_buffer._sampler._average_priority
         target_buffer._sampler._uninitialized_memories = source_buffer._sampler._uninitialized_memories
+        target_buffer._sampler._sum_tree.set_priorities(source_buffer._sampler._sum_tree.priorities(len(source_buffer)))
 
-    if isinstance(source_buffer._sampler, PrioritizedSampler) and isinstance(target_buffer._sampler, PrioritizedSampler):
-        for i in range(len(source_buffer)):
-            target_buffer._sampler._sum_tree[i] = source_buffer._sampler._sum_tree.at(i)
 
-
-def make_buffers(buffer_size: int) -> tuple[ReplayBuffer, ReplayBuffer]:
+def make_buffers(buffer_size: int, device_policy: DevicePolicy, directory: Optional[Path] = None) -> tuple[ReplayBuffer, ReplayBuffer]:
+    """
+    With a directory, the buffers are kept in memory-mapped files in its "train" and "test" subdirectories, see array_storage.py
+    """
     buffer = ReplayBuffer(
-        storage=ListStorage(buffer_size),
+        storage=ExperienceArrayStorage(buffer_size, None if directory is None else directory / "train"),
         batch_size=config_copy.batch_size,
-        collate_fn=buffer_collate_function,
+        collate_fn=partial(buffer_collate_function, device_policy=device_policy),
         prefetch=1,
         sampler=CustomPrioritizedSampler(
             buffer_size, config_copy.prio_alpha, config_copy.prio_beta, config_copy.prio_epsilon, torch.float64
@@ -302,9 +307,9 @@ def make_buffers(buffer_size: int) -> tuple[ReplayBuffer, ReplayBuffer]:
         else RandomSampler(),
     )
     buffer_test = ReplayBuffer(
-        storage=ListStorage(int(buffer_size * config_copy.buffer_test_ratio)),
+        storage=ExperienceArrayStorage(int(buffer_size * config_copy.buffer_test_ratio), None if directory is None else directory / "test"),
         batch_size=config_copy.batch_size,
-        collate_fn=buffer_collate_function,
+        collate_fn=partial(buffer_collate_function, device_policy=device_policy),
         prefetch=1,
         sampler=CustomPrioritizedSampler(
             buffer_size, config_copy.prio_alpha, config_copy.prio_beta, config_copy.prio_epsilon, torch.float64
@@ -315,8 +320,41 @@ def make_buffers(buffer_size: int) -> tuple[ReplayBuffer, ReplayBuffer]:
     return buffer, buffer_test
 
 
-def resize_buffers(buffer: ReplayBuffer, buffer_test: ReplayBuffer, new_buffer_size: int) -> tuple[ReplayBuffer, ReplayBuffer]:
-    new_buffer, new_buffer_test = make_buffers(new_buffer_size)
+def resize_buffers(
+    buffer: ReplayBuffer, buffer_test: ReplayBuffer, new_buffer_size: int, device_policy: DevicePolicy, directory: Optional[Path] = None
+) -> tuple[ReplayBuffer, ReplayBuffer]:
+    new_buffer, new_buffer_test = make_buffers(new_buffer_size, device_policy, directory)
     copy_buffer_content_to_other_buffer(buffer, new_buffer)
     copy_buffer_content_to_other_buffer(buffer_test, new_buffer_test)
     return new_buffer, new_buffer_test
+
+
+def save_buffer(buffer: ReplayBuffer) -> None:
+    """
+    Saves a buffer made with a directory, along with its write cursor and priorities, so that load_buffer() can reattach it.
+    """
+    header = {"writer_cursor": buffer._writer._cursor}
+    if isinstance(buffer._sampler, CustomPrioritizedSampler):
+        header["priorities"] = buffer._sampler._sum_tree.priorities(len(buffer)).copy()
+        header["average_priority"] = buffer._sampler._average_priority
+        header["uninitialized_memories"] = buffer._sampler._uninitialized_memories
+    buffer._storage.save(**header)
+
+
+def load_buffer(buffer: ReplayBuffer) -> bool:
+    """
+    Reattaches a buffer made with a directory to the files of its last save. Returns False if there was no save for a buffer of this size.
+    """
+    header = buffer._storage.attach()
+    if header is None:
+        return False
+    buffer._writer._cursor = header["writer_cursor"]
+    if isinstance(buffer._sampler, CustomPrioritizedSampler) and "average_priority" in header:
+        priorities = header["priorities"]
+        # The storage may have been saved again after its frame store grew, with the priorities of the previous save
+        default_priority = priorities.mean() if len(priorities) > 0 else 1.0
+        priorities = np.concatenate((priorities, np.full(len(buffer) - len(priorities), default_priority)))[: len(buffer)]
+        buffer._sampler._sum_tree.set_priorities(priorities)
+        buffer._sampler._average_priority = header["average_priority"]
+        buffer._sampler._uninitialized_memories = header["uninitialized_memories"]
+    return True
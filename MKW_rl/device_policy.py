@@ -0,0 +1,61 @@
+"""
+This file contains the DevicePolicy, which decides where the networks run and in which precision they are trained.
+
+On CUDA, training runs under float16 autocast with a gradient scaler, and images of training batches are sent as float16.
+On CPU, training runs under bfloat16 autocast, or in float32 if amp_dtype is None, without gradient scaler: bfloat16 has the
+exponent range of float32, gradients do not underflow.
+Inference always runs in float32.
+
+The policy is built from config.py by DevicePolicy.from_config(), and given to the networks, Trainer, Inferer and batch collation.
+"""
+
+import contextlib
+from typing import Optional
+
+import torch
+
+from config_files import config_copy
+
+
+class DevicePolicy:
+    __slots__ = ("device", "amp_dtype")
+
+    def __init__(self, device, amp_dtype: Optional[torch.dtype]):
+        self.device = torch.device(device)
+        self.amp_dtype = amp_dtype
+
+    @classmethod
+    def from_config(cls) -> "DevicePolicy":
+        if torch.device(config_copy.device).type == "cuda":
+            return cls(config_copy.device, torch.float16)
+        return cls(config_copy.device, torch.bfloat16 if config_copy.cpu_autocast_bfloat16 else None)
+
+    @property
+    def is_cuda(self) -> bool:
+        return self.device.type == "cuda"
+
+    @property
+    def img_dtype(self) -> torch.dtype:
+        """
+        dtype of the normalized images of training batches.
+        """
+        return torch.float32 if self.amp_dtype is None else self.amp_dtype
+
+    def autocast(self):
+        if self.amp_dtype is None:
+            return contextlib.nullcontext()
+        return torch.amp.autocast(device_type=self.device.type, dtype=self.amp_dtype)
+
+    def make_grad_scaler(self) -> torch.amp.GradScaler:
+        # A disabled scaler passes through: scale() returns the loss, step() calls optimizer.step(), its state_dict is empty
+        return torch.amp.GradScaler(self.device.type, enabled=self.amp_dtype == torch.float16)
+
+    def to_device(self, tensor: torch.Tensor, **kwargs) -> torch.Tensor:
+        """
+        Sends a CPU tensor to the device. On CPU the tensor is copied, as it usually views memory that is reused afterwards.
+        """
+        return tensor.to(self.device, non_blocking=self.is_cuda, copy=not self.is_cuda, **kwargs)
+
+    def synchronize(self):
+        if self.is_cuda:
+            torch.cuda.synchronize(self.device)
@@ -0,0 +1,248 @@
+"""
+This file contains the ExperienceArrayStorage, the storage of our replay buffers.
+
+Transitions are given to the buffer as Experience objects, but are stored as one preallocated NumPy array per field.
+Frames are kept once in a FrameStore, the state_img and next_state_img arrays hold frame ids.
+Sampling a batch is one gather per field into pinned memory, buffer_collate_function receives a dict of these arrays.
+
+With a directory, fields and frames are memory-mapped .npy files in that directory. save() flushes them and writes a header
+with the length of the storage, the frame store counters, and whatever the caller adds (write cursor, priorities).
+The header is replaced atomically, so a crash leaves the header of the last save, which attach() reads back.
+Files are named after their size, so resizing a storage or growing its frame store never overwrites the files of the last save.
+"""
+
+import copy
+import os
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import joblib
+import numpy as np
+import torch
+from torchrl.data import ListStorage
+from torchrl.data.replay_buffers.utils import INT_CLASSES, _to_numpy
+
+from MKW_rl.experience_replay.experience_replay_interface import Experience
+from MKW_rl.experience_replay.frame_store import FrameStore
+
+FRAME_ATTRIBUTES = ("state_img", "next_state_img")
+
+# dtype of the array of each Experience field. Frames are stored as frame ids.
+FIELD_DTYPES = {
+    "state_img": np.int64,
+    "state_float": np.float32,
+    "action": np.int64,
+    "n_steps": np.int64,
+    "rewards": np.float32,
+    "next_state_img": np.int64,
+    "next_state_float": np.float32,
+    "gammas": np.float32,
+    "terminal_actions": np.float32,
+}
+
+to_torch_dtype = {
+    np.dtype(np.uint8): torch.uint8,
+    np.dtype(np.int64): torch.int64,
+    np.dtype(np.float32): torch.float32,
+}
+
+
+def pinned_empty(shape, dtype) -> np.ndarray:
+    # Pinned memory requires CUDA, batches are not transferred anyway on hosts without it
+    return torch.empty(size=shape, dtype=to_torch_dtype[np.dtype(dtype)], pin_memory=torch.cuda.is_available()).numpy()
+
+
+class ExperienceArrayStorage(ListStorage):
+    """
+    Subclasses ListStorage for the replay buffer plumbing, but does not use its list.
+    """
+
+    HEADER_NAME = "header.joblib"
+
+    def __init__(self, max_size: int, directory: Optional[Path] = None):
+        super().__init__(max_size)
+        self.directory = directory
+        if directory is not None:
+            directory.mkdir(parents=True, exist_ok=True)
+        self.frame_store = FrameStore(max_size, directory=directory)
+        self.fields: Dict[str, np.ndarray] = None  # Allocated with the first transition, once the field shapes are known
+        self.length = 0
+        self.saved_header = {}  # Arguments of the last save()
+        if directory is not None:
+            self.frame_store.on_grow = self._save_after_growth
+
+    def __len__(self) -> int:
+        return self.length
+
+    def _field_file_name(self, name: str) -> str:
+        return f"{name}_{self.max_size}.npy"
+
+    def _new_field(self, name: str, shape, dtype) -> np.ndarray:
+        if self.directory is None:
+            return np.empty((self.max_size, *shape), dtype=dtype)
+        return np.lib.format.open_memmap(self.directory / self._field_file_name(name), mode="w+", dtype=dtype, shape=(self.max_size, *shape))
+
+    def _allocate(self, experience: Experience):
+        self.fields = {name: self._new_field(name, np.shape(getattr(experience, name)), dtype) for name, dtype in FIELD_DTYPES.items()}
+
+    def field(self, name: str) -> np.ndarray:
+        """
+        Stored part of a field, as a view.
+        """
+        return self.fields[name][: self.length]
+
+    def add_rollout_frames(self, experiences: List[Experience], frames: np.ndarray):
+        """
+        experiences hold indices in frames instead of frames, as built by buffer_management.
+        Adds the frames they reference to the frame store, and replaces those indices by frame ids.
+        """
+        rollout_frame_idx = np.array([[experience.state_img, experience.next_state_img] for experience in experiences], dtype=np.int64)
+        used_frame_idx, inverse = np.unique(rollout_frame_idx, return_inverse=True)
+        frame_ids = self.frame_store.add(frames[used_frame_idx])[inverse.reshape(rollout_frame_idx.shape)]
+        for experience, (state_img, next_state_img) in zip(experiences, frame_ids.tolist()):
+            experience.state_img = state_img
+            experience.next_state_img = next_state_img
+
+    def copy_from(self, other: "ExperienceArrayStorage"):
+        """
+        Takes over the transitions and frames of another storage, which must not be used anymore. Transitions keep their index.
+        """
+        assert other.max_size <= self.max_size
+        self.frame_store = other.frame_store
+        self.saved_header = other.saved_header
+        if self.directory is not None:
+            self.frame_store.on_grow = self._save_after_growth
+        self.length = other.length
+        if other.fields is not None:
+            self.fields = {name: self._new_field(name, field.shape[1:], field.dtype) for name, field in other.fields.items()}
+            for name, field in self.fields.items():
+                field[: self.length] = other.field(name)
+
+    def set(self, cursor, data, *args, **kwargs):
+        if isinstance(cursor, INT_CLASSES):
+            cursor = [cursor]
+            data = [data]
+        cursor = np.asarray(_to_numpy(cursor), dtype=np.int64)
+        if self.fields is None:
+            self._allocate(data[0])
+
+        overwritten = cursor[cursor < self.length]
+        for name in FRAME_ATTRIBUTES:
+            self.frame_store.release(self.fields[name][overwritten])
+        for name, field in self.fields.items():
+            field[cursor] = [getattr(experience, name) for experience in data]
+        for name in FRAME_ATTRIBUTES:
+            self.frame_store.retain(self.fields[name][cursor])
+        self.length = max(self.length, int(cursor.max()) + 1)
+
+    def get(self, index):
+        if isinstance(index, INT_CLASSES):
+            # Single transitions are read for analysis, they are given as an Experience with its frames
+            if not -self.length <= index < self.length:
+                raise IndexError(f"Index {index} out of range for a storage of length {self.length}")
+            experience = Experience.__new__(Experience)
+            for name, field in self.fields.items():
+                value = field[index]
+                setattr(experience, name, self.frame_store.get(value).copy() if name in FRAME_ATTRIBUTES else copy.copy(value))
+            return experience
+        if isinstance(index, tuple):
+            index = index[0]
+        if isinstance(index, slice):
+            index = np.arange(self.length)[index]
+        return self.gather(index)
+
+    def gather(self, index, out: Optional[Dict[str, np.ndarray]] = None) -> Dict[str, np.ndarray]:
+        """
+        Gathers each field of the transitions at index in a single operation, into out if given, else into new pinned arrays.
+        Frames are gathered here too, so this must be called while the replay buffer holds its lock.
+        """
+        index = np.asarray(_to_numpy(index), dtype=np.int64)
+        if out is None:
+            out = {}
+            for name, field in self.fields.items():
+                source = self.frame_store.frames if name in FRAME_ATTRIBUTES else field
+                out[name] = pinned_empty((len(index), *source.shape[1:]), source.dtype)
+        for name, field in self.fields.items():
+            if name in FRAME_ATTRIBUTES:
+                self.frame_store.gather(field[index], out=out[name])
+            else:
+                np.take(field, index, axis=0, out=out[name])
+        return out
+
+    def save(self, **header):
+        """
+        Flushes the memory-mapped files and writes the header, then removes the files the header does not use anymore.
+        """
+        assert self.directory is not None
+        self.saved_header = dict(header)
+        file_names = {self.HEADER_NAME}
+        if self.fields is not None:
+            for name, field in self.fields.items():
+                field.flush()
+                file_names.add(self._field_file_name(name))
+        if self.frame_store.frames is not None:
+            self.frame_store.frames.flush()
+            file_names.add(self.frame_store.file_name)
+        header.update(
+            max_size=self.max_size,
+            length=self.length,
+            fields=self.fields is not None,
+            frames_file=self.frame_store.file_name if self.frame_store.frames is not None else None,
+            next_frame_id=self.frame_store.next_id,
+        )
+        temporary_header_path = self.directory / (self.HEADER_NAME + ".tmp")
+        joblib.dump(header, temporary_header_path)
+        os.replace(temporary_header_path, self.directory / self.HEADER_NAME)
+        self._remove_unused_files(file_names)
+
+    def _save_after_growth(self):
+        # New frames go to the new file from now on, the header must point to it.
+        # The write cursor and priorities are those of the last save, which only changes the order of the next overwrites.
+        self.save(**self.saved_header)
+
+    def _remove_unused_files(self, file_names):
+        for path in self.directory.glob("*.npy"):
+            if path.name not in file_names:
+                try:
+                    path.unlink()
+                except OSError:
+                    # Still mapped by an array that was not collected yet, it will be removed by the next save
+                    pass
+
+    def attach(self) -> dict:
+        """
+        Reopens the files of the last save. Returns the header, or None if there is no save for a storage of this size.
+        Transitions written after the last save are kept when they are within its length: the frame store file they
+        reference is the one in the header, as the header is saved again whenever the frame store grows.
+        """
+        assert self.directory is not None
+        try:
+            header = joblib.load(self.directory / self.HEADER_NAME)
+        except FileNotFoundError:
+            return None
+        if header["max_size"] != self.max_size:
+            return None
+        if header["fields"]:
+            self.fields = {name: np.load(self.directory / self._field_file_name(name), mmap_mode="r+") for name in FIELD_DTYPES}
+            self.length = header["length"]
+        if header["frames_file"] is not None:
+            stored_frame_ids = np.concatenate([self.field(name) for name in FRAME_ATTRIBUTES])
+            self.frame_store.attach(np.load(self.directory / header["frames_file"], mmap_mode="r+"), header["next_frame_id"], stored_frame_ids)
+        self.saved_header = {key: header[key] for key in header if key not in ("max_size", "length", "fields", "frames_file", "next_frame_id")}
+        # Files of a frame store that grew after the last save, or of a resize that was not saved
+        self._remove_unused_files({self.HEADER_NAME, header["frames_file"], *(self._field_file_name(name) for name in FIELD_DTYPES)})
+        return header
+
+    def state_dict(self):
+        return {"fields": self.fields, "length": self.length, "frame_store": self.frame_store}
+
+    def load_state_dict(self, state_dict):
+        self.fields = state_dict["fields"]
+        self.length = state_dict["length"]
+        self.frame_store = state_dict["frame_store"]
+
+    def _empty(self):
+        self.frame_store = FrameStore(self.max_size, directory=self.directory)
+        if self.directory is not None:
+            self.frame_store.on_grow = self._save_after_growth
+        self.length = 0
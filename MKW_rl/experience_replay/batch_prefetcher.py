@@ -0,0 +1,80 @@
+"""
+This file contains the BatchPrefetcher, which samples and collates batches in background threads while the learner trains.
+
+Worker threads sample indices and gather the transitions under the replay buffer's lock, then run collate_on_cpu.
+Batches are gathered into a pool of pinned arrays that is allocated once. A pool slot is reused only after the CUDA
+copies reading it are complete.
+Batches are handed out in the order they were sampled. Priority updates go through the learner thread in that same order,
+under the replay buffer's lock, so the sampler never reads a sum tree that is being updated.
+
+The BatchPrefetcher has the sample() and update_priority() methods of a ReplayBuffer that Trainer.train_on_batch uses.
+"""
+
+import queue
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import torch
+from torchrl.data import ReplayBuffer
+
+from MKW_rl.buffer_utilities import collate_on_cpu, send_batch_to_gpu
+from MKW_rl.device_policy import DevicePolicy
+
+
+class _PoolSlot:
+    __slots__ = ("arrays", "copied")
+
+    def __init__(self):
+        self.arrays = None  # Pinned arrays of one gathered batch, allocated by the first batch
+        self.copied = None  # CUDA event recorded after the copies from this slot to the GPU. Copies to the CPU are synchronous.
+
+
+class BatchPrefetcher:
+    def __init__(self, buffer: ReplayBuffer, batch_size: int, n_threads: int, n_batches_ready: int, device_policy: DevicePolicy):
+        assert n_threads >= 1 and n_batches_ready >= 1
+        self.buffer = buffer
+        self.device_policy = device_policy
+        self.batch_size = batch_size
+        self.n_batches_ready = n_batches_ready
+        self.executor = ThreadPoolExecutor(max_workers=n_threads, thread_name_prefix="batch_prefetcher")
+        # One slot more than the batches kept ready: the batch being copied to the GPU keeps its slot until the copy is done
+        self.free_slots = queue.Queue()
+        for _ in range(n_batches_ready + 1):
+            self.free_slots.put(_PoolSlot())
+        self.pending = deque()
+
+    def _prepare_batch(self):
+        slot = self.free_slots.get()
+        if slot.copied is not None:
+            slot.copied.synchronize()
+        if slot.arrays is not None and len(slot.arrays["action"]) != self.batch_size:
+            slot.arrays = None
+        with self.buffer._replay_lock:
+            index, info = self.buffer._sampler.sample(self.buffer._storage, self.batch_size)
+            info["index"] = index
+            slot.arrays = self.buffer._storage.gather(index, out=slot.arrays)
+        return slot, collate_on_cpu(slot.arrays), info
+
+    def sample(self, batch_size: Optional[int] = None, return_info: bool = False):
+        if batch_size is not None:
+            self.batch_size = batch_size
+        while len(self.pending) < self.n_batches_ready + 1:
+            self.pending.append(self.executor.submit(self._prepare_batch))
+        slot, cpu_batch, info = self.pending.popleft().result()
+        batch = send_batch_to_gpu(cpu_batch, self.device_policy)
+        if self.device_policy.is_cuda:
+            slot.copied = torch.cuda.Event()
+            slot.copied.record()
+        self.free_slots.put(slot)
+        return (batch, info) if return_info else batch
+
+    def update_priority(self, index, priority):
+        self.buffer.update_priority(index, priority)
+
+    def close(self):
+        """
+        Waits for the batches being prepared, which must be done before the buffer is replaced.
+        """
+        self.executor.shutdown(wait=True)
+        self.pending.clear()
@@ -13,6 +13,7 @@ class Experience:
                                                 state_float is a np.array of shape (config.float_input_dim, ) and dtype np.float32
     (next_state_img, next_state_float):         represent "next_state"
                                                 next_state_img is a np.array of shape (1, H, W) and dtype np.uint8
+                                                In buffer_management, they hold the index of the frame in the rollout until the frames are added to the buffer's frame store
                                                 next_state_float is a np.array of shape (config.float_input_dim, ) and dtype np.float32
     (state_potential and next_state_potential)  are floats, used for reward shaping as per Andrew Ng's paper: https://people.eecs.berkeley.edu/~russell/papers/icml99-shaping.pdf
     action                                      is an integer representing the action taken for this transition, mapped to config_files/inputs_list.py
@@ -0,0 +1,101 @@
+"""
+This file contains the FrameStore, which keeps each frame of a replay buffer once.
+
+Consecutive transitions of a rollout overlap: the next_state_img of a transition is the state_img of a transition n_steps later.
+Transitions stored in an ExperienceArrayStorage do not hold their frames, state_img and next_state_img are integer frame ids instead.
+Frames are appended to a ring of uint8 arrays once per rollout, and each frame counts the stored transitions that reference it.
+A frame is reclaimed when no stored transition references it anymore, i.e. when the transitions that used it were evicted.
+
+Frame ids increase with every frame added, the slot of a frame in the ring is its id modulo the ring capacity.
+With a directory, the ring is a memory-mapped .npy file named after its capacity. Growing the ring writes a new file and
+calls on_grow, with which ExperienceArrayStorage saves a header pointing to the new file and removes the previous one.
+"""
+
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+
+class FrameStore:
+    def __init__(self, initial_capacity: int, growth_factor: float = 1.25, directory: Optional[Path] = None):
+        self.capacity = max(1, initial_capacity)
+        self.growth_factor = growth_factor
+        self.directory = directory
+        self.on_grow = None
+        self.frames = None  # Allocated with the first frames, once their shape is known
+        self.reference_counts = np.zeros(self.capacity, dtype=np.int32)
+        self.first_live_id = 0  # Frames before this id are free
+        self.next_id = 0
+
+    def __len__(self) -> int:
+        return self.next_id - self.first_live_id
+
+    def _reclaim(self):
+        while self.first_live_id < self.next_id and self.reference_counts[self.first_live_id % self.capacity] == 0:
+            self.first_live_id += 1
+
+    @property
+    def file_name(self) -> str:
+        return f"frames_{self.capacity}.npy"
+
+    def _new_frames(self, capacity: int, frame_shape) -> np.ndarray:
+        if self.directory is None:
+            return np.empty((capacity, *frame_shape), dtype=np.uint8)
+        return np.lib.format.open_memmap(self.directory / f"frames_{capacity}.npy", mode="w+", dtype=np.uint8, shape=(capacity, *frame_shape))
+
+    def attach(self, frames: np.ndarray, next_id: int, stored_frame_ids: np.ndarray):
+        """
+        Uses frames saved by a previous run. Reference counts are recomputed from the frame ids of the stored transitions,
+        as transitions written after the last save may reference frames added after it.
+        """
+        self.frames = frames
+        self.capacity = len(frames)
+        self.reference_counts = np.bincount(stored_frame_ids % self.capacity, minlength=self.capacity).astype(np.int32)
+        self.first_live_id = int(stored_frame_ids.min()) if len(stored_frame_ids) > 0 else next_id
+        self.next_id = max(next_id, int(stored_frame_ids.max()) + 1 if len(stored_frame_ids) > 0 else 0)
+
+    def _grow(self, min_capacity: int):
+        capacity = max(min_capacity, int(self.capacity * self.growth_factor))
+        live_ids = np.arange(self.first_live_id, self.next_id)
+        frames = self._new_frames(capacity, self.frames.shape[1:])
+        frames[live_ids % capacity] = self.frames[live_ids % self.capacity]
+        reference_counts = np.zeros(capacity, dtype=np.int32)
+        reference_counts[live_ids % capacity] = self.reference_counts[live_ids % self.capacity]
+        self.frames = frames
+        self.reference_counts = reference_counts
+        self.capacity = capacity
+        if self.on_grow is not None:
+            self.on_grow()
+
+    def add(self, frames: np.ndarray) -> np.ndarray:
+        """
+        Appends frames to the ring, and returns their ids.
+        Frames are free until a stored transition references them, so they must be referenced before the next call to add().
+        """
+        if self.frames is None:
+            self.frames = self._new_frames(self.capacity, frames.shape[1:])
+        self._reclaim()
+        if len(self) + len(frames) > self.capacity:
+            # Live frames are still referenced by stored transitions, they can't be overwritten
+            self._grow(len(self) + len(frames))
+        ids = np.arange(self.next_id, self.next_id + len(frames))
+        self.frames[ids % self.capacity] = frames
+        self.next_id += len(frames)
+        return ids
+
+    def retain(self, frame_ids: np.ndarray):
+        # A frame id may appear more than once, np.add.at counts every occurrence
+        np.add.at(self.reference_counts, frame_ids % self.capacity, 1)
+
+    def release(self, frame_ids: np.ndarray):
+        np.subtract.at(self.reference_counts, frame_ids % self.capacity, 1)
+
+    def clear_references(self):
+        self.reference_counts[:] = 0
+
+    def get(self, frame_id: int) -> np.ndarray:
+        return self.frames[frame_id % self.capacity]
+
+    def gather(self, frame_ids, out: np.ndarray) -> np.ndarray:
+        return np.take(self.frames, np.asarray(frame_ids) % self.capacity, axis=0, out=out)
@@ -0,0 +1,117 @@
+"""
+This file contains the SumTree used by CustomPrioritizedSampler, in place of torchrl's SumSegmentTree.
+
+The tree is a flat NumPy array: node i has children 2 * i and 2 * i + 1, leaves start at index `capacity`, the root is node 1.
+Leaves hold the priorities, so that priorities() is a view and whole-buffer reads are a slice instead of a loop of at(i).
+Batch updates and prefix-sum searches run in numba kernels. Parents are recomputed from their children, never updated by
+differences, so the tree does not drift.
+It keeps the interface of torchrl's segment trees that the samplers use: [] with ints or arrays, query() and scan_lower_bound().
+"""
+
+from typing import Optional
+
+import numba
+import numpy as np
+
+
+@numba.njit(cache=True)
+def _set_leaves(tree: np.ndarray, capacity: int, indices: np.ndarray, values: np.ndarray):
+    for k in range(len(indices)):
+        node = capacity + indices[k]
+        tree[node] = values[k]
+        node //= 2
+        while node >= 1:
+            tree[node] = tree[2 * node] + tree[2 * node + 1]
+            node //= 2
+
+
+@numba.njit(cache=True)
+def _scan_lower_bound(tree: np.ndarray, capacity: int, size: int, masses: np.ndarray) -> np.ndarray:
+    # Smallest index whose inclusive prefix sum is >= mass, or size if mass exceeds the total
+    indices = np.empty(len(masses), dtype=np.int64)
+    for k in range(len(masses)):
+        mass = masses[k]
+        if mass > tree[1]:
+            indices[k] = size
+            continue
+        node = 1
+        while node < capacity:
+            left = 2 * node
+            if mass <= tree[left]:
+                node = left
+            else:
+                mass -= tree[left]
+                node = left + 1
+        indices[k] = node - capacity
+    return indices
+
+
+@numba.njit(cache=True)
+def _query(tree: np.ndarray, capacity: int, start: int, end: int) -> float:
+    # Sum of the leaves in [start, end)
+    result = 0.0
+    start += capacity
+    end += capacity
+    while start < end:
+        if start & 1:
+            result += tree[start]
+            start += 1
+        if end & 1:
+            end -= 1
+            result += tree[end]
+        start //= 2
+        end //= 2
+    return result
+
+
+class SumTree:
+    def __init__(self, size: int, dtype=np.float64):
+        self.size = size
+        self.capacity = 1
+        while self.capacity < size:
+            self.capacity *= 2
+        self.tree = np.zeros(2 * self.capacity, dtype=dtype)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return self.tree[self.capacity + index]
+        return self.tree[self.capacity + np.asarray(index, dtype=np.int64)]
+
+    def __setitem__(self, index, value):
+        indices = np.atleast_1d(np.asarray(index, dtype=np.int64))
+        values = np.broadcast_to(np.asarray(value, dtype=self.tree.dtype), indices.shape)
+        _set_leaves(self.tree, self.capacity, np.ascontiguousarray(indices), np.ascontiguousarray(values))
+
+    def at(self, index: int) -> float:
+        return self.tree[self.capacity + index]
+
+    def priorities(self, length: Optional[int] = None) -> np.ndarray:
+        """
+        Leaves of the tree, as a view. Writing to it requires a rebuild().
+        """
+        return self.tree[self.capacity : self.capacity + (self.size if length is None else length)]
+
+    def set_priorities(self, values: np.ndarray):
+        """
+        Sets the first len(values) leaves, then rebuilds the tree in O(n).
+        """
+        self.priorities(len(values))[:] = values
+        self.rebuild()
+
+    def rebuild(self):
+        level_start = self.capacity // 2
+        while level_start >= 1:
+            children = self.tree[2 * level_start : 4 * level_start]
+            self.tree[level_start : 2 * level_start] = children[0::2] + children[1::2]
+            level_start //= 2
+
+    def query(self, start: int, end: int) -> float:
+        return _query(self.tree, self.capacity, start, end)
+
+    def scan_lower_bound(self, mass):
+        if np.ndim(mass) == 0:
+            return int(_scan_lower_bound(self.tree, self.capacity, self.size, np.array([mass], dtype=self.tree.dtype))[0])
+        return _scan_lower_bound(self.tree, self.capacity, self.size, np.asarray(mass, dtype=self.tree.dtype))
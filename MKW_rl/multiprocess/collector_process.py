@@ -4,6 +4,7 @@ This file implements a single multithreaded worker that handles a Trackmania gam
 
 import importlib
 import time
+from functools import partial
 from itertools import chain, count, cycle
 from pathlib import Path
 
@@ -14,12 +15,20 @@ from torch import multiprocessing as mp
 from config_files import config_copy
 from MKW_rl import utilities
 from MKW_rl.agents import iqn as iqn
+from MKW_rl.agents.inference_export import InferenceNetworkExport, action_agreement
+from MKW_rl.device_policy import DevicePolicy
+from MKW_rl.multiprocess.inference_server import RemoteInferer
+
+
+def send_rollout_chunk(rollout_queue, fill_buffer, is_explo, map_name, map_status, loop_number, rollout_chunk):
+    # The learner fills its buffer from the chunk as it arrives, the end of race stats come with the last chunk
+    rollout_queue.put((rollout_chunk, None, fill_buffer, is_explo, map_name, map_status, None, loop_number))
 
 
 def collector_process_fn(
     rollout_queue,
-    uncompiled_shared_network,
-    shared_network_lock,
+    shared_weights,
+    inference_client,
     game_spawning_lock,
     shared_steps: mp.Value, # type: ignore # because it's fine at runtime so i wish to be rid of the warning
     base_dir: Path,
@@ -40,23 +49,52 @@ def collector_process_fn(
         process_number=process_number,
     )
 
-    inference_network, uncompiled_inference_network = iqn.make_untrained_iqn_network(config_copy.use_jit, is_inference=True)
-    try:
-        inference_network.load_state_dict(torch.load(f=save_dir / "weights1.torch", weights_only=False))
-    except Exception as e:
-        print("Worker could not load weights, exception:", e)
+    if inference_client is None:
+        device_policy = DevicePolicy.from_config()
+        inference_network, uncompiled_inference_network = iqn.make_untrained_iqn_network(
+            config_copy.use_jit, is_inference=True, device_policy=device_policy
+        )
+        try:
+            inference_network.load_state_dict(torch.load(f=save_dir / "weights1.torch", weights_only=False))
+        except Exception as e:
+            print("Worker could not load weights, exception:", e)
+
+        inference_export = None
+        if config_copy.inference_quantize_linear or config_copy.inference_conv_head_dtype is not None:
+            # Actions are chosen by a reduced-precision copy of the network, exported again whenever new weights are pulled
+            inference_export = InferenceNetworkExport(
+                uncompiled_inference_network,
+                config_copy.inference_quantize_linear,
+                None if config_copy.inference_conv_head_dtype is None else getattr(torch, config_copy.inference_conv_head_dtype),
+            )
+
+        inferer = iqn.Inferer(
+            inference_network if inference_export is None else inference_export.network,
+            config_copy.iqn_k,
+            config_copy.tau_epsilon_boltzmann,
+            device_policy,
+            config_copy.inference_tau_pool_size,
+        )
 
-    inferer = iqn.Inferer(inference_network, config_copy.iqn_k, config_copy.tau_epsilon_boltzmann)
+        def update_network():
+            # Update weights of the inference network, if the learner sent new ones
+            if shared_weights.pull(uncompiled_inference_network) and inference_export is not None:
+                inference_export.refresh(uncompiled_inference_network)
 
-    def update_network():
-        # Update weights of the inference network
-        with shared_network_lock:
-            uncompiled_inference_network.load_state_dict(uncompiled_shared_network.state_dict())
+    else:
+        # Inferences are run by the inference server of the learner process, which also keeps the weights up to date
+        inference_network = None
+        inference_export = None
+        inferer = RemoteInferer(inference_client, config_copy.iqn_k, config_copy.tau_epsilon_boltzmann)
+
+        def update_network():
+            pass
 
     # ========================================================
     # Training loop
     # ========================================================
-    inference_network.train()
+    if inference_network is not None:
+        inference_network.train()
 
     map_cycle_str = str(config_copy.map_cycle)
     set_maps_trained, set_maps_blind = analyze_map_cycle(config_copy.map_cycle)
@@ -76,74 +114,100 @@ def collector_process_fn(
 
     time_since_last_queue_push = time.perf_counter()
     last_loop_finished = False
-    for loop_number in count(1):
-        importlib.reload(config_copy)
-
-        mkw.max_minirace_duration_f = config_copy.cutoff_rollout_if_no_vcp_passed_within_duration_f
-
-        # ===============================================
-        #   DID THE CYCLE CHANGE ?
-        # ===============================================
-        if str(config_copy.map_cycle) != map_cycle_str:
-            map_cycle_str = str(config_copy.map_cycle)
-            set_maps_trained, set_maps_blind = analyze_map_cycle(config_copy.map_cycle)
-            map_cycle_iter = cycle(chain(*config_copy.map_cycle))
-
-        # ===============================================
-        #   GET NEXT MAP FROM CYCLE
-        # ===============================================
-        next_map_tuple = next(map_cycle_iter)
-        if next_map_tuple[2] != zone_centers_filename:
-            zone_centers = load_next_map_zone_centers(next_map_tuple[2], base_dir)
-        map_name, map_path, zone_centers_filename, is_explo, fill_buffer = next_map_tuple
-        map_status = "trained" if map_name in set_maps_trained else "blind"
-
-        inferer.epsilon = utilities.from_exponential_schedule(config_copy.epsilon_schedule, shared_steps.value)
-        inferer.epsilon_boltzmann = utilities.from_exponential_schedule(config_copy.epsilon_boltzmann_schedule, shared_steps.value)
-        inferer.tau_epsilon_boltzmann = config_copy.tau_epsilon_boltzmann
-        inferer.is_explo = is_explo
-
-        # ===============================================
-        #   PLAY ONE ROUND
-        # ===============================================
-
-        rollout_start_time = time.perf_counter()
-
-        if inference_network.training and not is_explo:
-            inference_network.eval()
-        elif is_explo and not inference_network.training:
-            inference_network.train()
-
-        update_network()
-
-        rollout_start_time = time.perf_counter()
-        rollout_results, end_race_stats = mkw.rollout(
-            exploration_policy=inferer.get_exploration_action,
-            savestate_path=map_path,
-            zone_centers=zone_centers,
-            update_network=update_network,
-            last_loop_finished=last_loop_finished,
-        )
-        rollout_end_time = time.perf_counter()
-        rollout_duration = rollout_end_time - rollout_start_time
-        rollout_results["worker_time_in_rollout_percentage"] = rollout_duration / (time.perf_counter() - time_since_last_queue_push)
-        if end_race_stats["race_finished"]:
-            last_loop_finished = True
-        else:
-            last_loop_finished = False
-        time_since_last_queue_push = time.perf_counter()
-        print("", flush=True)
-
-        if not mkw.last_rollout_crashed:
-            rollout_queue.put(
-                (
-                    rollout_results,
-                    end_race_stats,
-                    fill_buffer,
-                    is_explo,
-                    map_name,
-                    map_status,
-                    rollout_duration,
-                    loop_number,
-                )
+    try:
+        for loop_number in count(1):
+            importlib.reload(config_copy)
+
+            mkw.max_minirace_duration_f = config_copy.cutoff_rollout_if_no_vcp_passed_within_duration_f
+
+            # ===============================================
+            #   DID THE CYCLE CHANGE ?
+            # ===============================================
+            if str(config_copy.map_cycle) != map_cycle_str:
+                map_cycle_str = str(config_copy.map_cycle)
+                set_maps_trained, set_maps_blind = analyze_map_cycle(config_copy.map_cycle)
+                map_cycle_iter = cycle(chain(*config_copy.map_cycle))
+
+            # ===============================================
+            #   GET NEXT MAP FROM CYCLE
+            # ===============================================
+            next_map_tuple = next(map_cycle_iter)
+            if next_map_tuple[2] != zone_centers_filename:
+                zone_centers = load_next_map_zone_centers(next_map_tuple[2], base_dir)
+            map_name, map_path, zone_centers_filename, is_explo, fill_buffer = next_map_tuple
+            map_status = "trained" if map_name in set_maps_trained else "blind"
+
+            inferer.epsilon = utilities.from_exponential_schedule(config_copy.epsilon_schedule, shared_steps.value)
+            inferer.epsilon_boltzmann = utilities.from_exponential_schedule(config_copy.epsilon_boltzmann_schedule, shared_steps.value)
+            inferer.tau_epsilon_boltzmann = config_copy.tau_epsilon_boltzmann
+            inferer.is_explo = is_explo
+
+            # ===============================================
+            #   PLAY ONE ROUND
+            # ===============================================
+
+            rollout_start_time = time.perf_counter()
+
+            if inference_network is not None:
+                if inference_network.training and not is_explo:
+                    inference_network.eval()
+                elif is_explo and not inference_network.training:
+                    inference_network.train()
+
+            update_network()
+
+            send_chunk = None
+            if config_copy.rollout_chunk_size > 0:
+                send_chunk = partial(send_rollout_chunk, rollout_queue, fill_buffer, is_explo, map_name, map_status, loop_number)
+
+            rollout_start_time = time.perf_counter()
+            rollout_results, end_race_stats = mkw.rollout(
+                exploration_policy=inferer.get_exploration_action,
+                savestate_path=map_path,
+                zone_centers=zone_centers,
+                update_network=update_network,
+                last_loop_finished=last_loop_finished,
+                is_explo=is_explo,
+                send_chunk=send_chunk,
             )
+            rollout_end_time = time.perf_counter()
+            rollout_duration = rollout_end_time - rollout_start_time
+            rollout_results["worker_time_in_rollout_percentage"] = rollout_duration / (time.perf_counter() - time_since_last_queue_push)
+            if end_race_stats["race_finished"]:
+                last_loop_finished = True
+            else:
+                last_loop_finished = False
+            time_since_last_queue_push = time.perf_counter()
+            print("", flush=True)
+
+            if (
+                inference_export is not None
+                and not mkw.last_rollout_crashed
+                and loop_number % config_copy.inference_export_check_every_n_rollouts == 0
+            ):
+                end_race_stats["inference_export_action_agreement"] = action_agreement(
+                    uncompiled_inference_network, inference_export.network, rollout_results, config_copy.iqn_k
+                )
+                agreement = end_race_stats["inference_export_action_agreement"]
+                print(f"Inference export agrees with the float32 network on {100 * agreement:.1f}% of actions")
+
+            if "last_chunk" in rollout_results:
+                # The learner got the other frames with the previous chunks
+                rollout_results = {key: value for key, value in rollout_results.items() if key not in ("frames", "state_float")}
+
+            if not mkw.last_rollout_crashed:
+                rollout_queue.put(
+                    (
+                        rollout_results,
+                        end_race_stats,
+                        fill_buffer,
+                        is_explo,
+                        map_name,
+                        map_status,
+                        rollout_duration,
+                        loop_number,
+                    )
+                )
+    finally:
+        # Removes the shared memory ring, which would otherwise only be reported as leaked when the process exits
+        mkw.close()
@@ -0,0 +1,160 @@
+"""
+This file contains the InferenceServer, which runs the inferences of all collector processes in a thread of the learner process.
+
+Each collector has a request slot in tensors shared between processes: its frame, its floats, and the q_values of the answer.
+A collector fills its slot, puts its index in the request queue and waits for its semaphore.
+The server thread takes a first request, then the requests that arrive within max_wait seconds of it, runs one forward pass
+on the whole batch, writes each answer to its slot and releases the semaphores of the collectors in the batch.
+Before each batch the server pulls the weights published to the SharedWeights, so collectors need neither a network nor weight updates.
+If the server thread fails, it marks the server as failed and releases every collector, whose inferences then raise instead of waiting.
+
+The server works on the device of its network, on CPU as well as on GPU. A compiled network is compiled once for each batch size.
+"""
+
+import queue
+import threading
+import time
+import traceback
+from typing import Optional
+
+import numpy.typing as npt
+import torch
+from torch import multiprocessing as mp
+
+from config_files import config_copy
+from MKW_rl.agents.iqn import Inferer
+from MKW_rl.multiprocess.shared_weights import SharedWeights
+
+
+class InferenceClient:
+    """
+    The part of the InferenceServer given to a collector process.
+    """
+
+    def __init__(
+        self, index: int, img: torch.Tensor, float_inputs: torch.Tensor, q_values: torch.Tensor, requests: mp.Queue, response, failed
+    ):
+        self.index = index
+        self.img = img
+        self.float_inputs = float_inputs
+        self.q_values = q_values
+        self.requests = requests
+        self.response = response
+        self.failed = failed
+
+    def _check_server(self):
+        if self.failed.is_set():
+            raise RuntimeError("The inference server has failed, see the output of the learner process")
+
+    def infer(self, img_inputs_uint8: npt.NDArray, float_inputs: npt.NDArray) -> npt.NDArray:
+        self._check_server()
+        self.img.copy_(torch.from_numpy(img_inputs_uint8))
+        self.float_inputs.copy_(torch.from_numpy(float_inputs))
+        self.requests.put(self.index)
+        self.response.acquire()
+        self._check_server()
+        return self.q_values.numpy().copy()
+
+
+class RemoteInferer(Inferer):
+    """
+    Inferer whose inferences are run by the InferenceServer.
+    """
+
+    __slots__ = ("client",)
+
+    def __init__(self, client: InferenceClient, iqn_k, tau_epsilon_boltzmann):
+        super().__init__(None, iqn_k, tau_epsilon_boltzmann, None)
+        self.client = client
+
+    def infer_network(self, img_inputs_uint8: npt.NDArray, float_inputs: npt.NDArray, tau=None) -> npt.NDArray:
+        assert tau is None, "The inference server samples tau itself"
+        return self.client.infer(img_inputs_uint8, float_inputs)
+
+
+class InferenceServer:
+    def __init__(
+        self,
+        network: torch.nn.Module,
+        uncompiled_network: torch.nn.Module,
+        shared_weights: Optional[SharedWeights],
+        n_clients: int,
+        max_wait: float,
+    ):
+        """
+        Args:
+            network:            the network used for inference
+            uncompiled_network: the uncompiled copy of network, in which weights are pulled
+            shared_weights:     weights published by the learner, or None to keep the weights of network
+            n_clients:          the number of collector processes
+            max_wait:           how long a batch waits for more requests after its first one, in seconds
+        """
+        self.network = network
+        self.uncompiled_network = uncompiled_network
+        self.shared_weights = shared_weights
+        self.n_clients = n_clients
+        self.max_wait = max_wait
+        self.iqn_k = config_copy.iqn_k
+        self.device = next(network.parameters()).device
+        self.img = torch.zeros((n_clients, 1, config_copy.H_downsized, config_copy.W_downsized), dtype=torch.uint8).share_memory_()
+        self.float_inputs = torch.zeros((n_clients, config_copy.float_input_dim), dtype=torch.float32).share_memory_()
+        self.q_values = torch.zeros((n_clients, self.iqn_k, len(config_copy.inputs)), dtype=torch.float32).share_memory_()
+        self.requests = mp.Queue()
+        self.responses = [mp.Semaphore(0) for _ in range(n_clients)]
+        self.failed = mp.Event()
+        self.thread = threading.Thread(target=self._serve, name="inference_server", daemon=True)
+
+    def client(self, index: int) -> InferenceClient:
+        """
+        Must be given to the collector process when it is started.
+        """
+        return InferenceClient(
+            index, self.img[index], self.float_inputs[index], self.q_values[index], self.requests, self.responses[index], self.failed
+        )
+
+    def start(self):
+        self.thread.start()
+
+    def close(self):
+        self.requests.put(None)
+        self.thread.join()
+
+    def _next_batch(self) -> Optional[list]:
+        indices = [self.requests.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(indices) < self.n_clients and indices[-1] is not None:
+            try:
+                indices.append(self.requests.get(timeout=max(0.0, deadline - time.perf_counter())))
+            except queue.Empty:
+                break
+        if None in indices:
+            return None
+        return indices
+
+    def _serve(self):
+        try:
+            self._serve_batches()
+        except BaseException:
+            traceback.print_exc()
+            # Collectors waiting for an answer, or asking for one later, would otherwise wait forever
+            self.failed.set()
+            for response in self.responses:
+                response.release()
+
+    def _serve_batches(self):
+        while True:
+            indices = self._next_batch()
+            if indices is None:
+                return
+            if self.shared_weights is not None:
+                self.shared_weights.pull(self.uncompiled_network)
+            with torch.no_grad():
+                state_img_tensor = (
+                    self.img[indices].to(self.device, memory_format=torch.channels_last, non_blocking=True, dtype=torch.float32) - 128
+                ) / 128
+                state_float_tensor = self.float_inputs[indices].to(self.device, non_blocking=True)
+                # Rows of the output are ordered by quantile, then by state
+                q_values = self.network(state_img_tensor, state_float_tensor, self.iqn_k)[0].reshape(self.iqn_k, len(indices), -1)
+                self.q_values[indices] = q_values.transpose(0, 1).to("cpu", dtype=torch.float32)
+            for index in indices:
+                self.responses[index].release()
@@ -32,15 +32,17 @@ from MKW_rl.analysis_metrics import (
     race_time_left_curves,
     tau_curves,
 )
-from MKW_rl.buffer_utilities import make_buffers, resize_buffers
+from MKW_rl.buffer_utilities import load_buffer, make_buffers, resize_buffers, save_buffer
+from MKW_rl.device_policy import DevicePolicy
+from MKW_rl.experience_replay.batch_prefetcher import BatchPrefetcher
 from MKW_rl.map_reference_times import reference_times
-from MKW_rl.MKW_interaction import MKW_data_translate
+from MKW_rl.multiprocess.shared_weights import SharedWeights
+from MKW_rl.MKW_interaction import MKW_state_layout
 
 
 def learner_process_fn(
     rollout_queues,
-    uncompiled_shared_network,
-    shared_network_lock,
+    shared_weights: SharedWeights,
     shared_steps: mp.Value, # type: ignore
     base_dir: Path,
     save_dir: Path,
@@ -113,8 +115,9 @@ def learner_process_fn(
     # Create new stuff
     # ========================================================
 
-    online_network, uncompiled_online_network = make_untrained_iqn_network(config_copy.use_jit, is_inference=False)
-    target_network, _ = make_untrained_iqn_network(config_copy.use_jit, is_inference=False)
+    device_policy = DevicePolicy.from_config()
+    online_network, uncompiled_online_network = make_untrained_iqn_network(config_copy.use_jit, False, device_policy)
+    target_network, _ = make_untrained_iqn_network(config_copy.use_jit, False, device_policy)
 
     print(online_network)
     utilities.count_parameters(online_network)
@@ -141,8 +144,7 @@ def learner_process_fn(
     except:
         print(" Learner could not load weights")
 
-    with shared_network_lock:
-        uncompiled_shared_network.load_state_dict(uncompiled_online_network.state_dict())
+    shared_weights.publish(uncompiled_online_network)
 
     # noinspection PyBroadException
     try:
@@ -169,11 +171,17 @@ def learner_process_fn(
     )
     # optimizer1 = torch_optimizer.Lookahead(optimizer1, k=5, alpha=0.5)
 
-    scaler = torch.amp.GradScaler("cuda")
+    scaler = device_policy.make_grad_scaler()
     memory_size, memory_size_start_learn = utilities.from_staircase_schedule(
         config_copy.memory_size_schedule, accumulated_stats["cumul_number_memories_generated"]
     )
-    buffer, buffer_test = make_buffers(memory_size)
+    replay_buffer_dir = save_dir / "replay_buffer" if config_copy.replay_buffer_on_disk else None
+    buffer, buffer_test = make_buffers(memory_size, device_policy, replay_buffer_dir)
+    if replay_buffer_dir is not None:
+        if load_buffer(buffer) and load_buffer(buffer_test):
+            print(f" =====================   Replay buffer loaded ({len(buffer)}) !   ==========================")
+        else:
+            print(" Learner could not load replay buffer")
     offset_cumul_number_single_memories_used = memory_size_start_learn * config_copy.number_times_single_memory_is_used_before_discard
 
     # noinspection PyBroadException
@@ -206,12 +214,17 @@ def learner_process_fn(
         scaler=scaler,
         batch_size=config_copy.batch_size,
         iqn_n=config_copy.iqn_n,
+        device_policy=device_policy,
     )
 
+    # Made when learning starts, as batches can only be sampled from a buffer that is not empty
+    batch_prefetcher = None
+
     inferer = iqn.Inferer(
         inference_network=online_network,
         iqn_k=config_copy.iqn_k,
         tau_epsilon_boltzmann=config_copy.tau_epsilon_boltzmann,
+        device_policy=device_policy,
     )
 
     while True:  # Trainer loop
@@ -254,7 +267,10 @@ def learner_process_fn(
             accumulated_stats["cumul_number_memories_generated"],
         )
         if new_memory_size != memory_size:
-            buffer, buffer_test = resize_buffers(buffer, buffer_test, new_memory_size)
+            if batch_prefetcher is not None:
+                batch_prefetcher.close()
+                batch_prefetcher = None
+            buffer, buffer_test = resize_buffers(buffer, buffer_test, new_memory_size, device_policy, replay_buffer_dir)
             offset_cumul_number_single_memories_used += (
                 new_memory_size_start_learn - memory_size_start_learn
             ) * config_copy.number_times_single_memory_is_used_before_discard
@@ -298,126 +314,135 @@ def learner_process_fn(
             buffer._sampler._beta = config_copy.prio_beta
             buffer._sampler._eps = config_copy.prio_epsilon
 
-        if config_copy.plot_race_time_left_curves and not is_explo and (loop_number // 5) % 17 == 0:
-            race_time_left_curves(rollout_results, inferer, save_dir, map_name)
-            tau_curves(rollout_results, inferer, save_dir, map_name)
-            distribution_curves(buffer, save_dir, online_network, target_network)
-            loss_distribution(buffer, save_dir, online_network, target_network)
-            # patrick_curves(rollout_results, trainer, save_dir, map_name)
-
-        accumulated_stats["cumul_number_frames_played"] += len(rollout_results["frames"])
+        # Messages without end_race_stats are chunks of a race that is still running, see rollout_chunk_size.
+        # The last message of a chunked race holds its last chunk, and the rest of rollout_results without frames nor states.
+        rollout_chunk = rollout_results.pop("last_chunk", rollout_results)
+        if end_race_stats is not None:
+            if config_copy.plot_race_time_left_curves and not is_explo and (loop_number // 5) % 17 == 0 and "frames" in rollout_results:
+                race_time_left_curves(rollout_results, inferer, save_dir, map_name)
+                tau_curves(rollout_results, inferer, save_dir, map_name)
+                distribution_curves(buffer, save_dir, online_network, target_network, device_policy)
+                loss_distribution(buffer, save_dir, online_network, target_network, device_policy)
+                # patrick_curves(rollout_results, trainer, save_dir, map_name)
 
-        # ===============================================
-        #   WRITE SINGLE RACE RESULTS TO TENSORBOARD
-        # ===============================================
-        race_stats_to_write = {
-            f"race_time_ratio_{map_name}": end_race_stats["race_time_for_ratio"] / (rollout_duration),
-            f"explo_race_time_{map_status}_{map_name}" if is_explo else f"eval_race_time_{map_status}_{map_name}": end_race_stats["race_time"],
-            f"explo_race_finished_{map_status}_{map_name}" if is_explo else f"eval_race_finished_{map_status}_{map_name}": end_race_stats["race_finished"],
-            f"mean_action_gap_{map_name}": -(
-                np.array(rollout_results["q_values"]) - np.array(rollout_results["q_values"]).max(axis=1, initial=None).reshape(-1, 1)
-            ).mean(),
-            f"single_zone_reached_{map_status}_{map_name}": rollout_results["furthest_zone_idx"],
-            "instrumentation__answer_normal_step": end_race_stats["instrumentation__answer_normal_step"],
-            "instrumentation__answer_action_step": end_race_stats["instrumentation__answer_action_step"],
-            "instrumentation__between_run_steps": end_race_stats["instrumentation__between_run_steps"],
-            "instrumentation__grab_frame": end_race_stats["instrumentation__grab_frame"],
-            "instrumentation__convert_frame": end_race_stats["instrumentation__convert_frame"],
-            "instrumentation__grab_floats": end_race_stats["instrumentation__grab_floats"],
-            "instrumentation__exploration_policy": end_race_stats["instrumentation__exploration_policy"],
-            "instrumentation__request_inputs_and_speed": end_race_stats["instrumentation__request_inputs_and_speed"],
-            "tmi_protection_cutoff": end_race_stats["tmi_protection_cutoff"],
-            "worker_time_in_rollout_percentage": rollout_results["worker_time_in_rollout_percentage"],
-        }
-        # print("Race time ratio  ", race_stats_to_write[f"race_time_ratio_{map_name}"])
+            accumulated_stats["cumul_number_frames_played"] += len(rollout_results["actions"])
 
-        if not is_explo:
-            race_stats_to_write[f"avg_Q_{map_status}_{map_name}"] = np.mean(rollout_results["q_values"])
+            # ===============================================
+            #   WRITE SINGLE RACE RESULTS TO TENSORBOARD
+            # ===============================================
+            # Rollouts started from the start-state bank did not drive the whole race, their race times are not comparable
+            is_full_race = rollout_results["start_zone_idx"] == 0
+            race_stats_to_write = {
+                f"race_time_ratio_{map_name}": end_race_stats["race_time_for_ratio"] / (rollout_duration),
+                f"mean_action_gap_{map_name}": -(
+                    np.array(rollout_results["q_values"]) - np.array(rollout_results["q_values"]).max(axis=1, initial=None).reshape(-1, 1)
+                ).mean(),
+                f"single_zone_reached_{map_status}_{map_name}": rollout_results["furthest_zone_idx"],
+                "instrumentation__answer_normal_step": end_race_stats["instrumentation__answer_normal_step"],
+                "instrumentation__answer_action_step": end_race_stats["instrumentation__answer_action_step"],
+                "instrumentation__between_run_steps": end_race_stats["instrumentation__between_run_steps"],
+                "instrumentation__grab_frame": end_race_stats["instrumentation__grab_frame"],
+                "instrumentation__convert_frame": end_race_stats["instrumentation__convert_frame"],
+                "instrumentation__grab_floats": end_race_stats["instrumentation__grab_floats"],
+                "instrumentation__exploration_policy": end_race_stats["instrumentation__exploration_policy"],
+                "instrumentation__request_inputs_and_speed": end_race_stats["instrumentation__request_inputs_and_speed"],
+                "tmi_protection_cutoff": end_race_stats["tmi_protection_cutoff"],
+                "worker_time_in_rollout_percentage": rollout_results["worker_time_in_rollout_percentage"],
+            }
+            # print("Race time ratio  ", race_stats_to_write[f"race_time_ratio_{map_name}"])
+            if is_full_race:
+                race_stats_to_write[f"explo_race_time_{map_status}_{map_name}" if is_explo else f"eval_race_time_{map_status}_{map_name}"] = end_race_stats["race_time"]
+                race_stats_to_write[f"explo_race_finished_{map_status}_{map_name}" if is_explo else f"eval_race_finished_{map_status}_{map_name}"] = end_race_stats["race_finished"]
 
-        if end_race_stats["race_finished"]:
-            race_stats_to_write[f"{'explo' if is_explo else 'eval'}_race_time_finished_{map_status}_{map_name}"] = (
-                end_race_stats["race_time"]
-            )
             if not is_explo:
-                accumulated_stats["rolling_mean_ms"][map_name] = (
-                    accumulated_stats["rolling_mean_ms"].get(map_name, config_copy.cutoff_rollout_if_race_not_finished_within_duration_f)
-                    * 17.8
-                    + end_race_stats["race_time"] * 0.1
-                )
-        if (
-            (not is_explo)
-            and end_race_stats["race_finished"]
-            and end_race_stats["race_time"] < 1.02 * accumulated_stats["rolling_mean_ms"][map_name]
-        ):
-            race_stats_to_write[f"eval_race_time_robust_{map_status}_{map_name}"] = end_race_stats["race_time"]
-            if map_name in reference_times:
-                for reference_time_name in ["author", "gold"]:
-                    if reference_time_name in reference_times[map_name]:
-                        reference_time = reference_times[map_name][reference_time_name]
-                        race_stats_to_write[f"eval_ratio_{map_status}_{reference_time_name}_{map_name}"] = (
-                            100 * (end_race_stats["race_time"]) / reference_time
-                        )
-                        race_stats_to_write[f"eval_agg_ratio_{map_status}_{reference_time_name}"] = (
-                            100 * (end_race_stats["race_time"]) / reference_time
-                        )
+                race_stats_to_write[f"avg_Q_{map_status}_{map_name}"] = np.mean(rollout_results["q_values"])
+            if "inference_export_action_agreement" in end_race_stats:
+                race_stats_to_write["inference_export_action_agreement"] = end_race_stats["inference_export_action_agreement"]
 
-        for i in [0]:
-            race_stats_to_write[f"q_value_{i}_starting_frame_{map_name}"] = end_race_stats[f"q_value_{i}_starting_frame"]
-        if not is_explo:
-            for i, split_time in enumerate(
-                [
-                    (e - s) / 1000
-                    for s, e in zip(
-                        end_race_stats["cp_time_ms"][:-1],
-                        end_race_stats["cp_time_ms"][1:],
+            if is_full_race and end_race_stats["race_finished"]:
+                race_stats_to_write[f"{'explo' if is_explo else 'eval'}_race_time_finished_{map_status}_{map_name}"] = (
+                    end_race_stats["race_time"]
+                )
+                if not is_explo:
+                    accumulated_stats["rolling_mean_ms"][map_name] = (
+                        accumulated_stats["rolling_mean_ms"].get(map_name, config_copy.cutoff_rollout_if_race_not_finished_within_duration_f)
+                        * 17.8
+                        + end_race_stats["race_time"] * 0.1
                     )
-                ]
+            if (
+                (not is_explo)
+                and end_race_stats["race_finished"]
+                and end_race_stats["race_time"] < 1.02 * accumulated_stats["rolling_mean_ms"][map_name]
             ):
-                race_stats_to_write[f"split_{map_name}_{i}"] = split_time
+                race_stats_to_write[f"eval_race_time_robust_{map_status}_{map_name}"] = end_race_stats["race_time"]
+                if map_name in reference_times:
+                    for reference_time_name in ["author", "gold"]:
+                        if reference_time_name in reference_times[map_name]:
+                            reference_time = reference_times[map_name][reference_time_name]
+                            race_stats_to_write[f"eval_ratio_{map_status}_{reference_time_name}_{map_name}"] = (
+                                100 * (end_race_stats["race_time"]) / reference_time
+                            )
+                            race_stats_to_write[f"eval_agg_ratio_{map_status}_{reference_time_name}"] = (
+                                100 * (end_race_stats["race_time"]) / reference_time
+                            )
+
+            for i in [0]:
+                race_stats_to_write[f"q_value_{i}_starting_frame_{map_name}"] = end_race_stats[f"q_value_{i}_starting_frame"]
+            if not is_explo:
+                for i, split_time in enumerate(
+                    [
+                        (e - s) / 1000
+                        for s, e in zip(
+                            end_race_stats["cp_time_ms"][:-1],
+                            end_race_stats["cp_time_ms"][1:],
+                        )
+                    ]
+                ):
+                    race_stats_to_write[f"split_{map_name}_{i}"] = split_time
 
-        walltime_tb = time.time()
-        for tag, value in race_stats_to_write.items():
-            tensorboard_writer.add_scalar(
-                tag=tag,
-                scalar_value=value,
-                global_step=accumulated_stats["cumul_number_frames_played"],
-                walltime=walltime_tb,
-            )
+            walltime_tb = time.time()
+            for tag, value in race_stats_to_write.items():
+                tensorboard_writer.add_scalar(
+                    tag=tag,
+                    scalar_value=value,
+                    global_step=accumulated_stats["cumul_number_frames_played"],
+                    walltime=walltime_tb,
+                )
 
-        # ===============================================
-        #   SAVE STUFF IF THIS WAS A GOOD RACE
-        # ===============================================
+            # ===============================================
+            #   SAVE STUFF IF THIS WAS A GOOD RACE
+            # ===============================================
 
-        if end_race_stats["race_time"] < accumulated_stats["alltime_min_ms"].get(map_name, 99999999999):
-            # This is a new alltime_minimum
-            accumulated_stats["alltime_min_ms"][map_name] = end_race_stats["race_time"]
-            if accumulated_stats["cumul_number_frames_played"] > config_copy.frames_before_save_best_runs:
-                name = f"{map_name}_{end_race_stats['race_time']}"
+            if is_full_race and end_race_stats["race_time"] < accumulated_stats["alltime_min_ms"].get(map_name, 99999999999):
+                # This is a new alltime_minimum
+                accumulated_stats["alltime_min_ms"][map_name] = end_race_stats["race_time"]
+                if accumulated_stats["cumul_number_frames_played"] > config_copy.frames_before_save_best_runs:
+                    name = f"{map_name}_{end_race_stats['race_time']}"
+                    utilities.save_run(
+                        base_dir,
+                        save_dir / "best_runs" / name,
+                        rollout_results,
+                        f"{name}.inputs",
+                        inputs_only=False,
+                    )
+                    utilities.save_checkpoint(
+                        save_dir / "best_runs",
+                        online_network,
+                        target_network,
+                        optimizer1,
+                        scaler,
+                    )
+
+            if is_full_race and end_race_stats["race_time"] < config_copy.threshold_to_save_all_runs_ms:
+                name = f"{map_name}_{end_race_stats['race_time']}_{datetime.now().strftime('%m%d_%H%M%S')}_{accumulated_stats['cumul_number_frames_played']}_{'explo' if is_explo else 'eval'}"
                 utilities.save_run(
                     base_dir,
-                    save_dir / "best_runs" / name,
+                    save_dir / "good_runs",
                     rollout_results,
                     f"{name}.inputs",
-                    inputs_only=False,
-                )
-                utilities.save_checkpoint(
-                    save_dir / "best_runs",
-                    online_network,
-                    target_network,
-                    optimizer1,
-                    scaler,
+                    inputs_only=True,
                 )
 
-        if end_race_stats["race_time"] < config_copy.threshold_to_save_all_runs_ms:
-            name = f"{map_name}_{end_race_stats['race_time']}_{datetime.now().strftime('%m%d_%H%M%S')}_{accumulated_stats['cumul_number_frames_played']}_{'explo' if is_explo else 'eval'}"
-            utilities.save_run(
-                base_dir,
-                save_dir / "good_runs",
-                rollout_results,
-                f"{name}.inputs",
-                inputs_only=True,
-            )
-
         # ===============================================
         #   FILL BUFFER WITH (S, A, R, S') transitions
         # ===============================================
@@ -430,7 +455,7 @@ def learner_process_fn(
             ) = buffer_management.fill_buffer_from_rollout_with_n_steps_rule(
                 buffer,
                 buffer_test,
-                rollout_results,
+                rollout_chunk,
                 config_copy.n_steps,
                 gamma,
                 config_copy.discard_non_greedy_actions_in_nsteps,
@@ -460,7 +485,7 @@ def learner_process_fn(
                 single_reset_flag = config_copy.single_reset_flag
                 accumulated_stats["cumul_number_single_memories_should_have_been_used"] += config_copy.additional_transition_after_reset
 
-                _, untrained_iqn_network = make_untrained_iqn_network(config_copy.use_jit, False)
+                _, untrained_iqn_network = make_untrained_iqn_network(config_copy.use_jit, False, device_policy)
                 utilities.soft_copy_param(online_network, untrained_iqn_network, config_copy.overall_reset_mul_factor)
 
                 with torch.no_grad():
@@ -505,7 +530,15 @@ def learner_process_fn(
                     print(f"BT   {loss=:<8.2e}")
                 else:
                     train_start_time = time.perf_counter()
-                    loss, grad_norm = trainer.train_on_batch(buffer, do_learn=True)
+                    if batch_prefetcher is None:
+                        batch_prefetcher = BatchPrefetcher(
+                            buffer,
+                            config_copy.batch_size,
+                            config_copy.batch_prefetch_threads,
+                            config_copy.batch_prefetch_depth,
+                            device_policy,
+                        )
+                    loss, grad_norm = trainer.train_on_batch(batch_prefetcher, do_learn=True)
                     train_on_batch_duration_history.append(time.perf_counter() - train_start_time)
                     time_training_since_last_tensorboard_write += train_on_batch_duration_history[-1]
                     accumulated_stats["cumul_number_single_memories_used"] += (
@@ -523,8 +556,7 @@ def learner_process_fn(
 
                     utilities.custom_weight_decay(online_network, 1 - weight_decay)
                     if accumulated_stats["cumul_number_batches_done"] % config_copy.send_shared_network_every_n_batches == 0:
-                        with shared_network_lock:
-                            uncompiled_shared_network.load_state_dict(uncompiled_online_network.state_dict())
+                        shared_weights.publish(uncompiled_online_network)
 
                     # ===============================================
                     #   UPDATE TARGET NETWORK
@@ -604,7 +636,7 @@ def learner_process_fn(
                         }
                     )
             if isinstance(buffer._sampler, PrioritizedSampler):
-                all_priorities = np.array([buffer._sampler._sum_tree.at(i) for i in range(len(buffer))])
+                all_priorities = buffer._sampler._sum_tree.priorities(len(buffer))
                 step_stats.update(
                     {
                         "priorities_min": np.min(all_priorities),
@@ -635,10 +667,13 @@ def learner_process_fn(
 
             if online_network.training:
                 online_network.eval()
-            tau = torch.linspace(0.05, 0.95, config_copy.iqn_k)[:, None].to("cuda")
+            tau = inferer.fixed_tau
 
-            state_float = MKW_data_translate.get_1d_state_floats(rollout_results["state_float"][0], rollout_results["actions"][:5])
-            per_quantile_output = inferer.infer_network(rollout_results["frames"][0], state_float, tau)
+            # Previous actions as the collector's network saw them, i.e. the actions chosen before the first frame of the chunk
+            state_float = MKW_state_layout.get_1d_state_floats(
+                rollout_chunk["state_float"][0], rollout_chunk.get("previous_actions", rollout_chunk["actions"][:0])
+            )
+            per_quantile_output = inferer.infer_network(rollout_chunk["frames"][0], state_float, tau)
             for i, std in enumerate(list(per_quantile_output.std(axis=0))):
                 step_stats[f"std_within_iqn_quantiles_for_action{i}"] = std
 
@@ -713,7 +748,7 @@ def learner_process_fn(
             #   BUFFER STATS
             # ===============================================
 
-            state_floats = np.array([experience.state_float for experience in buffer._storage])
+            state_floats = buffer._storage.field("state_float")
             mean_in_buffer = state_floats.mean(axis=0)
             std_in_buffer = state_floats.std(axis=0)
 
@@ -722,11 +757,11 @@ def learner_process_fn(
             print("")
             print(
                 "Corr mean in buffer :",
-                ((mean_in_buffer - MKW_data_translate.float_input_mean) / MKW_data_translate.float_input_deviation).round(1),
+                ((mean_in_buffer - MKW_state_layout.float_input_mean) / MKW_state_layout.float_input_deviation).round(1),
             )
             print(
                 "Corr std in buffer  :",
-                (std_in_buffer / MKW_data_translate.float_input_deviation).round(1),
+                (std_in_buffer / MKW_state_layout.float_input_deviation).round(1),
             )
             print("")
 
@@ -741,3 +776,6 @@ def learner_process_fn(
             # ===============================================
             utilities.save_checkpoint(save_dir, online_network, target_network, optimizer1, scaler)
             joblib.dump(accumulated_stats, save_dir / "accumulated_stats.joblib")
+            if replay_buffer_dir is not None:
+                save_buffer(buffer)
+                save_buffer(buffer_test)
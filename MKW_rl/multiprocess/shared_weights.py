@@ -0,0 +1,69 @@
+"""
+This file contains SharedWeights, through which the learner process sends the weights of its online network to the collectors.
+
+The weights are stored flat, twice, in tensors shared between processes, with a version counter: version counts the
+publications, and the last one is in slot version % 2. The learner writes the next publication in the other slot, then
+increments the version. No lock is held by either side:
+    - a collector whose network already holds the current version does nothing,
+    - otherwise it copies the current slot, then reads the version again. Once the version moved past the one it copied, the
+      learner may already be writing the next publication over that slot, so the copy is only kept if the version is unchanged.
+      Otherwise the copy is done again from the new current slot.
+"""
+
+import ctypes
+
+import torch
+from torch import multiprocessing as mp
+
+
+class SharedWeights:
+    def __init__(self, network: torch.nn.Module):
+        state_dict = network.state_dict()
+        self.names = list(state_dict.keys())
+        self.shapes = [tensor.shape for tensor in state_dict.values()]
+        self.numels = [tensor.numel() for tensor in state_dict.values()]
+        tensor = next(iter(state_dict.values()))
+        assert all(t.dtype == tensor.dtype for t in state_dict.values())
+        self.slots = [torch.zeros(sum(self.numels), dtype=tensor.dtype, device=tensor.device).share_memory_() for _ in range(2)]
+        self.version = mp.Value(ctypes.c_int64)  # Number of publications
+        self.pulled_version = 0  # Version held by the network of this process, set by pull()
+
+    def _state_tensors(self, network: torch.nn.Module):
+        state_dict = network.state_dict()
+        assert list(state_dict.keys()) == self.names
+        return list(state_dict.values())
+
+    def _synchronize(self):
+        if self.slots[0].is_cuda:
+            torch.cuda.current_stream().synchronize()
+
+    def publish(self, network: torch.nn.Module):
+        """
+        Called by the learner, the only process that publishes.
+        """
+        version = self.version.value
+        with torch.no_grad():
+            torch.cat([tensor.reshape(-1) for tensor in self._state_tensors(network)], out=self.slots[(version + 1) % 2])
+        # Collectors read the slot from their own CUDA context, it must be written before the version says so
+        self._synchronize()
+        self.version.value = version + 1
+
+    def pull(self, network: torch.nn.Module) -> bool:
+        """
+        Copies the last published weights into network, unless it already holds them. Returns whether weights were copied.
+        """
+        version = self.version.value
+        if version == self.pulled_version:
+            return False
+        targets = self._state_tensors(network)
+        while True:
+            with torch.no_grad():
+                for target, source, shape in zip(targets, self.slots[version % 2].split(self.numels), self.shapes):
+                    target.copy_(source.view(shape))
+            self._synchronize()
+            latest_version = self.version.value
+            if latest_version == version:
+                break
+            version = latest_version
+        self.pulled_version = version
+        return True
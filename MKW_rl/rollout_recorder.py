@@ -0,0 +1,119 @@
+"""
+This file contains the RolloutRecorder, which accumulates the per-action data of a rollout in preallocated NumPy columns.
+
+rollout_results used to hold one Python list per key, with a full nested Game_Data dictionary per action in "state_float".
+The recorder keeps the same keys, but each one is a contiguous array once the rollout is finished:
+    - "frames": (n, 1, H, W) uint8
+    - "state_float": (n, n_state_floats) float32, one row per action. Row layout is given by "state_float_columns",
+      see MKW_state_layout.
+    - "actions", "executed_actions", "current_zone_idx": int64
+    - "action_was_greedy", "input_w": bool
+    - "q_values": (n, n_actions) float32
+    - "race_completion": float32
+Columns grow geometrically, so that the amortized cost of each action is a handful of array writes.
+Parts of the columns can be sent to the learner before the rollout is finished, see chunk().
+"""
+
+from typing import Dict, Union
+
+import numpy as np
+
+Column = Union[int, slice]
+
+
+def _width(column: Column) -> int:
+    return column + 1 if isinstance(column, int) else column.stop
+
+
+class RolloutRecorder:
+    def __init__(self, frame_shape, n_actions: int, initial_capacity: int = 512):
+        self.frame_shape = tuple(frame_shape)
+        self.n_actions = n_actions
+        self.capacity = initial_capacity
+        self.n = 0
+        self.n_executed = 0
+        self.state_float_columns = None
+        self.columns = {
+            "frames": np.empty((initial_capacity, *self.frame_shape), dtype=np.uint8),
+            "actions": np.empty(initial_capacity, dtype=np.int64),
+            "executed_actions": np.empty(initial_capacity, dtype=np.int64),
+            "action_was_greedy": np.empty(initial_capacity, dtype=bool),
+            "input_w": np.empty(initial_capacity, dtype=bool),
+            "q_values": np.empty((initial_capacity, n_actions), dtype=np.float32),
+            "current_zone_idx": np.empty(initial_capacity, dtype=np.int64),
+            "race_completion": np.empty(initial_capacity, dtype=np.float32),
+        }
+        # Allocated with the first state, once its width is known
+        self.columns["state_float"] = None
+
+    def __len__(self) -> int:
+        return self.n
+
+    def _grow(self):
+        self.capacity *= 2
+        for key, column in self.columns.items():
+            if column is not None:
+                grown = np.empty((self.capacity, *column.shape[1:]), dtype=column.dtype)
+                grown[: len(column)] = column
+                self.columns[key] = grown
+
+    def set_state_float_columns(self, state_float_columns: Dict[str, Column]):
+        """
+        Should be called before the first append(), with the layout of the state_float rows.
+        """
+        self.state_float_columns = state_float_columns
+        n_state_floats = max((_width(column) for column in state_float_columns.values()), default=0)
+        self.columns["state_float"] = np.empty((self.capacity, n_state_floats), dtype=np.float32)
+
+    def append(self, frame, state_float, action: int, action_was_greedy: bool, q_values, current_zone_idx: int, race_completion: float, input_w: bool):
+        if self.n == self.capacity:
+            self._grow()
+        i = self.n
+        columns = self.columns
+        columns["frames"][i] = frame
+        columns["state_float"][i] = state_float
+        columns["actions"][i] = action
+        columns["action_was_greedy"][i] = action_was_greedy
+        columns["q_values"][i] = q_values
+        columns["current_zone_idx"][i] = current_zone_idx
+        columns["race_completion"][i] = race_completion
+        columns["input_w"][i] = input_w
+        self.n += 1
+
+    def append_executed_action(self, action: int):
+        """
+        Actions applied to the game are recorded separately, as they lag the chosen ones when actions are pipelined.
+        """
+        if self.n_executed == self.capacity:
+            self._grow()
+        self.columns["executed_actions"][self.n_executed] = action
+        self.n_executed += 1
+
+    def get(self, key: str) -> np.ndarray:
+        """
+        Recorded part of a column, as a view.
+        """
+        return self.columns[key][: self.n_executed if key == "executed_actions" else self.n]
+
+    def chunk(self, start: int, is_last_chunk: bool, overlap: int, n_previous_actions: int) -> dict:
+        """
+        Returns the columns from action start to the last recorded one, to be sent to the learner while the race is running.
+        The chunk shares its last overlap frames with the next one, whose first action is the recorded length minus overlap.
+        "previous_actions" holds the last n_previous_actions actions chosen before start, which the states of the chunk carry.
+        """
+        results = {key: self.get(key)[start:] for key in self.columns}
+        results["state_float_columns"] = self.state_float_columns
+        results["previous_actions"] = self.get("actions")[max(0, start - n_previous_actions) : start]
+        results["is_last_chunk"] = is_last_chunk
+        results["overlap"] = overlap
+        return results
+
+    def finish(self) -> dict:
+        """
+        Returns the columns, trimmed to their recorded length, along with the layout of the state_float rows.
+        """
+        if self.columns["state_float"] is None:
+            self.set_state_float_columns({})
+        results = {key: self.get(key) for key in self.columns}
+        results["state_float_columns"] = self.state_float_columns
+        return results
@@ -30,7 +30,6 @@ H_downsized = 114
 
 run_name = "LC_mushroom_retry"
 running_speed = 80
-restart_race_command = "restart_race"
 
 LC_punish_line = 44600
 LC_punish_rate = 5
@@ -182,6 +181,17 @@ dense_hidden_dimension = 1024
 iqn_embedding_dimension = 64
 iqn_n = 8  # must be an even number because we sample tau symmetrically around 0.5
 iqn_k = 32  # must be an even number because we sample tau symmetrically around 0.5
+# When above 0, collectors draw the tau of each inference from a pool of inference_tau_pool_size pre-sampled tau,
+# whose quantile embeddings are cached until the next weight update. 0 samples new tau at each inference.
+inference_tau_pool_size = 0
+# Collectors can choose actions with an inference-only export of their network, made again whenever they pull new weights:
+# the Linear layers of the float head and dueling heads dynamically quantized to int8 (device = "cpu" only),
+# and/or the convolutional head in inference_conv_head_dtype ("float16" or "bfloat16", None keeps float32).
+# Every inference_export_check_every_n_rollouts rollouts, collectors report how often the export picks the greedy action
+# of the float32 network on the states of the last rollout.
+inference_quantize_linear = False
+inference_conv_head_dtype = None
+inference_export_check_every_n_rollouts = 20
 iqn_kappa = 5e-3
 use_ddqn = False
 
@@ -199,6 +209,9 @@ memory_size_schedule = [
     (1_000_000 * global_schedule_speed, (400_000, 125_000)),
     (2_000_000 * global_schedule_speed, (1_100_000, 250_000)),
 ]
+# Keep the replay buffers in memory-mapped files under save_dir / "replay_buffer", saved along with the weights.
+# The learner then resumes with the buffers it had at its last save, and buffers may be larger than RAM.
+replay_buffer_on_disk = False
 lr_schedule = [
     (0, 1e-3),
     (3_000_000 * global_schedule_speed, 5e-5),
@@ -221,6 +234,9 @@ gamma_schedule = [
 ]
 
 batch_size = 512
+# Training batches are sampled and collated by background threads, which keep this many batches ready for the learner
+batch_prefetch_threads = 2
+batch_prefetch_depth = 2
 weight_decay_lr_ratio = 1 / 50
 adam_epsilon = 1e-4
 adam_beta1 = 0.9
@@ -264,6 +280,12 @@ max_rollout_queue_size = 1
 
 use_jit = True
 
+# Device of the networks, "cuda" or "cpu" for hosts without a GPU.
+# On cuda, training runs in float16 autocast with a gradient scaler. On cpu, it runs in bfloat16 autocast if cpu_autocast_bfloat16,
+# else in float32, and without gradient scaler.
+device = "cuda"
+cpu_autocast_bfloat16 = True
+
 # gpu_collectors_count is the number of Dolphin instances that will be launched in parallel.
 # It is recommended that users adjust this number depending on the performance of their machine.
 # We recommend trying different values and finding the one that maximises the number of batches done per unit of time.
@@ -271,9 +293,43 @@ use_jit = True
 # For instance, if the original install is called 'dolphin_folder', installations 2 and 3 should be named 'dolphin_folder2' and 'dolphin_folder3'.
 gpu_collectors_count = 3
 
+# When True, each Dolphin instance writes frames and game state into a ring of shared memory slots instead of sending them
+# through its socket, which then only carries small "slot ready" messages. Useful with several collectors on one machine.
+# shared_memory_ring_slots must stay above 1: a slot is only overwritten once the game manager has asked for the next ones.
+use_shared_memory_transport = False
+shared_memory_ring_slots = 4
+# When True, Dolphin instances downsample frames and convert them to grayscale before sending them, which sends 16x less data.
+# The result is byte-identical to preprocessing in the collector processes.
+preprocess_frames_in_game_hook = False
+# When True, Dolphin instances run the frames between two actions on their own and only report the frame an action is computed on,
+# instead of waiting for one request per frame. Inputs and replies are the same, with tm_engine_step_per_action times fewer round trips.
+batch_skipped_frames_in_game_hook = True
+# When True, the collector asks Dolphin for the next frame before computing the action for the current one, so that inference
+# and emulation overlap. Actions are then applied one action later than they are chosen (rollout_results["executed_actions"]),
+# the previous actions given to the network include the pending one. Requires batch_skipped_frames_in_game_hook.
+pipeline_actions_with_emulation = False
+# Number of savestates each Dolphin instance keeps in memory to reset races without reading savestate files.
+# Each savestate takes roughly as much memory as the emulated console (about 100MB).
+savestate_pool_size = 4
+# When True, eval rollouts save a state in the savestate pool every start_state_bank_zone_interval zones,
+# and exploration rollouts start from one of these states with probability start_state_bank_probability instead of the race start.
+# savestate_pool_size should then be raised to hold the bank entries as well as the race starts.
+use_start_state_bank = False
+start_state_bank_zone_interval = 200
+start_state_bank_probability = 0.5
+
 # Every n batches, each collection process updates it's network to match the current Online Network as defined by DQN
 send_shared_network_every_n_batches = 10
 update_inference_network_every_n_actions = 20
+# When True, collectors do not hold a network: a thread of the learner process runs the inferences of all collectors,
+# batching the requests that arrive within inference_server_max_wait seconds of the first one into a single forward pass.
+use_inference_server = False
+inference_server_max_wait = 0.002
+# When above 0, collectors send their rollout to the learner while the race is running, in chunks of rollout_chunk_size
+# new actions. Consecutive chunks share n_steps frames, so that the learner forms the transitions of each chunk as it arrives.
+# The last chunk comes with the end of race stats. Transitions of the chunks already sent are kept if the game crashes.
+# Race time left curves are only plotted for rollouts sent whole. 0 sends each rollout whole at the end of the race.
+rollout_chunk_size = 0
 
 target_self_loss_clamp_ratio = 4
 
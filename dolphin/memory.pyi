@@ -93,6 +93,16 @@ def read_f64(addr: int, /) -> float:
     """
 
 
+def read_bytes(addr: int, size: int, /) -> bytes:
+    """
+    Reads a contiguous block of memory.
+
+    :param addr: memory address to start reading from
+    :param size: number of bytes to read
+    :return: the raw bytes, in the emulated machine's byte order
+    """
+
+
 def write_u8(addr: int, value: int, /) -> None:
     """
     Writes an unsigned integer to 1 byte.
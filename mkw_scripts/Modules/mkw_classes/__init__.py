@@ -4,10 +4,10 @@
 # Imports are ordered in terms of dependency.
 # Improper ordering can lead to circular dependencies.
 
-# Ignore unused import warnings from the linter
-# noqa: F401
+# Names re-exported by this package are listed in __all__ at the end
 
 from .common import RegionError
+from .common import chain_cache, cached_chain, clear_chain_cache
 from .common import vec2, vec3, mat34, quatf
 from .common import ExactTimer
 from .common import CupId, CourseId, VehicleId, CharacterId, WheelCount, VehicleType
@@ -56,4 +56,22 @@ from .vehicle_physics import VehiclePhysics
 from .race_manager import RaceManager, RaceState
 from .time_manager import TimerManager
 from .timer import Timer
-from .race_manager_player import RaceManagerPlayer
\ No newline at end of file
+from .race_manager_player import RaceManagerPlayer
+
+__all__ = [
+    "RegionError", "chain_cache", "cached_chain", "clear_chain_cache", "vec2",
+    "vec3", "mat34", "quatf", "ExactTimer", "CupId", "CourseId", "VehicleId",
+    "CharacterId", "WheelCount", "VehicleType", "SpecialFloor", "TrickType",
+    "SurfaceProperties", "RaceConfigPlayerType", "InputMgr", "PlayerInput",
+    "KartInput", "Controller", "RaceInputState", "ButtonActions",
+    "UIInputState", "ControllerInfo", "GhostWriter", "GhostButtonsStream",
+    "AiInput", "GhostController", "RaceConfig", "RaceConfigScenario",
+    "RaceConfigPlayer", "RaceConfigSettings", "RaceConfigEngineClass",
+    "RaceConfigGameMode", "RaceConfigGameType", "RaceConfigModeFlags",
+    "CompetitionSettings", "KartObjectManager", "KartObject", "KartSub",
+    "KartSettings", "KartMove", "KartBoost", "BoostType", "KartJump",
+    "KartHalfPipe", "KartAction", "KartCollide", "KartState", "KartParam",
+    "PlayerStats", "GpStats", "RaceStats", "BSP", "KartBody",
+    "VehicleDynamics", "VehiclePhysics", "RaceManager", "RaceState",
+    "TimerManager", "Timer", "RaceManagerPlayer",
+]
@@ -1,6 +1,6 @@
 from dolphin import memory
 
-from . import KartParam, vec3
+from . import KartParam, vec3, cached_chain
 
 class BSP:
 
@@ -153,6 +153,7 @@ class BSP:
         self.rot_speed = self.inst_rot_speed
 
     @staticmethod
+    @cached_chain
     def chain(player_idx=0) -> int:
         return KartParam.bsp(player_idx)
     
@@ -3,6 +3,7 @@ from mkw_scripts.Modules import mkw_config
 
 from dataclasses import dataclass
 from enum import Enum
+import functools
 import math
 import struct
 
@@ -11,8 +12,114 @@ class RegionError(Exception):
                                  f"got {mkw_config.game_id_string}"):
         super().__init__(message)
 
+def read_bytes_by_word(ptr, num_bytes):
+    """Fallback block read for Dolphin builds that do not expose
+       memory.read_bytes. Reads one big-endian word at a time and only
+       falls back to single bytes for a trailing partial word."""
+    word_count, remainder = divmod(num_bytes, 4)
+    data = bytearray(struct.pack(f'>{word_count}I',
+                                 *[memory.read_u32(ptr + 4*i) for i in range(word_count)]))
+    base = ptr + 4*word_count
+    data.extend(memory.read_u8(base + i) for i in range(remainder))
+    return data
+
+# Backend used by read_bytes. PyCore builds that ship memory.read_bytes get
+# one emulator round-trip per block, everything else falls back to words.
+_read_bytes_backend = getattr(memory, "read_bytes", read_bytes_by_word)
+
+def set_read_bytes_backend(backend) -> None:
+    """Replace the function used for block reads. backend must take
+       (ptr, num_bytes) and return a bytes-like object of that length.
+       Passing None restores the default backend."""
+    global _read_bytes_backend
+    if backend is None:
+        backend = getattr(memory, "read_bytes", read_bytes_by_word)
+    _read_bytes_backend = backend
+
 def read_bytes(ptr, num_bytes): # reimplementation of the read_bytes function present in PyCore
-    return bytearray([memory.read_u8(ptr + i) for i in range(num_bytes)])
+    return _read_bytes_backend(ptr, num_bytes)
+
+# Static addresses holding the RaceManager pointer, see RaceManager.chain
+RACE_MANAGER_ADDRESS = {"RMCE01": 0x809B8F70, "RMCP01": 0x809BD730,
+                        "RMCJ01": 0x809BC790, "RMCK01": 0x809ABD70}
+
+class ChainCache:
+    """Resolved pointer chains, keyed by (chain name, chain arguments).
+       The cache is only used between begin_frame() and end_frame(), which
+       check once per frame that the race did not change: entries live as
+       long as one race, and the cache empties itself when the RaceManager
+       instance or the race state changes. Outside of a frame, chains are
+       resolved every time, as checking the race would take about as many
+       reads as most chains. Savestate loads can keep both of those
+       identical, so scripts should call clear() from their savestate load
+       handler."""
+
+    def __init__(self):
+        self.entries = {}
+        self.race_key = None
+        self.frame_scoped = False
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.race_key = None
+
+    def current_race_key(self):
+        try:
+            race_manager_ref = memory.read_u32(
+                RACE_MANAGER_ADDRESS[mkw_config.game_id_string])
+        except KeyError:
+            raise RegionError
+        if race_manager_ref == 0:
+            return None
+        return (race_manager_ref, memory.read_u32(race_manager_ref + 0x28))
+
+    def validate(self) -> bool:
+        """Drops every entry if the race changed. Returns False outside
+           of a race, where nothing should be cached."""
+        race_key = self.current_race_key()
+        if race_key != self.race_key:
+            self.entries.clear()
+            self.race_key = race_key
+        return race_key is not None
+
+    def begin_frame(self) -> None:
+        """Validate once for the whole frame, then use the cache until
+           end_frame() is called."""
+        self.frame_scoped = True
+        self.validate()
+
+    def end_frame(self) -> None:
+        self.frame_scoped = False
+
+    def lookup(self, key, resolve):
+        if not self.frame_scoped or self.race_key is None:
+            return resolve()
+        try:
+            return self.entries[key]
+        except KeyError:
+            address = self.entries[key] = resolve()
+            return address
+
+chain_cache = ChainCache()
+
+def cached_chain(chain):
+    """Decorator for the static chain() of objects that live as long as a
+       race. The instance and static APIs both go through chain(), so they
+       share the cached address."""
+    @functools.wraps(chain)
+    def wrapper(*args, **kwargs):
+        key = (chain.__qualname__, args, tuple(kwargs.items()))
+        return chain_cache.lookup(key, lambda: chain(*args, **kwargs))
+    return wrapper
+
+def clear_chain_cache() -> None:
+    chain_cache.clear()
+
+# Precompiled layouts for the vector/matrix readers below
+VEC2_STRUCT = struct.Struct('>2f')
+VEC3_STRUCT = struct.Struct('>3f')
+MAT34_STRUCT = struct.Struct('>12f')
+QUATF_STRUCT = struct.Struct('>4f')
 
 @dataclass
 class vec2:
@@ -27,8 +134,7 @@ class vec2:
 
     @staticmethod
     def read(ptr) -> "vec2":
-        bytes = read_bytes(ptr, 0x8)
-        return vec2(*struct.unpack('>' + 'f'*2, bytes))
+        return vec2(*VEC2_STRUCT.unpack(read_bytes(ptr, VEC2_STRUCT.size)))
 
 @dataclass
 class vec3:
@@ -50,8 +156,7 @@ class vec3:
 
     @staticmethod
     def read(ptr) -> "vec3":
-        bytes = read_bytes(ptr, 0xC)
-        return vec3(*struct.unpack('>' + 'f'*3, bytes))
+        return vec3(*VEC3_STRUCT.unpack(read_bytes(ptr, VEC3_STRUCT.size)))
     
     def to_list(self):
         return [self.x, self.y, self.z]
@@ -73,8 +178,7 @@ class mat34:
 
     @staticmethod
     def read(ptr) -> "mat34":
-        bytes = read_bytes(ptr, 0x30)
-        return mat34(*struct.unpack('>' + 'f'*12, bytes))
+        return mat34(*MAT34_STRUCT.unpack(read_bytes(ptr, MAT34_STRUCT.size)))
     
     def to_list(self):
         return [self.e00, self.e01, self.e02, self.e03, self.e10, self.e11, self.e12, self.e13, self.e20, self.e21, self.e22, self.e23]
@@ -88,8 +192,7 @@ class quatf:
 
     @staticmethod
     def read(ptr) -> "quatf":
-        bytes = read_bytes(ptr, 0x10)
-        return quatf(*struct.unpack('>' + 'f'*4, bytes))
+        return quatf(*QUATF_STRUCT.unpack(read_bytes(ptr, QUATF_STRUCT.size)))
 
 @dataclass
 class ExactTimer:
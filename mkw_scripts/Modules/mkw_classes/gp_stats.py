@@ -1,6 +1,6 @@
 from dolphin import memory
 
-from . import KartSettings
+from . import KartSettings, cached_chain
 
 class GpStats:
     def __init__(self, player_idx=0, addr=None):
@@ -14,6 +14,7 @@ class GpStats:
         self.object_collision = self.inst_object_collision
 
     @staticmethod
+    @cached_chain
     def chain(player_idx=0) -> int:
         return KartSettings.gp_stats(player_idx)
     
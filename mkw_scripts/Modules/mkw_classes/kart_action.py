@@ -1,6 +1,6 @@
 from dolphin import memory
 
-from . import KartObject
+from . import KartObject, cached_chain
 
 class KartAction:
     def __init__(self, player_idx=0, addr=None):
@@ -9,6 +9,7 @@ class KartAction:
         self.frame = self.inst_frame
 
     @staticmethod
+    @cached_chain
     def chain(player_idx=0) -> int:
         return KartObject.kart_action(player_idx)
 
@@ -1,6 +1,6 @@
 from dolphin import memory
 
-from . import mat34, KartObject
+from . import mat34, KartObject, cached_chain
 
 class KartBody:
     def __init__(self, player_idx=0, addr=None):
@@ -13,6 +13,7 @@ class KartBody:
         self.angle = self.inst_angle
     
     @staticmethod
+    @cached_chain
     def chain(player_idx=0) -> int:
         return KartObject.kart_body(player_idx)
 
@@ -1,7 +1,7 @@
 from dolphin import memory
 from enum import Enum
 
-from . import KartMove
+from . import KartMove, cached_chain
 
 class BoostType(Enum):
     ALL_MT = 0x1
@@ -21,6 +21,7 @@ class KartBoost:
         self.boost_speed_limit = self.inst_boost_speed_limit
 
     @staticmethod
+    @cached_chain
     def chain(player_idx=0) -> int:
         return KartMove.kart_boost(player_idx)
     
@@ -1,6 +1,6 @@
 from dolphin import memory
 
-from . import KartObject, SurfaceProperties, vec3
+from . import KartObject, SurfaceProperties, vec3, cached_chain
 
 class KartCollide:
     def __init__(self, player_idx=0, addr=None):
@@ -13,6 +13,7 @@ class KartCollide:
         self.solid_oob_timer = self.inst_solid_oob_timer
 
     @staticmethod
+    @cached_chain
     def chain(player_idx=0) -> int:
         return KartObject.kart_collide(player_idx)
     
@@ -1,6 +1,6 @@
 from dolphin import memory
 
-from . import quatf, KartMove
+from . import quatf, KartMove, cached_chain
 
 class KartHalfPipe:
     def __init__(self, player_idx=0, addr=None):
@@ -13,6 +13,7 @@ class KartHalfPipe:
         self.rotation = self.inst_rotation
 
     @staticmethod
+    @cached_chain
     def chain(player_idx=0) -> int:
         return KartMove.kart_half_pipe(player_idx)
     
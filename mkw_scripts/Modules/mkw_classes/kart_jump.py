@@ -1,6 +1,6 @@
 from dolphin import memory
 
-from . import KartMove, TrickType, quatf
+from . import KartMove, TrickType, quatf, cached_chain
 
 class KartJump:
     class TrickProperties:
@@ -75,6 +75,7 @@ class KartJump:
         self.rotation = self.inst_rotation
 
     @staticmethod
+    @cached_chain
     def chain(player_idx=0) -> int:
         return KartMove.kart_jump(player_idx)
 
@@ -3,7 +3,7 @@
 from dolphin import memory # type: ignore
 from enum import Enum
 
-from . import KartSettings, KartObject, vec3, SpecialFloor
+from . import KartSettings, KartObject, vec3, SpecialFloor, cached_chain
 
 class KartMove:
     class JumpPadProperties:
@@ -148,6 +148,7 @@ class KartMove:
         self.wheelie_rotation_decrease = self.inst_wheelie_rotation_decrease
     
     @staticmethod
+    @cached_chain
     def chain(player_idx=0) -> int:
         return KartObject.kart_move(player_idx)
 
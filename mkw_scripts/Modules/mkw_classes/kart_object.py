@@ -1,6 +1,6 @@
 from dolphin import memory # type: ignore
 
-from . import KartObjectManager
+from . import KartObjectManager, cached_chain
 
 class KartObject:
     def __init__(self, player_idx=0, addr=None):
@@ -16,6 +16,7 @@ class KartObject:
         self.kart_collide = self.inst_kart_collide
     
     @staticmethod
+    @cached_chain
     def chain(player_idx=0) -> int:
         return KartObjectManager.kart_object(player_idx)
 
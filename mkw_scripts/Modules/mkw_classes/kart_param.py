@@ -1,6 +1,6 @@
 from dolphin import memory
 
-from . import KartSettings
+from . import KartSettings, cached_chain
 
 class KartParam:
     def __init__(self, player_idx=0, addr=None):
@@ -10,6 +10,7 @@ class KartParam:
         self.bsp = self.inst_bsp
     
     @staticmethod
+    @cached_chain
     def chain(player_idx=0) -> int:
         return KartSettings.kart_param(player_idx)
 
@@ -1,6 +1,6 @@
 from dolphin import memory
 
-from . import KartObject, VehicleId, CharacterId
+from . import KartObject, VehicleId, CharacterId, cached_chain
 
 class KartSettings:
     def __init__(self, player_idx=0, addr=None):
@@ -16,6 +16,7 @@ class KartSettings:
         self.race_stats = self.inst_race_stats
 
     @staticmethod
+    @cached_chain
     def chain(player_idx=0) -> int:
         return KartObject.kart_settings(player_idx)
 
@@ -1,6 +1,6 @@
 from dolphin import memory # type: ignore
 
-from . import KartObject, vec3
+from . import KartObject, vec3, cached_chain
 
 class KartState:
     def __init__(self, player_idx=0, addr=None):
@@ -22,6 +22,7 @@ class KartState:
         self.trickable_timer = self.inst_trickable_timer
     
     @staticmethod
+    @cached_chain
     def chain(player_idx=0) -> int:
         return KartObject.kart_state(player_idx)
 
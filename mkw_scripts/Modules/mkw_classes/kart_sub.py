@@ -1,6 +1,6 @@
 from dolphin import memory
 
-from . import KartObject, mat34
+from . import KartObject, mat34, cached_chain
 
 class KartSub:
     def __init__(self, player_idx=0, addr=None):
@@ -12,6 +12,7 @@ class KartSub:
         self.wheelie_rotate_angle = self.inst_wheelie_rotate_angle
 
     @staticmethod
+    @cached_chain
     def chain(player_idx=0) -> int:
         return KartObject.kart_sub(player_idx)
 
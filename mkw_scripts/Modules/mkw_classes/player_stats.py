@@ -1,6 +1,6 @@
 from dolphin import memory
 
-from . import KartParam, WheelCount, VehicleType
+from . import KartParam, WheelCount, VehicleType, cached_chain
 
 class PlayerStats:
     def __init__(self, player_idx=0, addr=None):
@@ -35,6 +35,7 @@ class PlayerStats:
         self.tire_distance = self.inst_tire_distance
     
     @staticmethod
+    @cached_chain
     def chain(player_idx=0) -> int:
         return KartParam.player_stats(player_idx)
 
@@ -1,7 +1,7 @@
 from dolphin import memory # type: ignore
 from enum import Enum
 
-from . import Timer, RaceManager
+from . import Timer, RaceManager, cached_chain
 
 class RaceInfoPlayerFlags(Enum):
     IN_RACE = 1
@@ -40,6 +40,7 @@ class RaceManagerPlayer:
         self.finishing_position = self.inst_finishing_position
 
     @staticmethod
+    @cached_chain
     def chain(player_idx=0) -> int:
         return RaceManager.race_manager_player(player_idx)
     
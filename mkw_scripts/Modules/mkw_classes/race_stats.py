@@ -1,6 +1,6 @@
 from dolphin import memory
 
-from . import KartSettings
+from . import KartSettings, cached_chain
 
 class RaceStats:
     def __init__(self, player_idx=0, addr=None):
@@ -12,6 +12,7 @@ class RaceStats:
         self.trick_count = self.inst_trick_count
 
     @staticmethod
+    @cached_chain
     def chain(player_idx=0) -> int:
         return KartSettings.race_stats(player_idx)
     
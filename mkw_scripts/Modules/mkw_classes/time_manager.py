@@ -1,6 +1,6 @@
 from dolphin import memory # type: ignore
 
-from . import RaceManager
+from . import RaceManager, cached_chain
 
 class TimerManager:
     def __init__(self, addr=None):
@@ -14,6 +14,7 @@ class TimerManager:
         self.race_frame_counter = self.inst_race_frame_counter
 
     @staticmethod
+    @cached_chain
     def chain() -> int:
         return RaceManager.timer_manager()
     
@@ -1,6 +1,6 @@
 from dolphin import memory
 
-from . import vec3, quatf, mat34, KartBody
+from . import vec3, quatf, mat34, KartBody, cached_chain
 
 class VehicleDynamics:
     def __init__(self, player_idx=0, addr=None):
@@ -22,6 +22,7 @@ class VehicleDynamics:
         self.speed = self.inst_speed
 
     @staticmethod
+    @cached_chain
     def chain(player_idx=0) -> int:
         return KartBody.vehicle_dynamics(player_idx)
     
@@ -1,6 +1,6 @@
 from dolphin import memory # type: ignore
 
-from . import mat34, vec3, quatf, VehicleDynamics
+from . import mat34, vec3, quatf, VehicleDynamics, cached_chain
 
 class VehiclePhysics:
     def __init__(self, player_idx=0, addr=None):
@@ -32,6 +32,7 @@ class VehiclePhysics:
         self.scale = self.inst_scale
 
     @staticmethod
+    @cached_chain
     def chain(player_idx=0) -> int:
         return VehicleDynamics.vehicle_physics(player_idx)
     
@@ -1,8 +1,9 @@
 from dolphin import memory #type: ignore
 from mkw_scripts.Modules import mkw_config
 
-from mkw_scripts.Modules.mkw_classes import mat34, quatf, vec3, ExactTimer
-from mkw_scripts.Modules.mkw_classes import VehicleDynamics, VehiclePhysics, RaceManagerPlayer
+# Relative, so that scripts importing Modules.mkw_utils share the chain cache of Modules.mkw_classes
+from .mkw_classes import mat34, quatf, vec3, ExactTimer, chain_cache
+from .mkw_classes import VehicleDynamics, VehiclePhysics, RaceManagerPlayer
 
 # These are helper functions that don't quite fit in common.py
 # This file also contains getter functions for a few global variables.
@@ -10,15 +11,23 @@ from mkw_scripts.Modules.mkw_classes import VehicleDynamics, VehiclePhysics, Rac
 # NOTE (xi): wait for get_game_id() to be put in dolphin.memory before clearing
 #  these commented-out lines:
 
+def resolve_pointer(base_address, offsets):
+    """Dereferences base_address, then every offset but the last, and
+       returns the address of the value. The result is kept in the chain
+       cache, as the objects these chains lead to live as long as a race."""
+    def resolve():
+        current_address = memory.read_u32(base_address)
+        for offset in offsets[:-1]:
+            current_address = memory.read_u32(current_address + offset)
+        return current_address + offsets[-1]
+    return chain_cache.lookup(("chase_pointer", base_address, tuple(offsets)), resolve)
+
 def chase_pointer(base_address, offsets, data_type):
     """This is a helper function to allow multiple ptr dereferences in
        quick succession. base_address is dereferenced first, and then
        offsets are applied. Then, the appropriate function based off data_type
        is called with the resulting dereferences + the final offset."""
-    current_address = memory.read_u32(base_address)
-    for offset in offsets:
-        value_address = current_address + offset
-        current_address = memory.read_u32(current_address + offset)
+    value_address = resolve_pointer(base_address, offsets)
     data_types = {
         'u8': memory.read_u8,
         'u16': memory.read_u16,
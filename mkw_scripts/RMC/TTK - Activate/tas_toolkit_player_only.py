@@ -2,7 +2,7 @@ from dolphin import event, gui
 from Modules import ttk_lib
 from Modules.mkw_utils import frame_of_input
 from Modules.framesequence import FrameSequence
-from Modules.mkw_classes import RaceManager, RaceState
+from Modules.mkw_classes import RaceManager, RaceState, clear_chain_cache
 
 player_inputs = FrameSequence()
 
@@ -15,6 +15,7 @@ The inputs are reloaded on every state load
 
 @event.on_savestateload
 def on_state_load(is_slot, slot):
+    clear_chain_cache()
     player_inputs.read_from_file()
 
 @event.on_frameadvance
@@ -11,6 +11,7 @@ from Modules.mkw_classes import RaceConfig, RaceConfigScenario, RaceConfigSettin
 from Modules.mkw_classes import KartObject, KartMove, KartSettings, KartBody
 from Modules.mkw_classes import VehicleDynamics, VehiclePhysics, KartBoost, KartJump
 from Modules.mkw_classes import KartState, KartCollide, KartInput, RaceInputState
+from Modules.mkw_classes import chain_cache
 
 def populate_default_config(file_path):
     config = configparser.ConfigParser()
@@ -263,12 +264,17 @@ def create_infodisplay():
 
 @event.on_savestateload
 def on_state_load(fromSlot: bool, slot: int):
+    chain_cache.clear()
+    chain_cache.begin_frame()
     race_mgr = RaceManager()
     if race_mgr.state().value >= RaceState.COUNTDOWN.value:
         gui.draw_text((10, 10), c.color, create_infodisplay())
+    chain_cache.end_frame()
 
 @event.on_frameadvance
 def on_frame_advance():
+    chain_cache.begin_frame()
     race_mgr = RaceManager()
     if race_mgr.state().value >= RaceState.COUNTDOWN.value:
         gui.draw_text((10, 10), c.color, create_infodisplay())
+    chain_cache.end_frame()
@@ -0,0 +1,50 @@
+"""
+This script times the game state readers off-emulator, using the offline_dolphin stand-in loaded with memory dumps.
+
+The dumps must be taken during a race (Dolphin: Debug > Memory > Dump MEM1 / Dump MEM2).
+Both the per-getter path and the snapshot path of MKW_Interface are timed, and their outputs are checked to match.
+"""
+
+import argparse
+import time
+from pathlib import Path
+
+from MKW_rl.MKW_interaction import offline_dolphin
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("mem1_path", type=Path)
+    parser.add_argument("mem2_path", type=Path, nargs="?")
+    parser.add_argument("--iterations", type=int, default=10000)
+    args = parser.parse_args()
+
+    offline_dolphin.install()
+    offline_dolphin.memory.load_dump(args.mem1_path, args.mem2_path)
+
+    from MKW_rl.MKW_interaction.MKW_interface import MKW_Interface
+
+    interface = MKW_Interface()
+    interface.initialize_race_objects()
+
+    by_field = interface.get_game_data_object_by_field()
+    snapshot = interface.get_game_data_object()
+    if by_field != snapshot:
+        print("WARNING: snapshot and per-field readers disagree")
+        print("by field:", by_field)
+        print("snapshot:", snapshot)
+
+    for name, reader in [
+        ("by field", interface.get_game_data_object_by_field),
+        ("snapshot", interface.get_game_data_object),
+        ("snapshot array", interface.get_game_data_snapshot),
+    ]:
+        start = time.perf_counter()
+        for _ in range(args.iterations):
+            reader()
+        elapsed = time.perf_counter() - start
+        print(f"{name:>15}: {1e6 * elapsed / args.iterations:8.1f} us per frame")
+
+
+if __name__ == "__main__":
+    main()
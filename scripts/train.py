@@ -57,8 +57,11 @@ if cmd_subfolder not in sys.path:
 
 from config_files import config_copy
 from MKW_rl.agents.iqn import make_untrained_iqn_network
+from MKW_rl.device_policy import DevicePolicy
 from MKW_rl.multiprocess.collector_process import collector_process_fn
+from MKW_rl.multiprocess.inference_server import InferenceServer
 from MKW_rl.multiprocess.learner_process import learner_process_fn
+from MKW_rl.multiprocess.shared_weights import SharedWeights
 
 # Set torch settings for RL
 # noinspection PyUnresolvedReferences
@@ -120,10 +123,21 @@ if __name__ == "__main__":
     shared_steps = mp.Value(ctypes.c_int64)
     shared_steps.value = 0
     rollout_queues = [mp.Queue(config_copy.max_rollout_queue_size) for _ in range(config_copy.gpu_collectors_count)]
-    shared_network_lock = Lock()
     game_spawning_lock = Lock()
-    _, uncompiled_shared_network = make_untrained_iqn_network(jit=config_copy.use_jit, is_inference=False) # initialize the network
-    uncompiled_shared_network.share_memory() # share network memory for multi-threading
+    device_policy = DevicePolicy.from_config()
+    _, uncompiled_shared_network = make_untrained_iqn_network(config_copy.use_jit, False, device_policy) # initialize the network
+    shared_weights = SharedWeights(uncompiled_shared_network) # double-buffered weights, shared with the collectors
+    del uncompiled_shared_network
+    inference_server = None
+    if config_copy.use_inference_server:
+        # Collectors send their inferences to a thread of this process, whose network pulls the weights the learner publishes
+        inference_server = InferenceServer(
+            *make_untrained_iqn_network(jit=config_copy.use_jit, is_inference=False, device_policy=device_policy),
+            shared_weights,
+            config_copy.gpu_collectors_count,
+            config_copy.inference_server_max_wait,
+        )
+        inference_server.start()
 
     # Start worker process
     collector_processes = [
@@ -131,8 +145,8 @@ if __name__ == "__main__":
             target=collector_process_fn,
             args=(
                 rollout_queue,
-                uncompiled_shared_network,
-                shared_network_lock,
+                shared_weights,
+                inference_server.client(process_number) if inference_server is not None else None,
                 game_spawning_lock,
                 shared_steps,
                 base_dir,
@@ -148,7 +162,11 @@ if __name__ == "__main__":
 
     # Start learner process
     print("Train.py: Starting learner process")
-    learner_process_fn(rollout_queues,uncompiled_shared_network,shared_network_lock,shared_steps,base_dir,save_dir,tensorboard_base_dir) #Turn main process into learner process instead of starting a new one, this saves 1 CUDA context
+    try:
+        learner_process_fn(rollout_queues,shared_weights,shared_steps,base_dir,save_dir,tensorboard_base_dir) #Turn main process into learner process instead of starting a new one, this saves 1 CUDA context
+    finally:
+        if inference_server is not None:
+            inference_server.close() # stop the server thread with the learner
 
     for collector_process in collector_processes:
         collector_process.join() # combine processes for learning and/or completion?
@@ -0,0 +1,19 @@
+"""
+Tests run from the repository root, with the configuration that training would use.
+scripts/train.py copies config.py to config_copy.py. The tests import config.py as config_files.config_copy instead,
+so that they neither write to the tree nor read a config_copy.py left over from an earlier training run.
+"""
+
+import sys
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parents[1]
+
+if str(BASE_DIR) not in sys.path:
+    sys.path.insert(0, str(BASE_DIR))
+
+import config_files  # noqa: E402
+from config_files import config  # noqa: E402
+
+sys.modules["config_files.config_copy"] = config
+config_files.config_copy = config
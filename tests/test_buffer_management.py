@@ -0,0 +1,377 @@
+"""
+Checks that fill_buffer_from_rollout_with_n_steps_rule() forms the same transitions as the frame-by-frame loops it replaced.
+
+baseline_fill_buffer_from_rollout_with_n_steps_rule() is the function as it was before rewards and n-step returns were computed
+with array operations, copied as-is apart from its name and trailing whitespace, and from the distance of the close-to-VCP
+reward. Since then:
+    - the close-to-VCP reward measures the distance to the first zone center ahead, where the baseline took the norm of its
+      first coordinate,
+    - images are referenced by their index in the rollout until they are added to the frame store,
+    - the states carry the actions chosen before each frame for every rollout, which the baseline only did for rollouts with
+      pipelined actions. The synthetic rollouts are therefore marked as such.
+"""
+
+import math
+import random
+import threading
+
+import numpy as np
+import pytest
+from torchrl.data import ReplayBuffer
+
+from config_files import config_copy
+from MKW_rl.buffer_management import fill_buffer_from_rollout_with_n_steps_rule
+from MKW_rl.experience_replay.experience_replay_interface import Experience
+from MKW_rl.MKW_interaction.MKW_state_layout import STATE_LAYOUT, get_1d_state_floats
+from MKW_rl.rollout_recorder import RolloutRecorder
+
+N_STEPS_MAX = 5
+GAMMA = 0.99
+FRAME_SHAPE = (1, 6, 8)
+START_BOOST_REWARD = 0.3
+CLOSE_TO_VCP_REWARD = 0.7
+
+
+def baseline_fill_buffer_from_rollout_with_n_steps_rule(
+    buffer: ReplayBuffer,
+    buffer_test: ReplayBuffer,
+    rollout_results: dict,
+    n_steps_max: int,
+    gamma: float,
+    discard_non_greedy_actions_in_nsteps: bool,
+    engineered_item_usage_reward=-4.0,
+    engineered_button_A_pressed_reward=2,
+    engineered_supergrinding_reward=0.0,
+    engineered_close_to_vcp_reward=0,
+    engineered_start_boost_reward=0,
+):
+    assert len(rollout_results["frames"]) == len(rollout_results["current_zone_idx"])
+    n_frames = len(rollout_results["frames"])
+    # One row per frame, see rollout_recorder
+    states = rollout_results["state_float"]
+    columns = rollout_results["state_float_columns"]
+
+    number_memories_added_train = 0
+    number_memories_added_test = 0
+    Experiences_For_Buffer = []
+    Experiences_For_Buffer_Test = []
+    list_to_fill = Experiences_For_Buffer_Test if random.random() < config_copy.buffer_test_ratio else Experiences_For_Buffer
+
+    gammas = (gamma ** np.linspace(1, n_steps_max, n_steps_max)).astype(
+        np.float32
+    )  # Discount factor that will be placed in front of next_step in Bellman equation, depending on n_steps chosen
+
+    reward_into = np.zeros(n_frames)
+    for i in range(1, n_frames): # run for each frame of the rollout
+        """reward_into[i] += config_copy.constant_reward_per_ms * (
+            config_copy.f_per_action
+            if (i < n_frames - 1 or ("race_time" not in rollout_results)) # We haven't generated any frames, or the race has not started
+            else rollout_results["race_time"] - (n_frames - 2) * config_copy.f_per_action
+        )"""
+        if states[i, columns["race_data.state"]] == 2: # Only apply these rewards during the actual race (Not race finished, not during countdown timer)
+            reward_into[i] += config_copy.constant_reward_per_action
+            temp_completion_reward = (
+                rollout_results["race_completion"][i] - rollout_results["race_completion"][i - 1] # meters progressed (negative if backwards)
+            ) * config_copy.reward_per_m_advanced_along_centerline # Based on estimated time to lap completion
+
+            # discourage mushroom usage according to speed increase for the duration of the boost
+            # 83 > 120 = 40 speed increase. 1/3rd of progression. so, discount roughly 40% (?) of progression
+            if (states[i, columns["boost_data.shroom_boost"]] > 60
+                and temp_completion_reward > 0
+                and not states[i, columns["surface_properties"]]): # not on offroad, shouldn't have used shroom
+                temp_completion_reward = 0 # 0.6 (40% discount for speed increase) divided by 30/90 as we can't confirm source of boost outside that range
+
+            if states[i, columns["race_data.item_count"]] < states[i - 1, columns["race_data.item_count"]]:
+                # used item punish
+                reward_into[i] += config_copy.constant_reward_per_action * engineered_item_usage_reward
+
+            # LUIGI CIRCUIT FORCE SHORTCUT
+            if states[i, columns["kart_data.position"]][2] > config_copy.LC_punish_line:
+                reward_into[i] += config_copy.constant_reward_per_action * config_copy.LC_punish_rate # triple punishment
+
+            reward_into[i] += temp_completion_reward
+
+            if i < n_frames - 1:
+                if engineered_close_to_vcp_reward != 0:
+                    reward_into[i] += engineered_close_to_vcp_reward * np.interp(max(config_copy.engineered_reward_min_dist_to_cur_vcp,
+                            min(config_copy.engineered_reward_max_dist_to_cur_vcp, np.sqrt(np.sum(np.square(states[i, columns["relative_zone_centers"]][0:3])))),
+                        ),
+                        [config_copy.engineered_reward_min_dist_to_cur_vcp, config_copy.engineered_reward_max_dist_to_cur_vcp],
+                        [0.5, -1]
+                    ) # normalizing to 1, -1 using np.interp so when we multiply by engineered reward we are reasonable
+
+                """if (math.floor(-(rollout_results["state_float"][i]["race_data"]["race_completion_max"] - 4))) > rollout_results["state_float"][i]["race_data"]["item_count"]:
+                    reward_into[i] -= (temp_completion_reward / 2) # less reward for you, you mushroomed too much"""
+
+        if i < n_frames - 1: # apply these rewards even during countdown
+            """if config_copy.final_speed_reward_per_f_per_s != 0:
+                # car is driving forward
+                reward_into[i] += config_copy.final_speed_reward_per_f_per_s * (
+                    rollout_results["state_float"][i]["kart_data"]["speed"]
+                )
+            if engineered_button_A_pressed_reward != 0 and config_copy.inputs[rollout_results["actions"][i]]["A"] > 0 and config_copy.inputs[rollout_results["actions"][i]]["TriggerRight"] == 0:
+                reward_into[i] += engineered_button_A_pressed_reward
+
+            if engineered_item_usage_reward != 0 and config_copy.inputs[rollout_results["actions"][i]]["TriggerLeft"] > 0:
+                reward_into[i] += engineered_item_usage_reward
+
+            if engineered_speedslide_reward != 0 and np.all(rollout_results["state_float"][i][25:29]):
+                # all wheels touch the ground
+                reward_into[i] += engineered_speedslide_reward * max(
+                    0.0,
+                    1 - abs(speedslide_quality_tarmac(rollout_results["state_float"][i][56], rollout_results["state_float"][i][58]) - 1),
+                )  # TODO : indices 25:29, 56 and 58 are hardcoded, this is bad....
+
+            # lateral speed is higher than 2 meters per second
+            reward_into[i] += (
+                engineered_neoslide_reward if abs(rollout_results["state_float"][i][56]) >= 2.0 else 0
+            )  # TODO : 56 is hardcoded, this is bad....
+            # kamikaze reward
+            if (
+                engineered_kamikaze_reward != 0
+                and rollout_results["actions"][i] <= 2
+                or np.sum(rollout_results["state_float"][i][25:29]) <= 1
+            ):
+                reward_into[i] += engineered_kamikaze_reward"""
+
+            if (engineered_start_boost_reward != 0
+                and states[i, columns["race_data.state"]] == 1): # only reward start boost during countdown
+                # reward_into[i] += engineered_start_boost_reward * (rollout_results["state_float"][i]["start_boost_charge"] - .3)
+                if states[i, columns["start_boost_charge"]] > states[i - 1, columns["start_boost_charge"]]:
+                    reward_into[i] += engineered_start_boost_reward if states[i, columns["start_boost_charge"]] < 0.95 else -engineered_start_boost_reward
+                else:
+                    reward_into[i] += -engineered_start_boost_reward if states[i, columns["start_boost_charge"]] <= 0.925 else 0
+
+    for i in range(n_frames - 1):  # Loop over all frames that were generated
+        # Switch memory buffer sometimes
+        if random.random() < 0.1:
+            list_to_fill = Experiences_For_Buffer_Test if random.random() < config_copy.buffer_test_ratio else Experiences_For_Buffer
+
+        n_steps = min(n_steps_max, n_frames - 1 - i)
+        if discard_non_greedy_actions_in_nsteps:
+            non_greedy = np.flatnonzero(~rollout_results["action_was_greedy"][i + 1 : i + n_steps])
+            if len(non_greedy) > 0:
+                n_steps = min(n_steps, non_greedy[0] + 1)
+
+        rewards = np.empty(n_steps_max).astype(np.float32)
+        for j in range(n_steps):
+            rewards[j] = (gamma**j) * reward_into[i + j + 1] + (rewards[j - 1] if j >= 1 else 0)
+
+        state_img = rollout_results["frames"][i]
+        state_float = states[i]
+        #state_potential = get_potential(rollout_results["state_float"][i])
+
+        # Get action that was played
+        action = rollout_results["actions"][i]
+        terminal_actions = float((n_frames - 1) - i) if "race_time" in rollout_results else math.inf
+        next_state_has_passed_finish = ((i + n_steps) == (n_frames - 1)) and ("race_time" in rollout_results)
+
+        if not next_state_has_passed_finish:
+            next_state_img = rollout_results["frames"][i + n_steps]
+            next_state_float = states[i + n_steps]
+            # next_state_potential = get_potential(rollout_results["state_float"][i + n_steps])
+        else:
+            # It doesn't matter what next_state_img and next_state_float contain, as the transition will be forced to be final
+            next_state_img = state_img
+            next_state_float = state_float
+            #next_state_potential = 0
+
+        if rollout_results.get("action_delay", 0) > 0:
+            # The action chosen one step earlier is still pending when the next one is chosen, and decides the next rewards.
+            # The states must carry it as the collector's network saw it, i.e. with the actions chosen before each frame.
+            state_float = get_1d_state_floats(state_float, rollout_results["actions"][:i])
+            next_state_float = get_1d_state_floats(next_state_float, rollout_results["actions"][: i + n_steps])
+        else:
+            state_float = get_1d_state_floats(state_float, rollout_results["actions"])
+            next_state_float = get_1d_state_floats(next_state_float, rollout_results["actions"][:-1])
+
+        list_to_fill.append(
+            Experience(
+                state_img,
+                state_float,
+                # state_potential,
+                action,
+                n_steps,
+                rewards,
+                next_state_img,
+                next_state_float,
+                # next_state_potential,
+                gammas,
+                terminal_actions,
+            )
+        )
+    # print("Sum of rewards for this rollout:", sum(reward_into))
+    number_memories_added_train += len(Experiences_For_Buffer)
+    if len(Experiences_For_Buffer) > 1:
+        buffer.extend(Experiences_For_Buffer)
+    elif len(Experiences_For_Buffer) == 1:
+        buffer.add(Experiences_For_Buffer[0])
+    number_memories_added_test += len(Experiences_For_Buffer_Test)
+    if len(Experiences_For_Buffer_Test) > 1:
+        buffer_test.extend(Experiences_For_Buffer_Test)
+    elif len(Experiences_For_Buffer_Test) == 1:
+        buffer_test.add(Experiences_For_Buffer_Test[0])
+
+    return buffer, buffer_test, number_memories_added_train, number_memories_added_test
+
+
+class RecordingStorage:
+    def __init__(self):
+        self.frames = None
+
+    def add_rollout_frames(self, experiences, frames):
+        self.frames = frames
+
+
+class RecordingBuffer:
+    """
+    Stands in for a ReplayBuffer, and keeps the experiences it is given in order.
+    """
+
+    def __init__(self):
+        self._replay_lock = threading.Lock()
+        self._storage = RecordingStorage()
+        self.experiences = []
+
+    def extend(self, experiences):
+        self.experiences.extend(experiences)
+
+    def add(self, experience):
+        self.experiences.append(experience)
+
+
+def make_rollout(seed: int, n_frames: int, finished: bool, send_chunk=None, chunk_size: int = 0) -> dict:
+    """
+    Synthetic rollout with a countdown, a race with item uses and mushroom boosts, and random non-greedy actions.
+    With send_chunk, the rollout is also cut in chunks as GameManager.rollout() does, and the last one is in rollout_results["last_chunk"].
+    """
+    rng = np.random.default_rng(seed)
+    columns = STATE_LAYOUT.state_float_columns
+    n_actions = len(config_copy.inputs)
+    recorder = RolloutRecorder(FRAME_SHAPE, n_actions, initial_capacity=16)
+    recorder.set_state_float_columns(columns)
+    n_state_floats = recorder.columns["state_float"].shape[1]
+    n_zone_center_floats = len(range(n_state_floats)[columns["relative_zone_centers"]])
+
+    n_countdown = n_frames // 5
+    item_count = 3
+    race_completion = 0.0
+    chunk_start = 0
+    for i in range(n_frames):
+        state_float = rng.normal(size=n_state_floats).astype(np.float32)
+        state_float[columns["race_data.state"]] = 1 if i < n_countdown else (3 if finished and i == n_frames - 1 else 2)
+        if rng.random() < 0.1 and item_count > 0:
+            item_count -= 1
+        state_float[columns["race_data.item_count"]] = item_count
+        state_float[columns["start_boost_charge"]] = rng.choice([0.9, 0.925, 0.93, 0.95, 0.97])
+        state_float[columns["boost_data.shroom_boost"]] = rng.integers(0, 90)
+        state_float[columns["surface_properties"]] = rng.integers(0, 2)
+        state_float[columns["kart_data.position"]] = rng.normal(config_copy.LC_punish_line, 500, size=3)
+        state_float[columns["relative_zone_centers"]] = rng.normal(0, 3000, size=n_zone_center_floats)
+        race_completion += rng.normal(0.5, 1.0)
+        recorder.append(
+            rng.integers(0, 256, size=FRAME_SHAPE, dtype=np.uint8),
+            state_float,
+            rng.integers(0, n_actions),
+            rng.random() < 0.8,
+            rng.normal(size=n_actions),
+            0,
+            race_completion,
+            False,
+        )
+        if send_chunk is not None and i < n_frames - 1 and len(recorder) - chunk_start >= chunk_size + N_STEPS_MAX:
+            send_chunk(recorder.chunk(chunk_start, False, N_STEPS_MAX, config_copy.n_prev_actions_in_inputs))
+            chunk_start = len(recorder) - N_STEPS_MAX
+    rollout_results = recorder.finish()
+    # The baseline gives the states the actions chosen before each frame only when actions are delayed
+    rollout_results["action_delay"] = 1
+    if finished:
+        rollout_results["race_time"] = 12.5
+    if send_chunk is not None:
+        last_chunk = recorder.chunk(chunk_start, True, N_STEPS_MAX, config_copy.n_prev_actions_in_inputs)
+        if finished:
+            last_chunk["race_time"] = rollout_results["race_time"]
+        rollout_results["last_chunk"] = last_chunk
+    return rollout_results
+
+
+def fill_buffers(fill_function, rollout_results, seed, discard_non_greedy_actions_in_nsteps):
+    random.seed(seed)
+    buffer, buffer_test = RecordingBuffer(), RecordingBuffer()
+    _, _, n_train, n_test = fill_function(
+        buffer,
+        buffer_test,
+        rollout_results,
+        N_STEPS_MAX,
+        GAMMA,
+        discard_non_greedy_actions_in_nsteps,
+        engineered_close_to_vcp_reward=CLOSE_TO_VCP_REWARD,
+        engineered_start_boost_reward=START_BOOST_REWARD,
+    )
+    assert (n_train, n_test) == (len(buffer.experiences), len(buffer_test.experiences))
+    return buffer, buffer_test
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+@pytest.mark.parametrize("finished", [False, True])
+@pytest.mark.parametrize("discard_non_greedy_actions_in_nsteps", [False, True])
+def test_transitions_match_baseline(seed, finished, discard_non_greedy_actions_in_nsteps):
+    rollout_results = make_rollout(seed, 40 + seed, finished)
+    frames = rollout_results["frames"]
+    discard = discard_non_greedy_actions_in_nsteps
+    expected_buffers = fill_buffers(baseline_fill_buffer_from_rollout_with_n_steps_rule, rollout_results, seed, discard)
+    buffers = fill_buffers(fill_buffer_from_rollout_with_n_steps_rule, rollout_results, seed, discard)
+
+    for buffer, expected_buffer in zip(buffers, expected_buffers):
+        assert len(buffer.experiences) == len(expected_buffer.experiences)
+        if buffer.experiences:
+            assert buffer._storage.frames is frames
+        for experience, expected in zip(buffer.experiences, expected_buffer.experiences):
+            n_steps = expected.n_steps
+            assert experience.n_steps == n_steps
+            # The baseline left the rewards beyond n_steps uninitialized
+            assert np.array_equal(experience.rewards[:n_steps], expected.rewards[:n_steps])
+            assert np.array_equal(frames[experience.state_img], expected.state_img)
+            assert np.array_equal(frames[experience.next_state_img], expected.next_state_img)
+            assert np.array_equal(experience.state_float, expected.state_float)
+            assert np.array_equal(experience.next_state_float, expected.next_state_float)
+            assert experience.action == expected.action
+            assert np.array_equal(experience.gammas, expected.gammas)
+            assert experience.terminal_actions == expected.terminal_actions
+
+
+@pytest.mark.parametrize("finished", [False, True])
+@pytest.mark.parametrize("discard_non_greedy_actions_in_nsteps", [False, True])
+def test_chunks_match_whole_rollout(monkeypatch, finished, discard_non_greedy_actions_in_nsteps):
+    # Every transition goes to the train buffer, as each chunk draws its own train/test split
+    monkeypatch.setattr(config_copy, "buffer_test_ratio", 0)
+    chunks = []
+    rollout_results = make_rollout(0, 60, finished, send_chunk=chunks.append, chunk_size=8)
+    chunks.append(rollout_results["last_chunk"])
+    assert len(chunks) > 2
+
+    whole_buffer, _ = fill_buffers(fill_buffer_from_rollout_with_n_steps_rule, rollout_results, 0, discard_non_greedy_actions_in_nsteps)
+    chunk_transitions = []
+    for chunk in chunks:
+        chunk_buffer, _ = fill_buffers(fill_buffer_from_rollout_with_n_steps_rule, chunk, 0, discard_non_greedy_actions_in_nsteps)
+        chunk_transitions += [(experience, chunk) for experience in chunk_buffer.experiences]
+
+    frames = rollout_results["frames"]
+    assert len(chunk_transitions) == len(whole_buffer.experiences) == len(frames) - 1
+    for expected, (experience, chunk) in zip(whole_buffer.experiences, chunk_transitions):
+        n_steps = expected.n_steps
+        assert experience.n_steps == n_steps
+        assert np.array_equal(experience.rewards[:n_steps], expected.rewards[:n_steps])
+        assert np.array_equal(chunk["frames"][experience.state_img], frames[expected.state_img])
+        assert np.array_equal(chunk["frames"][experience.next_state_img], frames[expected.next_state_img])
+        assert np.array_equal(experience.state_float, expected.state_float)
+        assert np.array_equal(experience.next_state_float, expected.next_state_float)
+        assert experience.action == expected.action
+        assert np.array_equal(experience.gammas, expected.gammas)
+        if chunk["is_last_chunk"] or not finished:
+            assert experience.terminal_actions == expected.terminal_actions
+        else:
+            # The race had not finished when the chunk was sent. The finish is further than any n_steps,
+            # so the transition is not terminal either way.
+            assert experience.terminal_actions == math.inf
+            assert expected.terminal_actions > N_STEPS_MAX
@@ -0,0 +1,37 @@
+"""
+Checks that the NumPy grayscale conversion used by both the game manager and the game instance hook matches OpenCV byte for byte.
+"""
+
+import numpy as np
+import pytest
+
+from MKW_rl.MKW_interaction.MKW_frame import (
+    FRAME_HEIGHT,
+    FRAME_STRIDE,
+    FRAME_WIDTH,
+    PREPROCESSED_FRAME_HEIGHT,
+    PREPROCESSED_FRAME_WIDTH,
+    grayscale_numpy,
+    preprocess_frame,
+)
+
+cv2 = pytest.importorskip("cv2")
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_grayscale_matches_cv2(seed):
+    frame = np.random.default_rng(seed).integers(0, 256, size=(FRAME_HEIGHT, FRAME_WIDTH, 3), dtype=np.uint8)
+    assert np.array_equal(grayscale_numpy(frame), cv2.cvtColor(frame, cv2.COLOR_BGRA2GRAY))
+
+
+def test_grayscale_rounding():
+    # 14-bit coefficients round this pixel to 28
+    frame = np.array([[[55, 0, 71]]], dtype=np.uint8)
+    assert grayscale_numpy(frame)[0, 0] == cv2.cvtColor(frame, cv2.COLOR_BGRA2GRAY)[0, 0] == 27
+
+
+def test_preprocess_frame_matches_cv2():
+    frame = np.random.default_rng(0).integers(0, 256, size=(FRAME_HEIGHT, FRAME_WIDTH, 3), dtype=np.uint8)
+    preprocessed = preprocess_frame(frame)
+    assert preprocessed.shape == (1, PREPROCESSED_FRAME_HEIGHT, PREPROCESSED_FRAME_WIDTH)
+    assert np.array_equal(preprocessed[0], cv2.cvtColor(frame[::FRAME_STRIDE, ::FRAME_STRIDE], cv2.COLOR_BGRA2GRAY))
@@ -0,0 +1,114 @@
+"""
+Runs the InferenceServer on CPU with clients sending requests from several threads, and checks each answer against
+the same state inferred alone by an Inferer.
+
+The server samples tau itself. The network it is given takes the Inferer's fixed tau instead, so that both give the same q-values.
+"""
+
+import threading
+
+import numpy as np
+import torch
+
+from config_files import config_copy
+from MKW_rl.agents.iqn import Inferer, make_untrained_iqn_network
+from MKW_rl.device_policy import DevicePolicy
+from MKW_rl.multiprocess.inference_server import InferenceServer
+
+N_CLIENTS = 3
+N_REQUESTS = 4
+
+
+class FixedTauNetwork(torch.nn.Module):
+    """
+    Network of the server, which infers each state of a batch with the same tau.
+    """
+
+    def __init__(self, network: torch.nn.Module, tau: torch.Tensor):
+        super().__init__()
+        self.network = network
+        self.tau = tau
+        self.batch_sizes = []
+
+    def forward(self, img: torch.Tensor, float_inputs: torch.Tensor, num_quantiles: int):
+        self.batch_sizes.append(len(img))
+        # Rows of the output are ordered by quantile, then by state
+        return self.network(img, float_inputs, num_quantiles, tau=self.tau.repeat_interleave(len(img), dim=0))
+
+
+class FailingNetwork(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.linear = torch.nn.Linear(1, 1)
+
+    def forward(self, img: torch.Tensor, float_inputs: torch.Tensor, num_quantiles: int):
+        raise RuntimeError("shape mismatch")
+
+
+def test_batched_q_values_match_single_inferences():
+    torch.manual_seed(0)
+    device_policy = DevicePolicy("cpu", None)
+    network, uncompiled_network = make_untrained_iqn_network(jit=False, is_inference=True, device_policy=device_policy)
+    inferer = Inferer(network, config_copy.iqn_k, config_copy.tau_epsilon_boltzmann, device_policy)
+    server_network = FixedTauNetwork(network, inferer.fixed_tau)
+    server = InferenceServer(server_network, uncompiled_network, None, N_CLIENTS, max_wait=0.2)
+    server.start()
+
+    rng = np.random.default_rng(0)
+    img_inputs = rng.integers(0, 256, size=(N_CLIENTS, N_REQUESTS, 1, config_copy.H_downsized, config_copy.W_downsized), dtype=np.uint8)
+    float_inputs = rng.normal(size=(N_CLIENTS, N_REQUESTS, config_copy.float_input_dim)).astype(np.float32)
+    answers = np.empty((N_CLIENTS, N_REQUESTS, config_copy.iqn_k, len(config_copy.inputs)), dtype=np.float32)
+    barrier = threading.Barrier(N_CLIENTS)
+
+    def collect(index: int):
+        client = server.client(index)
+        for request in range(N_REQUESTS):
+            barrier.wait()
+            answers[index, request] = client.infer(img_inputs[index, request], float_inputs[index, request])
+
+    threads = [threading.Thread(target=collect, args=(index,)) for index in range(N_CLIENTS)]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=60)
+            assert not thread.is_alive()
+    finally:
+        server.close()
+    assert not server.thread.is_alive()
+
+    assert sum(server_network.batch_sizes) == N_CLIENTS * N_REQUESTS
+    assert max(server_network.batch_sizes) > 1
+    for index in range(N_CLIENTS):
+        for request in range(N_REQUESTS):
+            expected = inferer.infer_network(img_inputs[index, request], float_inputs[index, request], tau=inferer.fixed_tau)
+            np.testing.assert_allclose(answers[index, request], expected, rtol=1e-5, atol=1e-5)
+
+
+def test_clients_raise_when_the_server_fails():
+    network = FailingNetwork()
+    server = InferenceServer(network, network, None, N_CLIENTS, max_wait=0.01)
+    server.start()
+    img_inputs = np.zeros((1, config_copy.H_downsized, config_copy.W_downsized), dtype=np.uint8)
+    float_inputs = np.zeros(config_copy.float_input_dim, dtype=np.float32)
+    errors = []
+
+    def collect(index: int):
+        client = server.client(index)
+        for _ in range(2):
+            try:
+                client.infer(img_inputs, float_inputs)
+            except RuntimeError as error:
+                errors.append(error)
+
+    threads = [threading.Thread(target=collect, args=(index,)) for index in range(N_CLIENTS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=60)
+        assert not thread.is_alive()
+    server.close()
+
+    assert server.failed.is_set()
+    assert len(errors) == 2 * N_CLIENTS
+    assert all("inference server has failed" in str(error) for error in errors)
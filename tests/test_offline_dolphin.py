@@ -0,0 +1,150 @@
+"""
+Runs the memory readers, MKW_Interface and the game instance hook against the offline_dolphin stand-in.
+
+MEM1 is a synthetic image in which every word holds its own address, so that every pointer chain resolves to a valid object
+and every field reads a distinct value. Only the fields read as enums are then given valid values.
+"""
+
+import socket
+import threading
+import time
+from multiprocessing.connection import Client
+
+import numpy as np
+import pytest
+
+from MKW_rl.MKW_interaction import offline_dolphin
+
+offline_dolphin.install()
+
+from config_files import config_copy  # noqa: E402
+from MKW_rl.MKW_interaction.MKW_interface import MKW_Interface  # noqa: E402
+from MKW_rl.MKW_interaction.MKW_protocol import (  # noqa: E402
+    LOAD_STATE_REPLY,
+    Command,
+    check_hello_reply,
+    pack_request,
+)
+from MKW_rl.MKW_interaction.MKW_savestates import RACE_START  # noqa: E402
+from MKW_rl.MKW_interaction.MKW_snapshot import GameStateSnapshot  # noqa: E402
+from mkw_scripts.Modules.mkw_classes import clear_chain_cache, quatf, vec3  # noqa: E402
+from mkw_scripts.Modules.mkw_classes.common import read_bytes, read_bytes_by_word  # noqa: E402
+
+memory = offline_dolphin.memory
+
+SCRATCH_ADDRESS = 0x80100000  # Far from the objects of the race, for the reader tests
+SAVESTATE_SLOT = 0
+FRAME_WIDTH, FRAME_HEIGHT = 64, 48  # Small frames, so that replies fit in the socket buffers
+
+
+def make_synthetic_memory():
+    memory.mem1[:] = np.arange(0x80000000, 0x80000000 + memory.MEM1_SIZE, 4, dtype=np.int64).astype(">u4").tobytes()
+    memory.mem2[:] = bytes(memory.MEM2_SIZE)
+    interface = MKW_Interface()
+    # Enum values are written until the objects they belong to stop moving, in case a write lands on a pointer
+    for _ in range(8):
+        clear_chain_cache()
+        interface.initialize_race_objects()
+        enum_fields = [(interface.race_mgr.addr + 0x28, 2), (interface.kart_move.addr + 0x23C, 0)]  # RaceState.RACE, FORWARDS
+        if all(memory.read_u32(address) == value for address, value in enum_fields):
+            break
+        for address, value in enum_fields:
+            memory.write_u32(address, value)
+    else:
+        raise RuntimeError("The synthetic race objects did not settle")
+    clear_chain_cache()
+    offline_dolphin.savestate.save_to_slot(SAVESTATE_SLOT)
+
+
+@pytest.fixture(scope="module")
+def interface():
+    make_synthetic_memory()
+    interface = MKW_Interface()
+    interface.initialize_race_objects()
+    return interface
+
+
+def test_block_readers_match_word_reads(interface):
+    values = [0.5 * i - 3.25 for i in range(16)]
+    for i, value in enumerate(values):
+        memory.write_f32(SCRATCH_ADDRESS + 4 * i, value)
+    assert vec3.read(SCRATCH_ADDRESS) == vec3(*values[:3])
+    assert quatf.read(SCRATCH_ADDRESS + 4) == quatf(*values[1:5])
+    for size in (1, 3, 4, 12, 37, 64):
+        assert bytes(read_bytes(SCRATCH_ADDRESS + 2, size)) == bytes(read_bytes_by_word(SCRATCH_ADDRESS + 2, size))
+
+
+def test_snapshot_matches_getters(interface):
+    game_data = interface.get_game_data_object()
+    assert game_data == interface.get_game_data_object_by_field()
+    assert game_data["race_data"]["state"] == 2
+    assert game_data["kart_data"]["speed"] != 0
+
+
+def test_snapshot_is_read_again_every_frame(interface):
+    speed_address = interface.vehicle_physics.addr + 0xE0
+    memory.write_f32(speed_address, 87.5)
+    assert interface.get_game_data_object()["kart_data"]["speed"] == 87.5
+    assert interface.get_game_data_object() == interface.get_game_data_object_by_field()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture(scope="module")
+def hook_connection(interface):
+    # The hook listens on base_tmi_port when it is imported, and blocks until the game manager connects
+    config_copy.base_tmi_port = free_port()
+    connections = []
+
+    def connect():
+        while True:
+            try:
+                connections.append(Client(("127.0.0.1", config_copy.base_tmi_port)))
+                return
+            except ConnectionRefusedError:
+                time.sleep(0.01)
+
+    thread = threading.Thread(target=connect, daemon=True)
+    thread.start()
+    from MKW_rl.MKW_interaction import game_instance_hook  # noqa: F401
+
+    thread.join()
+    connection = connections[0]
+    yield connection
+    connection.close()
+
+
+def run_frame(frame: bytes, frames: int = 1):
+    offline_dolphin.run(frames, FRAME_WIDTH, FRAME_HEIGHT, frame_source=lambda frame_index: frame)
+
+
+def test_hook_request_loop(interface, hook_connection):
+    snapshot = GameStateSnapshot()
+    frames = [bytes([i]) * (FRAME_WIDTH * FRAME_HEIGHT * 3) for i in range(1, 4)]
+
+    hook_connection.send_bytes(pack_request(Command.HELLO))
+    hook_connection.send_bytes(pack_request(Command.LOAD_STATE, savestate_path=f"__slot__{SAVESTATE_SLOT}"))
+    run_frame(frames[0])
+    check_hello_reply(hook_connection.recv_bytes(), snapshot)
+    assert LOAD_STATE_REPLY.unpack(hook_connection.recv_bytes()) == (RACE_START,)
+
+    expected = interface.get_game_data_object_by_field()
+    for i, frame in enumerate(frames):
+        inputs = {"A": True, "StickX": i / 4}
+        hook_connection.send_bytes(pack_request(Command.STEP, frame_request=True, game_data_request=True, inputs=inputs))
+        run_frame(frame)
+        assert hook_connection.recv_bytes() == frame
+        assert snapshot.to_game_data(snapshot.from_bytes(hook_connection.recv_bytes())) == expected
+        buttons = offline_dolphin.controller.get_gc_buttons(0)
+        assert buttons["A"] and buttons["StickX"] == inputs["StickX"]
+
+    # The hook keeps the inputs for hold_frames frames, and answers for the frame after them
+    hook_connection.send_bytes(pack_request(Command.STEP, frame_request=True, hold_frames=2))
+    run_frame(frames[0], frames=2)
+    assert not hook_connection.poll(0.1)
+    run_frame(frames[1])
+    assert hook_connection.recv_bytes() == frames[1]